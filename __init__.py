@@ -1,6 +1,12 @@
 # -*- coding: utf-8 -*-
 from .comfy_nodes.callback_nodes import KLCallbackVdImg
 from .comfy_nodes.misc_nodes import PromptIdFetcher
+from .comfy_nodes.server_routes import KLServerRoutes
+
+# 恢复上次进程未投递成功的回调
+KLCallbackVdImg.resume_persisted_results()
+# 在ComfyUI服务上注册/klnodes/metrics等接口
+KLServerRoutes.register()
 
 NODE_CLASS_MAPPINGS = {
     "singleVideoImgCallback": KLCallbackVdImg,
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+基准测试公共工具：本地回环HTTP服务、内存统计和结果输出。
+在仓库根目录下以 python -m benchmarks.<name> 方式运行。
+"""
+import importlib.util
+import json
+import os
+import platform
+import resource
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class DiscardHandler(BaseHTTPRequestHandler):
+    """
+    按块读取并丢弃请求体，回复200
+    """
+    protocol_version = 'HTTP/1.1'
+    READ_SIZE = 64 * 1024
+
+    def do_POST(self):
+        remaining = int(self.headers.get('Content-Length', 0))
+        while remaining > 0:
+            data = self.rfile.read(min(self.READ_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class LoopbackServer:
+    """
+    在后台线程中运行的本地HTTP服务，用法：
+        with LoopbackServer() as server:
+            requests.post(server.url, ...)
+    """
+
+    def __init__(self, handler=DiscardHandler):
+        self.__server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.__server.daemon_threads = True
+        self.__thread = threading.Thread(target=self.__server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return 'http://127.0.0.1:{}/'.format(self.__server.server_address[1])
+
+    def __enter__(self) -> 'LoopbackServer':
+        self.__thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.__server.shutdown()
+        self.__server.server_close()
+
+
+def peak_rss_kb() -> int:
+    """
+    :return: 当前进程的峰值常驻内存（KB）
+    """
+    value = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS返回字节，Linux返回KB
+    return value // 1024 if sys.platform == 'darwin' else value
+
+
+def time_call(func, repeat: int = 5, *args, **kwargs) -> dict:
+    """
+    多次调用并统计耗时
+    :return: {'min': 秒, 'median': 秒, 'repeat': 次数}
+    """
+    durations = []
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        durations.append(time.perf_counter() - start)
+
+    durations.sort()
+    return {'min': durations[0], 'median': durations[len(durations) // 2], 'repeat': len(durations)}
+
+
+def emit(benchmark: str, results: list, output: str = ''):
+    """
+    输出机器可读的结果（JSON），output为空时打印到标准输出
+    """
+    document = {
+        'benchmark': benchmark,
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    text = json.dumps(document, indent=2, ensure_ascii=False)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+def load_node_pack(package_name: str = 'klnodes'):
+    """
+    把仓库根目录作为ComfyUI自定义节点包导入（comfy_nodes使用相对导入，不能作为顶层包导入）
+    :return: 节点包模块
+    """
+    if package_name in sys.modules:
+        return sys.modules[package_name]
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    spec = importlib.util.spec_from_file_location(
+        package_name, os.path.join(root, '__init__.py'), submodule_search_locations=[root]
+    )
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[package_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_sparse_file(path: str, size: int):
+    """
+    快速生成指定大小的文件（稀疏文件，读取时全为0）
+    """
+    with open(path, 'wb') as f:
+        f.truncate(size)
+    os.utime(path)
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+文件摘要吞吐量基准：原来的实现（每个算法各读一遍文件，4096字节一块）对比FileHasher的单次读取多摘要，
+以及hashlib.file_digest、blake2b、xxhash（已安装时）和线程池并发计算多个文件。
+
+文件先读一遍进入页缓存，测的是CPU和拷贝开销，不是磁盘速度：
+
+    python -m benchmarks.bench_file_hash --size-mb 256 --files 8 --output hash.json
+"""
+import argparse
+import hashlib
+import os
+import tempfile
+
+from ._common import emit, time_call
+
+LEGACY_CHUNK_BYTES = 4096
+
+
+def legacy_hash(path: str, algorithm: str) -> str:
+    """
+    原来的FileUtil.get_file_hash_sha1 / get_file_hash_md5
+    """
+    hash_obj = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(LEGACY_CHUNK_BYTES)
+            if not data:
+                break
+            hash_obj.update(data)
+    return hash_obj.hexdigest()
+
+
+def file_digest(path: str, algorithm: str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, algorithm).hexdigest()
+
+
+def make_file(path: str, size_mb: int):
+    block = os.urandom(1024 * 1024)
+    with open(path, 'wb') as f:
+        for _ in range(size_mb):
+            f.write(block)
+    # 预热页缓存
+    legacy_hash(path, 'md5')
+
+
+def throughput(name: str, func, repeat: int, total_mb: float, **params) -> dict:
+    timing = time_call(func, repeat)
+    timing.update({
+        'name': name,
+        'mb_per_second': total_mb / timing['median'] if timing['median'] > 0 else 0,
+        'params': dict(params, total_mb=total_mb),
+    })
+    return timing
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=int, default=128, help='size of the single-file cases')
+    parser.add_argument('--files', type=int, default=8, help='number of files in the multi-file cases')
+    parser.add_argument('--file-size-mb', type=int, default=32, help='size of each file in the multi-file cases')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default='', help='write JSON results to this file')
+    args = parser.parse_args()
+
+    from klutils.file_hasher import FileHasher
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'single.bin')
+        make_file(path, args.size_mb)
+        size = args.size_mb
+
+        expected = {algorithm: legacy_hash(path, algorithm) for algorithm in ('sha1', 'md5')}
+        assert FileHasher.hash_file(path, ('sha1', 'md5')) == expected
+
+        # sha1 + md5：原来要读两遍
+        results.append(throughput(
+            'single.legacy.sha1+md5', lambda: [legacy_hash(path, algorithm) for algorithm in ('sha1', 'md5')],
+            args.repeat, size, method='legacy', algorithms='sha1+md5'))
+        results.append(throughput(
+            'single.hasher.sha1+md5', lambda: FileHasher.hash_file(path, ('sha1', 'md5')),
+            args.repeat, size, method='hasher', algorithms='sha1+md5'))
+
+        # 单个算法
+        for algorithm in ('sha1', 'md5'):
+            results.append(throughput(
+                'single.legacy.{}'.format(algorithm), lambda: legacy_hash(path, algorithm),
+                args.repeat, size, method='legacy', algorithms=algorithm))
+            results.append(throughput(
+                'single.hasher.{}'.format(algorithm), lambda: FileHasher.hash_file(path, (algorithm,)),
+                args.repeat, size, method='hasher', algorithms=algorithm))
+            if hasattr(hashlib, 'file_digest'):
+                results.append(throughput(
+                    'single.file_digest.{}'.format(algorithm), lambda: file_digest(path, algorithm),
+                    args.repeat, size, method='file_digest', algorithms=algorithm))
+
+        # 更快的摘要
+        fast_algorithms = ['blake2b', 'blake2s']
+        if 'xxh3_64' in FileHasher.available_algorithms():
+            fast_algorithms.extend(['xxh3_64', 'xxh64'])
+        for algorithm in fast_algorithms:
+            results.append(throughput(
+                'single.hasher.{}'.format(algorithm), lambda: FileHasher.hash_file(path, (algorithm,)),
+                args.repeat, size, method='hasher', algorithms=algorithm))
+        os.remove(path)
+
+        # 多个文件：顺序 vs 线程池
+        paths = []
+        for index in range(args.files):
+            paths.append(os.path.join(tmp_dir, 'multi-{}.bin'.format(index)))
+            make_file(paths[-1], args.file_size_mb)
+        total = args.files * args.file_size_mb
+
+        results.append(throughput(
+            'multi.legacy.sha1+md5', lambda: [legacy_hash(p, a) for p in paths for a in ('sha1', 'md5')],
+            args.repeat, total, method='legacy', algorithms='sha1+md5', files=args.files, workers=1))
+        for workers in sorted({1, args.workers}):
+            results.append(throughput(
+                'multi.hasher.sha1+md5.w{}'.format(workers),
+                lambda: FileHasher.hash_files(paths, ('sha1', 'md5'), max_workers=workers),
+                args.repeat, total, method='hasher', algorithms='sha1+md5', files=args.files, workers=workers))
+
+    emit('file_hash', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
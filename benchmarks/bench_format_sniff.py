@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+格式判断基准：FormatSniffer（只读64字节文件头）对比原来的 imghdr + Pillow 回退路径。
+图片用Pillow生成，视频只合成各容器的文件头（后面填充随机数据），两种方法都只看文件头，结果可比。
+
+    python -m benchmarks.bench_format_sniff --output sniff.json
+"""
+import argparse
+import os
+import struct
+import tempfile
+import warnings
+
+from ._common import emit, time_call
+
+IMAGE_FORMATS = ('JPEG', 'PNG', 'WEBP', 'GIF', 'BMP')
+LOOPS = 200
+
+
+def make_video_headers() -> dict:
+    """
+    :return: 格式 -> 文件头
+    """
+    ebml = b'\x1a\x45\xdf\xa3\x9f\x42\x86\x81\x01\x42\xf7\x81\x01\x42\xf2\x81\x04\x42\xf3\x81\x08\x42\x82'
+    return {
+        'MP4': struct.pack('>I', 32) + b'ftypisom' + b'\x00\x00\x02\x00' + b'isomiso2avc1mp41',
+        'MOV': struct.pack('>I', 20) + b'ftypqt  ' + b'\x20\x05\x03\x00' + b'qt  ',
+        'WEBM': ebml + b'\x84webm' + b'\x42\x87\x81\x04\x42\x85\x81\x02',
+        'MKV': ebml + b'\x88matroska' + b'\x42\x87\x81\x04\x42\x85\x81\x02',
+        'AVI': b'RIFF' + struct.pack('<I', 1024 * 1024) + b'AVI LIST',
+    }
+
+
+def make_fixtures(tmp_dir: str) -> dict:
+    from PIL import Image
+
+    fixtures = {}
+    image = Image.effect_noise((1024, 1024), 64).convert('RGB')
+    for image_format in IMAGE_FORMATS:
+        path = os.path.join(tmp_dir, 'sample.{}'.format(image_format.lower()))
+        image.save(path, image_format)
+        fixtures[image_format] = path
+
+    for video_format, header in make_video_headers().items():
+        path = os.path.join(tmp_dir, 'sample-{}.bin'.format(video_format.lower()))
+        with open(path, 'wb') as f:
+            f.write(header + os.urandom(1024 * 1024))
+        fixtures[video_format] = path
+
+    return fixtures
+
+
+def legacy_detect(path: str) -> str:
+    """
+    原来的做法：imghdr读文件头，识别不了再用Pillow打开
+    """
+    from PIL import Image
+
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', DeprecationWarning)
+            import imghdr
+        real_format = imghdr.what(path)
+    except ImportError:
+        real_format = None
+    if real_format:
+        return real_format.upper()
+
+    try:
+        with Image.open(path) as img:
+            return img.format or ''
+    except Exception:
+        return ''
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default='', help='write JSON results to this file')
+    args = parser.parse_args()
+
+    from klutils.format_sniffer import FormatSniffer
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for expected, path in make_fixtures(tmp_dir).items():
+            for method, func in (('legacy', legacy_detect), ('sniff', FormatSniffer.sniff_file)):
+                def run():
+                    for _ in range(LOOPS):
+                        func(path)
+
+                timing = time_call(run, args.repeat)
+                timing = {key: value / LOOPS if key in ('min', 'median') else value for key, value in timing.items()}
+                timing.update({
+                    'name': 'detect.{}.{}'.format(method, expected.lower()),
+                    'params': {'method': method, 'expected': expected, 'detected': func(path), 'loops': LOOPS},
+                })
+                results.append(timing)
+
+    emit('format_sniff', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+节点包导入耗时基准：在子进程中用 python -X importtime 导入仓库根目录的__init__.py（与ComfyUI加载自定义节点相同），
+统计导入总耗时，以及requests / PIL / coloredlogs等重依赖是否在导入阶段就被加载。
+
+子进程中先导入ComfyUI本身已经加载的模块（aiohttp），只统计节点包自己带来的开销。
+--check 时只要有重依赖在导入阶段被加载就以非0退出，可作为回归检查：
+
+    python -m benchmarks.bench_import_time --repeat 5 --check
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+from ._common import emit
+
+HEAVY_MODULES = ('requests', 'urllib3', 'PIL', 'coloredlogs', 'colorama', 'humanfriendly', 'pytz', 'dateutil')
+MARKER = 'klnodes-import-start'
+
+CHILD_CODE = '''
+import json, sys, time, types
+try:
+    import aiohttp.web
+except ImportError:
+    pass
+
+class FakeRoutes:
+    def get(self, path):
+        return lambda handler: handler
+
+server = types.ModuleType('server')
+server.PromptServer = types.SimpleNamespace(instance=types.SimpleNamespace(routes=FakeRoutes()))
+sys.modules['server'] = server
+
+from benchmarks._common import load_node_pack
+
+before = set(sys.modules)
+sys.stderr.write({marker!r} + '\\n')
+sys.stderr.flush()
+started = time.perf_counter()
+load_node_pack()
+elapsed = time.perf_counter() - started
+loaded = sorted({{name.split('.')[0] for name in set(sys.modules) - before}} & set({heavy!r}))
+print(json.dumps({{'elapsed': elapsed, 'heavy_loaded': loaded, 'modules': len(set(sys.modules) - before)}}))
+'''.format(marker=MARKER, heavy=HEAVY_MODULES)
+
+
+def parse_importtime(stderr: str) -> dict:
+    """
+    解析标记之后的 -X importtime 输出
+    :return: {'total_us': 顶层导入的累计耗时之和, 'heavy_us': 重依赖 -> 累计耗时}
+    """
+    total_us = 0
+    heavy_us = {}
+    started = False
+    for line in stderr.splitlines():
+        if line.strip() == MARKER:
+            started = True
+            continue
+        if not started or not line.startswith('import time:'):
+            continue
+
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        cumulative = int(parts[1])
+        name = parts[2].rstrip()
+        # 缩进表示被上一层导入，顶层（不缩进）的累计耗时之和就是总耗时
+        if name.startswith(' ') and not name.startswith('  '):
+            total_us += cumulative
+        module = name.strip()
+        if module in HEAVY_MODULES:
+            heavy_us[module] = max(heavy_us.get(module, 0), cumulative)
+
+    return {'total_us': total_us, 'heavy_us': heavy_us}
+
+
+def run_once() -> dict:
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CHILD_CODE],
+        capture_output=True, text=True, check=False
+    )
+    if completed.returncode != 0:
+        raise RuntimeError('import failed:\n{}'.format(completed.stderr[-4000:]))
+
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result.update(parse_importtime(completed.stderr))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--check', action='store_true', help='exit with 1 if a heavy dependency is imported eagerly')
+    parser.add_argument('--output', default='', help='write JSON results to this file')
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(max(args.repeat, 1))]
+    elapsed = sorted(run['elapsed'] for run in runs)
+    totals = sorted(run['total_us'] for run in runs)
+    heavy_loaded = runs[-1]['heavy_loaded']
+    results = [{
+        'name': 'import.node_pack',
+        'min': elapsed[0],
+        'median': elapsed[len(elapsed) // 2],
+        'repeat': len(runs),
+        'importtime_median_us': totals[len(totals) // 2],
+        'modules': runs[-1]['modules'],
+        'heavy_loaded': heavy_loaded,
+        'heavy_us': runs[-1]['heavy_us'],
+    }]
+    emit('import_time', results, args.output)
+
+    if args.check and len(heavy_loaded) > 0:
+        sys.stderr.write('heavy dependencies imported at load time: {}\n'.format(', '.join(heavy_loaded)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
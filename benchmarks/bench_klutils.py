@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+klutils热点路径的微基准，全部使用临时生成的数据离线运行：
+
+- hash：FileUtil.get_file_hash_sha1 / get_file_hash_md5，不同文件大小
+- format：PictureUtils.get_image_real_format（每次调用前清空MediaProbe缓存，测的是真正读取文件头），
+  以及缓存命中、FormatSniffer和Pillow单独判断的耗时，PNG / WEBP / BMP / JPEG
+- convert：PictureUtils.convert_pic_format，PNG / WEBP / BMP -> JPEG，不同分辨率
+- multipart：回调表单（图片 + 视频）的MultipartEncoder构建，以及发往本地回环服务的完整POST
+- time：StringUtil的时间字符串转换
+
+    python -m benchmarks.bench_klutils --output base.json
+    python -m benchmarks.bench_klutils --groups hash convert --output new.json
+    python -m benchmarks.compare base.json new.json
+
+每条结果都有唯一的name，compare按name对比两次运行的median。
+"""
+import argparse
+import os
+import tempfile
+
+from ._common import LoopbackServer, emit, time_call
+
+GROUPS = ('hash', 'format', 'convert', 'multipart', 'time')
+HASH_SIZES_KB = (64, 1024, 16 * 1024, 128 * 1024)
+IMAGE_SIZES = (512, 1024, 2048)
+IMAGE_FORMATS = ('PNG', 'WEBP', 'BMP')
+
+
+def make_image(path: str, size: int, image_format: str):
+    """
+    生成带噪声的图片，避免纯色图片的编码速度失真
+    """
+    from PIL import Image
+
+    noise = Image.effect_noise((size, size), 64).convert('RGB')
+    gradient = Image.linear_gradient('L').resize((size, size)).convert('RGB')
+    Image.blend(noise, gradient, 0.5).save(path, image_format)
+
+
+def result(name: str, timing: dict, **params) -> dict:
+    timing = dict(timing)
+    timing.update({'name': name, 'params': params})
+    return timing
+
+
+def bench_hash(tmp_dir: str, repeat: int) -> list:
+    from klutils.file_util import FileUtil
+
+    results = []
+    for size_kb in HASH_SIZES_KB:
+        path = os.path.join(tmp_dir, 'hash-{}.bin'.format(size_kb))
+        with open(path, 'wb') as f:
+            f.write(os.urandom(size_kb * 1024))
+
+        for algorithm, func in (('sha1', FileUtil.get_file_hash_sha1), ('md5', FileUtil.get_file_hash_md5)):
+            timing = time_call(func, repeat, path)
+            timing['mb_per_second'] = size_kb / 1024 / timing['median'] if timing['median'] > 0 else 0
+            results.append(result('hash.{}.{}kb'.format(algorithm, size_kb), timing,
+                                  algorithm=algorithm, size_kb=size_kb))
+        os.remove(path)
+
+    return results
+
+
+def bench_format(tmp_dir: str, repeat: int) -> list:
+    from klutils.format_sniffer import FormatSniffer
+    from klutils.media_probe import MediaProbe
+    from klutils.picture_util import PictureUtils
+
+    def detect_uncached(file_path: str) -> str:
+        # 清空缓存，否则除第一次外测到的都是缓存命中
+        MediaProbe.clear()
+        return PictureUtils.get_image_real_format(file_path)
+
+    results = []
+    for image_format in IMAGE_FORMATS + ('JPEG',):
+        path = os.path.join(tmp_dir, 'format.{}'.format(image_format.lower()))
+        make_image(path, 1024, image_format)
+        name = image_format.lower()
+        results.append(result('format.{}'.format(name), time_call(detect_uncached, repeat * 20, path),
+                              format=image_format, detected=detect_uncached(path)))
+        results.append(result('format.{}.cached'.format(name),
+                              time_call(PictureUtils.get_image_real_format, repeat * 20, path),
+                              format=image_format))
+        results.append(result('format.{}.sniffer'.format(name),
+                              time_call(FormatSniffer.sniff_file, repeat * 20, path),
+                              format=image_format, detected=FormatSniffer.sniff_file(path)))
+        results.append(result('format.{}.pillow'.format(name),
+                              time_call(PictureUtils.get_image_real_format_with_pillow, repeat * 20, path),
+                              format=image_format, detected=PictureUtils.get_image_real_format_with_pillow(path)))
+
+    MediaProbe.clear()
+    return results
+
+
+def bench_convert(tmp_dir: str, repeat: int) -> list:
+    from klutils.picture_util import PictureUtils
+
+    results = []
+    for size in IMAGE_SIZES:
+        for image_format in IMAGE_FORMATS:
+            src_path = os.path.join(tmp_dir, 'convert-{}.{}'.format(size, image_format.lower()))
+            output_path = os.path.join(tmp_dir, 'convert-{}-{}.jpg'.format(size, image_format.lower()))
+            make_image(src_path, size, image_format)
+            results.append(result(
+                'convert.{}_to_jpeg.{}'.format(image_format.lower(), size),
+                time_call(PictureUtils.convert_pic_format, repeat, src_path, output_path, PictureUtils.IMG_FORMAT_JPEG),
+                format=image_format, size=size,
+                succeed=PictureUtils.convert_pic_format(src_path, output_path, PictureUtils.IMG_FORMAT_JPEG)
+            ))
+
+    return results
+
+
+def bench_multipart(tmp_dir: str, repeat: int) -> list:
+    from klutils.http_util import HttpSessionPool
+    from klutils.multipart_util import MultipartEncoder
+
+    image_path = os.path.join(tmp_dir, 'multipart.jpg')
+    make_image(image_path, 1024, 'JPEG')
+
+    results = []
+    for video_mb in (1, 16, 64):
+        video_path = os.path.join(tmp_dir, 'multipart-{}.mp4'.format(video_mb))
+        with open(video_path, 'wb') as f:
+            f.write(os.urandom(video_mb * 1024 * 1024))
+        fields = {'promptId': 'bench', 'errCode': '0', 'errMsg': ''}
+        files = {
+            'image': ('multipart.jpg', image_path, 'image/jpeg'),
+            'video': ('multipart.mp4', video_path, 'video/*'),
+        }
+
+        def build():
+            encoder = MultipartEncoder(fields=fields, files=files)
+            while encoder.read(encoder.chunk_size):
+                pass
+            encoder.close()
+
+        results.append(result('multipart.build.{}mb'.format(video_mb), time_call(build, repeat), video_mb=video_mb))
+
+        with LoopbackServer() as server:
+            def post():
+                encoder = MultipartEncoder(fields=fields, files=files)
+                response = HttpSessionPool.post(server.url, data=encoder,
+                                                headers={'Content-Type': encoder.content_type}, timeout=600)
+                encoder.close()
+                assert response.status_code == 200
+
+            results.append(result('multipart.post.{}mb'.format(video_mb), time_call(post, repeat),
+                                  video_mb=video_mb))
+        os.remove(video_path)
+
+    return results
+
+
+def bench_time(tmp_dir: str, repeat: int) -> list:
+    from klutils.string_util import StringUtil
+
+    cases = (
+        ('time.convert_time_str_to_seconds', StringUtil.convert_time_str_to_seconds, ('12:34:56',)),
+        ('time.standard_readable_date_str', StringUtil.standard_readable_date_str,
+         ('September 16, 2022 at 6:38 pm',)),
+        ('time.convert_with_timezone', StringUtil.convert_with_timezone, ('2024-01-03 12:14:08+00:00', 8)),
+        ('time.convert_hour_minute_with_timezone', StringUtil.convert_hour_minute_with_timezone,
+         ('2024-01-03 12:14:08+00:00', 8)),
+        ('time.convert_timestamp_to_str', StringUtil.convert_timestamp_to_str, (1704284048000,)),
+        ('time.convert_time_str_by_zone', StringUtil.convert_time_str_by_zone, ('2024-01-03 12:14:08', -5)),
+        ('time.convert_to_utc8', StringUtil.convert_to_utc8, ('2024-01-03 12:14:08', -5)),
+    )
+    # 单次调用只有微秒级，每次计时循环多次调用
+    loops = 1000
+
+    results = []
+    for name, func, args in cases:
+        def run():
+            for _ in range(loops):
+                func(*args)
+
+        timing = time_call(run, repeat)
+        timing = {key: value / loops if key in ('min', 'median') else value for key, value in timing.items()}
+        timing['loops'] = loops
+        results.append(result(name, timing))
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--groups', nargs='+', default=list(GROUPS), choices=GROUPS)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default='', help='write JSON results to this file')
+    args = parser.parse_args()
+
+    runners = {
+        'hash': bench_hash, 'format': bench_format, 'convert': bench_convert,
+        'multipart': bench_multipart, 'time': bench_time,
+    }
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for group in args.groups:
+            for item in runners[group](tmp_dir, args.repeat):
+                item['group'] = group
+                results.append(item)
+
+    emit('klutils', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+回调上传的内存基准：对比 requests files= 整体编码、流式MultipartEncoder 和 sendfile 三种方式，
+视频越大时峰值RSS的增长情况。每个用例在独立子进程中运行，保证峰值RSS互不影响。
+
+    python -m benchmarks.bench_multipart_memory --sizes 16 64 256 --output memory.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from ._common import LoopbackServer, emit, make_sparse_file, peak_rss_kb
+
+MODES = ('files', 'stream', 'sendfile')
+
+
+def run_child(mode: str, video_path: str) -> dict:
+    import requests
+    from klutils.multipart_util import MultipartEncoder
+
+    with LoopbackServer() as server:
+        before = peak_rss_kb()
+        if mode == 'files':
+            with open(video_path, 'rb') as f:
+                response = requests.post(
+                    server.url, data={'promptId': 'bench'},
+                    files={'video': (os.path.basename(video_path), f, 'video/*')}, timeout=600
+                )
+        else:
+            encoder = MultipartEncoder(
+                fields={'promptId': 'bench'},
+                files={'video': (os.path.basename(video_path), video_path, 'video/*')}
+            )
+            if mode == 'sendfile':
+                response = MultipartEncoder.post_with_sendfile(server.url, encoder, timeout=600)
+            else:
+                response = requests.post(server.url, data=encoder,
+                                         headers={'Content-Type': encoder.content_type}, timeout=600)
+            encoder.close()
+        after = peak_rss_kb()
+
+    return {'status': response.status_code, 'peak_rss_delta_kb': after - before, 'peak_rss_kb': after}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[16, 64, 256], help='video sizes in MB')
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=MODES)
+    parser.add_argument('--output', default='', help='write JSON results to this file')
+    parser.add_argument('--child', nargs=2, metavar=('MODE', 'PATH'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args.child[0], args.child[1])))
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size_mb in args.sizes:
+            video_path = os.path.join(tmp_dir, 'video-{}.mp4'.format(size_mb))
+            make_sparse_file(video_path, size_mb * 1024 * 1024)
+            for mode in args.modes:
+                output = subprocess.check_output(
+                    [sys.executable, '-m', 'benchmarks.bench_multipart_memory', '--child', mode, video_path]
+                )
+                result = json.loads(output.decode().strip().splitlines()[-1])
+                result.update({'mode': mode, 'video_mb': size_mb})
+                results.append(result)
+            os.remove(video_path)
+
+    emit('multipart_memory', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+对比两次基准运行的结果（emit输出的JSON），按name匹配，比较median耗时：
+
+    python -m benchmarks.compare base.json new.json --threshold 0.15
+
+变慢超过threshold的条目标记为REGRESSION，存在回归时退出码为1，便于在CI中使用。
+"""
+import argparse
+import json
+import sys
+
+
+def load_results(path: str) -> dict:
+    with open(path, 'r', encoding='utf-8') as f:
+        document = json.load(f)
+    return {item['name']: item for item in document.get('results', []) if 'name' in item and 'median' in item}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('base')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=0.15, help='relative slowdown treated as regression')
+    args = parser.parse_args()
+
+    base = load_results(args.base)
+    new = load_results(args.new)
+
+    regressions = 0
+    print('{:<48} {:>12} {:>12} {:>8}'.format('name', 'base(ms)', 'new(ms)', 'change'))
+    for name in sorted(set(base) | set(new)):
+        if name not in base or name not in new:
+            print('{:<48} {}'.format(name, 'only in new' if name in new else 'only in base'))
+            continue
+
+        before, after = base[name]['median'], new[name]['median']
+        change = (after - before) / before if before > 0 else 0.0
+        flag = ''
+        if change > args.threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        print('{:<48} {:>12.4f} {:>12.4f} {:>+7.1%}{}'.format(name, before * 1000, after * 1000, change, flag))
+
+    sys.exit(1 if regressions > 0 else 0)
+
+
+if __name__ == '__main__':
+    main()
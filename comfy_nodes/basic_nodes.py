@@ -4,8 +4,6 @@ import os
 import socket
 import sys
 
-import requests
-
 from ..klutils.klLog import Log
 from ..klutils.string_util import StringUtil
 
@@ -1,15 +1,30 @@
 # -*- coding: utf-8 -*-
+import functools
+import json
 import os
+import threading
 import time
-from typing import Optional, Tuple
-
-import requests
+from typing import Callable, List, Optional, Tuple, Union
 
+from ..klutils.callback_outbox import CallbackOutbox, CallbackOutboxScheduler
+from ..klutils.chunked_upload import ChunkedUploader
+from ..klutils.circuit_breaker import CircuitBreaker
+from ..klutils.dedup_util import ContentDedup
+from ..klutils.delivery_queue import CallbackDeliveryQueue
 from ..klutils.picture_util import PictureUtils
 from ..klutils.file_util import FileUtil
+from ..klutils.format_sniffer import FormatSniffer
+from ..klutils.http_util import HttpSessionPool
+from ..klutils.multipart_util import MultipartEncoder
+from ..klutils.file_share import FileShare
 from ..klutils.klLog import Log
+from ..klutils.media_probe import MediaProbe
+from ..klutils.metrics import Metrics
 from ..klutils.string_util import StringUtil
+from ..klutils.upload_limiter import UploadLimiter
 from .basic_nodes import KLBasicNode
+from .misc_nodes import PromptIdFetcher
+from .server_routes import KLServerRoutes
 
 
 class KLCallbackVdImg(KLBasicNode):
@@ -26,6 +41,27 @@ class KLCallbackVdImg(KLBasicNode):
     CATEGORY = "KLNodes/WorkflowCallback"
     OUTPUT_NODE = True  # 设置这个节点为输出节点，每次都会执行
 
+    DELIVERY_SYNC = 'sync'
+    DELIVERY_BACKGROUND = 'background'
+
+    UPLOAD_FORM = 'form'
+    UPLOAD_CHUNKED = 'chunked'
+    UPLOAD_REFERENCE = 'reference'
+
+    ASSET_SUCCEED = 'succeed'
+    ASSET_FAILED = 'failed'
+    ASSET_MISSING = 'missing'
+
+    # 可以重试恢复的错误代码，按严重程度排序；批量回调部分失败时上报其中最严重的一个，发件箱据此继续重试
+    TRANSIENT_ERROR_CODES = ('CIRCUIT_OPEN', 'TIMEOUT', 'CONNECTION_ERROR', 'GATEWAY_TIMEOUT', 'SERVICE_UNAVAILABLE',
+                             'BAD_GATEWAY', 'SERVER_ERROR', 'TOO_MANY_REQUESTS', 'REQUEST_ERROR', 'UNKNOWN_ERROR')
+
+    # RESULT_CODE：0 成功；1 已入队后台投递（RESULT_TXT为投递句柄）；2 参数错误；-1 失败
+    RESULT_CODE_QUEUED = 1
+
+    __outbox_scheduler__ = None
+    __outbox_lock__ = threading.Lock()
+
     @classmethod
     def INPUT_TYPES(cls):
         inputs = {
@@ -39,6 +75,27 @@ class KLCallbackVdImg(KLBasicNode):
                 # "random_seed": ("INT", {"default": 0, "min": 0, "max": 0xffffffffffffffff}),
             },
 
+            "optional": {
+                # sync: 在执行线程中直接回调；background: 入队后立即返回，由后台线程上传
+                "delivery_mode": ([cls.DELIVERY_SYNC, cls.DELIVERY_BACKGROUND], {"default": cls.DELIVERY_SYNC}),
+                # 先把回调记录到本地发件箱，进程重启或重试耗尽后仍会重新投递
+                "persist_result": ("BOOLEAN", {"default": False}),
+                # form: 一次性表单上传；chunked: 分片上传，失败重试时从接收端已确认的分片继续；
+                # reference: 只发送带签名、会过期的下载地址，由接收端从本机ComfyUI拉取文件（支持Range）
+                "upload_mode": ([cls.UPLOAD_FORM, cls.UPLOAD_CHUNKED, cls.UPLOAD_REFERENCE],
+                                {"default": cls.UPLOAD_FORM}),
+                # 批量模式：image / video 为列表时全部回调，RESULT_TXT为各素材状态的JSON
+                "batch_mode": ("BOOLEAN", {"default": False}),
+                # 批量模式下单个请求的最大字节数，超过则拆成多个请求；0表示全部放在一个请求中
+                "max_batch_bytes": ("INT", {"default": 0, "min": 0, "max": 0x7fffffffffffffff}),
+                # 图片预算：长边最大像素、最大字节数、JPEG质量（设置了最大字节数时为质量上限），0为不限制
+                "image_max_dimension": ("INT", {"default": 0, "min": 0, "max": 16384}),
+                "image_max_bytes": ("INT", {"default": 0, "min": 0, "max": 0x7fffffff}),
+                "image_quality": ("INT", {"default": 0, "min": 0, "max": 100}),
+                # 上传前按内容哈希询问接收端，已持有的文件只发送引用
+                "dedup_upload": ("BOOLEAN", {"default": False}),
+            },
+
             "hidden": {
                 "unique_id": "UNIQUE_ID",
                 "extra_pnginfo": "EXTRA_PNGINFO",  # 添加这个
@@ -53,17 +110,30 @@ class KLCallbackVdImg(KLBasicNode):
         # Fixme
         self.set_all_log(False)
 
+    @Log.contextual(node=__name__, phase='commit')
     def commit_result(self, callback_url: str, video: str, image: str, prompt_id: str,
-                      extra_pnginfo=None, unique_id=None, *args, **kwargs) -> tuple:
+                      delivery_mode: str = DELIVERY_SYNC, persist_result: bool = False,
+                      upload_mode: str = UPLOAD_FORM, batch_mode: bool = False, max_batch_bytes: int = 0,
+                      image_max_dimension: int = 0, image_max_bytes: int = 0, image_quality: int = 0,
+                      dedup_upload: bool = False, extra_pnginfo=None, unique_id=None, *args, **kwargs) -> tuple:
         """
         回调
         :param callback_url: 回调地址
         :param video: 视频文件路径
         :param image: 图片文件路径
         :param prompt_id:
+        :param delivery_mode: 投递方式，sync / background
+        :param persist_result: 是否先记录到本地发件箱
+        :param upload_mode: 上传方式，form / chunked / reference
+        :param batch_mode: 是否批量回调列表中的全部图片和视频
+        :param max_batch_bytes: 批量模式下单个请求的最大字节数，0为不限制
+        :param image_max_dimension: 图片长边的最大像素数，0为不限制
+        :param image_max_bytes: 图片的最大字节数，0为不限制
+        :param image_quality: 图片的JPEG质量，0为默认值
+        :param dedup_upload: 是否先按内容哈希询问接收端，已持有的文件只发送引用
         :param extra_pnginfo:
         :param unique_id:
-        :return: (err_msg, err_code, prompt id)
+        :return: (err_msg, err_code, prompt id)，后台投递时err_msg为投递句柄
         """
         if StringUtil.is_string_empty(callback_url):
             self.__logger__.error(u'callback url is empty, cannot commit generated result!')
@@ -75,6 +145,19 @@ class KLCallbackVdImg(KLBasicNode):
 
         # self.__logger__.info(u'本次prompt id：{}'.format(prompt_id))
 
+        image_budget = None
+        if image_max_dimension or image_max_bytes or image_quality:
+            image_budget = {
+                'max_dimension': image_max_dimension, 'max_bytes': image_max_bytes, 'quality': image_quality
+            }
+
+        if batch_mode is True:
+            return self.__commit_batch__(
+                callback_url=callback_url, prompt_id=prompt_id, images=image, videos=video,
+                delivery_mode=delivery_mode, persist_result=persist_result, upload_mode=upload_mode,
+                max_batch_bytes=max_batch_bytes, image_budget=image_budget, dedup=dedup_upload
+            )
+
         # 对于image和video，如果给过来的是list，那么就取第一个
         if isinstance(image, list) and len(image) > 0:
             image = image[0]
@@ -90,31 +173,182 @@ class KLCallbackVdImg(KLBasicNode):
             self.__logger__.error('image path is empty, cannot commit generated result!')
             return 'image path is empty', 2, ''
 
-        if not FileUtil.check_file_exist(video):
+        video_info = MediaProbe.probe(video)
+        if not video_info.exists:
             self.__logger__.error('video[{}] not exist, cannot commit generated result!'.format(video))
             return 'video[{}] not exist, cannot commit generated result!'.format(video), 2, prompt_id
 
-        if not FileUtil.check_file_exist(image):
+        # 按文件头校验格式，只提示不拒绝：动图（GIF / WEBP，如VideoHelperSuite的image/gif输出）可以作为视频上传
+        if FormatSniffer.is_animated_image_format(video_info.format):
+            pass
+        elif FormatSniffer.is_image_format(video_info.format):
+            self.__logger__.warning('video[{}] is a {} still image'.format(video, video_info.format))
+        elif not video_info.is_video:
+            self.__logger__.warning('video[{}] has an unrecognized container format'.format(video))
+
+        image_info = MediaProbe.probe(image)
+        if not image_info.exists:
             self.__logger__.error('tail frame image[{}] not exist!'.format(image))
+        elif not FormatSniffer.is_image_format(image_info.format):
+            self.__logger__.warning('tail frame image[{}] has an unrecognized format: {}'.format(
+                image, image_info.format or 'unknown'))
+
+        send_kwargs = dict(callback_url=callback_url, prompt_id=prompt_id, img_path=image, video_path=video,
+                           upload_mode=upload_mode, image_budget=image_budget, dedup=dedup_upload)
+
+        # 持久化：先落盘到发件箱，投递结果回写发件箱，失败的由调度器稍后重投
+        deliver = self.__send_result_to_callback__
+        if persist_result is True:
+            deliver = self.__persist_result__(**send_kwargs)
+
+        # 后台投递：入队后立即返回，不占用执行线程
+        if delivery_mode == self.DELIVERY_BACKGROUND:
+            return self.__submit_background__(deliver, send_kwargs)
 
         # commit the video and the image
-        succeed, err_code, err_msg = self.__send_result_to_callback__(
-            callback_url=callback_url, prompt_id=prompt_id, img_path=image, video_path=video
-        )
+        succeed, err_code, err_msg = deliver(**send_kwargs)
         if not succeed:
-            self.__logger__.error('failed to commit generated result: {}, {}'.format(err_code, err_msg))
+            self.__logger__.error('failed to commit generated result: {}, {}'.format(err_code, err_msg),
+                                  extra={'log_key': 'commit_failed:{}'.format(err_code)})
             return 'failed', -1, prompt_id
 
         return 'succeed', 0, prompt_id
 
+    def __commit_batch__(self, callback_url: str, prompt_id: str, images, videos, delivery_mode: str,
+                         persist_result: bool, upload_mode: str, max_batch_bytes: int,
+                         image_budget: Optional[dict] = None, dedup: bool = False) -> tuple:
+        """
+        批量回调列表中的全部图片和视频
+        :return: (各素材状态的JSON / 投递句柄, err_code, prompt id)
+        """
+        img_paths = [p for p in (images if isinstance(images, list) else [images])
+                     if not StringUtil.is_string_empty(p)]
+        video_paths = [p for p in (videos if isinstance(videos, list) else [videos])
+                       if not StringUtil.is_string_empty(p)]
+        if len(img_paths) == 0 and len(video_paths) == 0:
+            self.__logger__.error('no image or video to commit!')
+            return 'no image or video to commit', 2, prompt_id
+
+        send_kwargs = dict(callback_url=callback_url, prompt_id=prompt_id, img_paths=img_paths,
+                           video_paths=video_paths, max_batch_bytes=max_batch_bytes, upload_mode=upload_mode,
+                           image_budget=image_budget, dedup=dedup)
+
+        deliver = self.__send_batch_to_callback__
+        if persist_result is True:
+            deliver = self.__persist_result__(**send_kwargs)
+
+        if delivery_mode == self.DELIVERY_BACKGROUND:
+            return self.__submit_background__(deliver, send_kwargs)
+
+        succeed, err_code, report = deliver(**send_kwargs)
+        if not succeed:
+            self.__logger__.error('failed to commit generated results: {}, {}'.format(err_code, report),
+                                  extra={'log_key': 'commit_failed:{}'.format(err_code)})
+            return report, -1, prompt_id
+
+        return report, 0, prompt_id
+
+    def __submit_background__(self, deliver: Callable[..., Tuple[bool, str, str]], send_kwargs: dict) -> tuple:
+        handle = CallbackDeliveryQueue.get_instance().submit(deliver, **send_kwargs)
+        if StringUtil.is_string_empty(handle):
+            self.__logger__.error('failed to enqueue generated result for background delivery')
+            return 'failed', -1, send_kwargs['prompt_id']
+
+        return handle, self.RESULT_CODE_QUEUED, send_kwargs['prompt_id']
+
+    @classmethod
+    def resume_persisted_results(cls):
+        """
+        启动时如果发件箱中已有记录，则启动调度器，把上次未投递成功的结果重新投递
+        """
+        if CallbackOutbox.has_database():
+            try:
+                cls.__get_outbox_scheduler__().start()
+            except Exception as e:
+                cls.__logger__.exception('failed to resume persisted results: {}'.format(e))
+
+    @classmethod
+    def __persist_result__(cls, **send_kwargs) -> Callable[..., Tuple[bool, str, str]]:
+        """
+        把回调记录到发件箱
+        :return: 投递函数，投递结果会回写到发件箱；落盘失败时退化为直接投递
+        """
+        # 批量回调的路径列表放在options中，img_path / video_path 列记录第一个素材，便于查询
+        options = dict(send_kwargs)
+        is_batch = 'img_paths' in options
+        send = cls.__send_batch_to_callback__ if is_batch else cls.__send_result_to_callback__
+        if is_batch:
+            img_path = (options['img_paths'] or [None])[0]
+            video_path = (options['video_paths'] or [None])[0]
+        else:
+            img_path = options.pop('img_path')
+            video_path = options.pop('video_path')
+
+        try:
+            outbox = CallbackOutbox.get_instance()
+            entry_id = outbox.enqueue(
+                prompt_id=options.pop('prompt_id'), callback_url=options.pop('callback_url'),
+                img_path=img_path, video_path=video_path, options=options
+            )
+            cls.__get_outbox_scheduler__().start()
+        except Exception as e:
+            cls.__logger__.exception('failed to persist generated result, deliver without outbox: {}'.format(e))
+            return send
+
+        if is_batch:
+            # 已投递成功的子批次记录到发件箱，重投时跳过
+            send = functools.partial(send, on_progress=functools.partial(
+                cls.__record_outbox_progress__, outbox, entry_id))
+        return functools.partial(CallbackOutboxScheduler.deliver_entry, outbox, entry_id, send)
+
     @classmethod
+    def __record_outbox_progress__(cls, outbox: CallbackOutbox, entry_id: int, delivered_fields: List[str]):
+        try:
+            outbox.merge_options(entry_id, {'delivered_fields': delivered_fields})
+        except Exception as e:
+            cls.__logger__.exception('failed to record outbox entry[{}] progress: {}'.format(entry_id, e))
+
+    @classmethod
+    def __get_outbox_scheduler__(cls) -> CallbackOutboxScheduler:
+        with cls.__outbox_lock__:
+            if cls.__outbox_scheduler__ is None:
+                cls.__outbox_scheduler__ = CallbackOutboxScheduler(
+                    CallbackOutbox.get_instance(), cls.__deliver_outbox_entry__
+                )
+
+        return cls.__outbox_scheduler__
+
+    @classmethod
+    def __deliver_outbox_entry__(cls, entry: dict) -> Tuple[bool, str, str]:
+        # 发件箱自己负责重试间隔，这里每次只尝试一次
+        options = dict(entry.get('options') or {})
+        options['max_retries'] = 1
+        if 'img_paths' in options:
+            return cls.__send_batch_to_callback__(
+                callback_url=entry['callback_url'], prompt_id=entry['prompt_id'],
+                on_progress=functools.partial(cls.__record_outbox_progress__, CallbackOutbox.get_instance(),
+                                              entry['id']),
+                **options
+            )
+
+        return cls.__send_result_to_callback__(
+            callback_url=entry['callback_url'], prompt_id=entry['prompt_id'],
+            img_path=entry['img_path'], video_path=entry['video_path'], **options
+        )
+
+    @classmethod
+    @Log.contextual(node=__name__, phase='deliver')
     def __send_result_to_callback__(
             cls,
             callback_url: str,
             prompt_id: str,
             img_path: Optional[str] = None,
             video_path: Optional[str] = None,
-            max_retries: int = 3
+            max_retries: int = 3,
+            upload_mode: str = UPLOAD_FORM,
+            use_temp_file: bool = False,
+            image_budget: Optional[dict] = None,
+            dedup: bool = False
     ) -> Tuple[bool, str, str]:
         """
     向回调地址发送运算结果（使用表单形式）
@@ -125,6 +359,11 @@ class KLCallbackVdImg(KLBasicNode):
         img_path: 图片文件路径
         video_path: 视频文件路径
         max_retries: 最大重试次数，默认为3
+        upload_mode: 上传方式，form为一次性表单上传，chunked为可续传的分片上传，reference为只发送下载地址
+        use_temp_file: 图片转码结果是否写入临时文件（默认在内存中转码），临时文件在回调结束后删除；
+            reference方式下忽略，转码结果随表单直接上传
+        image_budget: 图片预算，max_dimension / max_bytes / quality
+        dedup: 是否先按内容哈希询问接收端，已持有的文件只发送引用
 
     Returns:
         Tuple[bool, str, str]: (是否成功, 错误代码, 错误信息)
@@ -135,140 +374,496 @@ class KLCallbackVdImg(KLBasicNode):
         if StringUtil.is_string_empty(prompt_id):
             return False, '-1', 'the prompt id is empty, stop commit the generated result!'
 
-        if not FileUtil.check_file_exist(img_path):
+        if not MediaProbe.probe(img_path).exists:
             return False, '-1', 'the img[{}] not exists, stop committing the generated result!'.format(img_path)
 
-        if not FileUtil.check_file_exist(video_path):
+        if not MediaProbe.probe(video_path).exists:
             return False, '-1', 'the video[{}] not exists, stop committing the generated result!'.format(video_path)
 
         if not isinstance(max_retries, int) or max_retries <= 0:
             max_retries = 3
 
         # 图片转换格式为jpg
-        tmp_pic_path = ''
+        use_temp_file = cls.__use_temp_file__(use_temp_file, upload_mode)
+        image_name, image_source, tmp_pic_path = cls.__prepare_image__(img_path, use_temp_file, image_budget)
+
+        # 准备表单数据（流式请求体，文件按块读取，不会整体读入内存）
+        form_data = {'promptId': prompt_id}
+        files_to_send = {
+            'image': (image_name, image_source, 'image/*'),
+            'video': (os.path.basename(video_path), video_path, 'video/*'),
+        }
+        upload_id = ''
+        if upload_mode == cls.UPLOAD_CHUNKED:
+            # upload id按原始文件计算（转码结果每次重新生成），保证发件箱重投时也能续传
+            upload_id = ChunkedUploader.make_upload_id(prompt_id, {
+                'image': (os.path.basename(img_path), img_path, 'image/*'),
+                'video': files_to_send['video'],
+            })
+
         try:
-            pic_real_format = PictureUtils.get_image_real_format(image_file_path=img_path)
-            if not StringUtil.is_string_empty(pic_real_format) \
-                    and pic_real_format not in [PictureUtils.IMG_FORMAT_JPEG]:
-                cls.__logger__.info(u'reformat img as jpg...')
+            return cls.__post_form_with_retries__(
+                callback_url, form_data, files_to_send, max_retries=max_retries, upload_id=upload_id,
+                dedup=dedup, by_reference=upload_mode == cls.UPLOAD_REFERENCE
+            )
+        finally:
+            cls.__remove_temp_file__(tmp_pic_path)
 
-                img_dir = os.path.split(img_path)[0]
-                tmp_pic_path = os.path.join(
-                    img_dir,
-                    '{}-{}.jpg'.format(str(time.time()), StringUtil.get_random_number_string(6))
-                )
-                if not PictureUtils.convert_pic_format(
-                        src_path=img_path,
-                        output_path=tmp_pic_path,
-                        output_format=PictureUtils.IMG_FORMAT_JPEG
-                ):
-                    # 转换失败就恢复空值，后面会改为原始图片
-                    tmp_pic_path = ''
+    @classmethod
+    @Log.contextual(node=__name__, phase='deliver')
+    def __send_batch_to_callback__(
+            cls,
+            callback_url: str,
+            prompt_id: str,
+            img_paths: List[str],
+            video_paths: List[str],
+            max_batch_bytes: int = 0,
+            max_retries: int = 3,
+            upload_mode: str = UPLOAD_FORM,
+            use_temp_file: bool = False,
+            image_budget: Optional[dict] = None,
+            dedup: bool = False,
+            delivered_fields: Optional[List[str]] = None,
+            on_progress: Optional[Callable[[List[str]], None]] = None
+    ) -> Tuple[bool, str, str]:
+        """
+        批量回调：全部图片和视频放在一个表单请求中；设置了max_batch_bytes时按大小拆成尽量少的请求。
+        文件字段名为 image_<序号> / video_<序号>，另附 batchIndex / batchCount / assetCount 字段
+        :param callback_url: 回调地址
+        :param prompt_id:
+        :param img_paths: 图片文件路径列表
+        :param video_paths: 视频文件路径列表
+        :param max_batch_bytes: 单个请求的最大字节数，0为不限制（单个素材超过上限时单独成一个请求）
+        :param max_retries: 每个请求的最大重试次数
+        :param upload_mode: 上传方式，form / chunked / reference
+        :param use_temp_file: 图片转码结果是否写入临时文件，reference方式下忽略
+        :param image_budget: 图片预算，max_dimension / max_bytes / quality
+        :param dedup: 是否先按内容哈希询问接收端，已持有的文件只发送引用
+        :param delivered_fields: 之前已投递成功的文件字段名，所含素材全部在其中的子批次不再发送
+        :param on_progress: 每个子批次投递成功后调用，参数为目前已投递成功的全部文件字段名
+        :return: (全部存在的素材是否都已投递, 错误代码, 各素材状态的JSON)；
+            部分失败时错误代码优先取可重试的错误，素材全部不存在时为'-1'
+        """
+        if StringUtil.is_string_empty(callback_url):
+            return False, '-1', 'the callback url is empty, stop commit the generated result!'
+
+        if StringUtil.is_string_empty(prompt_id):
+            return False, '-1', 'the prompt id is empty, stop commit the generated result!'
+
+        if not isinstance(max_retries, int) or max_retries <= 0:
+            max_retries = 3
+
+        assets = []
+        for asset_type, paths in (('image', img_paths or []), ('video', video_paths or [])):
+            for index, path in enumerate(paths):
+                assets.append({
+                    'type': asset_type, 'path': path, 'field': '{}_{}'.format(asset_type, index),
+                    'status': cls.ASSET_MISSING, 'code': '-1', 'msg': 'file not exists', 'batch': -1
+                })
+
+        delivered = list(delivered_fields or [])
+        use_temp_file = cls.__use_temp_file__(use_temp_file, upload_mode)
+        tmp_paths = []
+        try:
+            # 准备各素材的表单文件字段，图片按需转码
+            prepared = []
+            for asset in assets:
+                media_info = MediaProbe.probe(asset['path'])
+                if not media_info.exists:
+                    continue
+
+                # 之前已投递成功的素材也照常准备，保证批次划分与上次一致
+                if asset['type'] == 'image':
+                    name, source, tmp_path = cls.__prepare_image__(asset['path'], use_temp_file, image_budget)
+                    tmp_paths.append(tmp_path)
                 else:
-                    cls.__logger__.info('img reformatting succeed!')
-        except Exception as e:
-            cls.__logger__.exception('img reformatting failed!', e)
-            tmp_pic_path = ''
-        if StringUtil.is_string_empty(tmp_pic_path):
-            tmp_pic_path = img_path
+                    name, source = os.path.basename(asset['path']), asset['path']
+                if isinstance(source, bytes):
+                    size = len(source)
+                else:
+                    size = media_info.size if source == asset['path'] else os.path.getsize(source)
+                prepared.append((asset, (name, source, asset['type'] + '/*'), size))
+
+            batches = cls.__split_batches__(prepared, max_batch_bytes)
+            for batch_index, batch in enumerate(batches):
+                if all(asset['field'] in delivered for asset, _, _ in batch):
+                    for asset, _, _ in batch:
+                        asset.update(status=cls.ASSET_SUCCEED, code='200', msg='delivered previously',
+                                     batch=batch_index)
+                    continue
+
+                form_data = {
+                    'promptId': prompt_id, 'batchIndex': batch_index,
+                    'batchCount': len(batches), 'assetCount': len(batch)
+                }
+                files_to_send = {asset['field']: file_info for asset, file_info, _ in batch}
+                upload_id = ''
+                if upload_mode == cls.UPLOAD_CHUNKED:
+                    upload_id = ChunkedUploader.make_upload_id(
+                        '{}#{}'.format(prompt_id, batch_index),
+                        {asset['field']: (os.path.basename(asset['path']), asset['path'], '')
+                         for asset, _, _ in batch}
+                    )
 
-        # 准备表单数据
-        files_to_send = {
-            'image': (
-                os.path.basename(tmp_pic_path),
-                open(tmp_pic_path, 'rb'),
-                'image/*'
-            ),
-            'video': (
-                os.path.basename(video_path),
-                open(video_path, 'rb'),
-                'video/*'
-            )
-        }
-        form_data = {'promptId': prompt_id}
+                succeed, err_code, err_msg = cls.__post_form_with_retries__(
+                    callback_url, form_data, files_to_send, max_retries=max_retries, upload_id=upload_id,
+                    dedup=dedup, by_reference=upload_mode == cls.UPLOAD_REFERENCE
+                )
+                for asset, _, _ in batch:
+                    asset.update(status=cls.ASSET_SUCCEED if succeed else cls.ASSET_FAILED,
+                                 code=err_code, msg=err_msg, batch=batch_index)
+                if succeed and on_progress is not None:
+                    delivered.extend(asset['field'] for asset, _, _ in batch if asset['field'] not in delivered)
+                    on_progress(list(delivered))
+        finally:
+            for tmp_path in tmp_paths:
+                cls.__remove_temp_file__(tmp_path)
+
+        # 不存在的素材单独统计：重试也无法恢复，不影响其余素材的投递结果
+        failed = [asset for asset in assets if asset['status'] == cls.ASSET_FAILED]
+        missing = [asset for asset in assets if asset['status'] == cls.ASSET_MISSING]
+        report = json.dumps({
+            'succeed': len(assets) - len(failed) - len(missing),
+            'failed': len(failed),
+            'missing': len(missing),
+            'assets': assets
+        }, ensure_ascii=False)
+        if len(failed) > 0:
+            return False, cls.__pick_error_code__([asset['code'] for asset in failed]), report
+        if len(assets) == len(missing):
+            return False, '-1', report
+
+        return True, '200', report
+
+    @classmethod
+    def __pick_error_code__(cls, codes: List[str]) -> str:
+        """
+        :param codes: 各失败子批次的错误代码
+        :return: 最严重的可重试错误代码（HTTP_5xx按SERVER_ERROR排序），都不可重试时返回第一个
+        """
+        def rank(code: str) -> int:
+            if code in cls.TRANSIENT_ERROR_CODES:
+                return cls.TRANSIENT_ERROR_CODES.index(code)
+            if code.startswith('HTTP_5'):
+                return cls.TRANSIENT_ERROR_CODES.index('SERVER_ERROR')
+            return len(cls.TRANSIENT_ERROR_CODES)
 
+        return min(codes, key=rank)
+
+    @staticmethod
+    def __split_batches__(prepared: list, max_batch_bytes: int) -> List[list]:
+        """
+        按大小把素材分成尽量少的批次（first-fit decreasing），批内保持原有顺序
+        :param prepared: [(asset, file_info, size)]
+        :param max_batch_bytes: 单批最大字节数，<=0 表示不拆分
+        :return: 批次列表
+        """
+        if len(prepared) == 0:
+            return []
+
+        if not isinstance(max_batch_bytes, int) or max_batch_bytes <= 0:
+            return [prepared]
+
+        order = {id(item): index for index, item in enumerate(prepared)}
+        batches = []
+        for item in sorted(prepared, key=lambda x: x[2], reverse=True):
+            for batch in batches:
+                if batch[0] + item[2] <= max_batch_bytes:
+                    batch[0] += item[2]
+                    batch[1].append(item)
+                    break
+            else:
+                batches.append([item[2], [item]])
+
+        return [sorted(items, key=lambda x: order[id(x)]) for _, items in batches]
+
+    @classmethod
+    def __post_form_with_retries__(
+            cls,
+            callback_url: str,
+            form_data: dict,
+            files_to_send: dict,
+            max_retries: int = 3,
+            upload_id: str = '',
+            dedup: bool = False,
+            by_reference: bool = False
+    ) -> Tuple[bool, str, str]:
+        """
+        发送回调表单，失败时按decorrelated jitter退避重试；429/503带Retry-After时按其等待。
+        同一主机连续失败后熔断，熔断期间直接返回CIRCUIT_OPEN，不再占用投递线程
+        :param callback_url: 回调地址
+        :param form_data: 普通表单字段
+        :param files_to_send: 文件字段，name -> (filename, 文件路径或bytes, content_type)
+        :param max_retries: 最大重试次数
+        :param upload_id: 非空时使用分片续传
+        :param dedup: 是否先询问接收端已持有哪些内容，已有的只发送引用
+        :param by_reference: 磁盘上的文件只发送签名下载地址，由接收端拉取
+        :return: (是否成功, 错误代码, 错误信息)
+        """
+        # requests只在真正发送回调时才导入（下面按它的异常类型区分错误）
+        import requests
+
+        breaker = CircuitBreaker.for_url(callback_url)
+        started = time.perf_counter()
         last_error_code = ""
         last_error_msg = ""
+        wait_time = 0.0
 
-        for attempt in range(max_retries):
-            try:
-                # 重新打开文件（因为文件指针可能已经移动）
-                if attempt > 0:
-                    # 关闭之前打开的文件
-                    for file_info in files_to_send.values():
-                        file_info[1].close()
-
-                    # 重新打开文件
-                    files_to_send['image'] = (
-                        os.path.basename(tmp_pic_path),
-                        open(tmp_pic_path, 'rb'),
-                        'image/*'
-                    )
-                    files_to_send['video'] = (
-                        os.path.basename(video_path),
-                        open(video_path, 'rb'),
-                        'video/*'
-                    )
+        # 熔断期间连预检请求（内容去重查询）也不发，直接快速失败；第一次尝试沿用这里拿到的放行
+        allowed, remaining = breaker.allow()
+        if not allowed:
+            return cls.__circuit_open__(callback_url, remaining, last_error_msg, started)
 
-                # 发送POST请求（表单形式）
-                response = requests.post(
-                    callback_url,
-                    files=files_to_send,
-                    data=form_data,
-                    timeout=60  # 30秒超时
+        try:
+            if by_reference is True:
+                form_data, files_to_send = cls.__share_files__(form_data, files_to_send)
+
+            content_hashes = {}
+            skipped = []
+            if dedup is True and len(files_to_send) > 0:
+                all_files = files_to_send
+                form_data, files_to_send, content_hashes, skipped = ContentDedup.apply(
+                    callback_url, form_data, files_to_send
                 )
+        except BaseException:
+            breaker.release()
+            raise
 
-                # 检查响应状态
-                if response.status_code == 200:
-                    # 成功，关闭所有文件
-                    for file_info in files_to_send.values():
-                        file_info[1].close()
-                    return True, '200', ""
-
-                # 处理不同的HTTP状态码
-                error_handlers = {
-                    400: ("BAD_REQUEST", f"请求参数错误: {response.text}"),
-                    401: ("UNAUTHORIZED", "认证失败"),
-                    403: ("FORBIDDEN", "权限不足"),
-                    404: ("NOT_FOUND", "回调地址不存在"),
-                    413: ("PAYLOAD_TOO_LARGE", "文件大小超过限制"),
-                    415: ("UNSUPPORTED_MEDIA_TYPE", "不支持的媒体类型"),
-                    500: ("SERVER_ERROR", "服务器内部错误"),
-                    502: ("BAD_GATEWAY", "网关错误"),
-                    503: ("SERVICE_UNAVAILABLE", "服务不可用"),
-                    504: ("GATEWAY_TIMEOUT", "网关超时")
-                }
+        for attempt in range(max_retries):
+            if attempt > 0:
+                allowed, remaining = breaker.allow()
+                if not allowed:
+                    return cls.__circuit_open__(callback_url, remaining, last_error_msg, started)
+
+            retry_after = 0.0
+            encoder = None
+            # 排队等待并发名额，请求体按全局 / 目标主机的带宽限制发送
+            with UploadLimiter.acquire(callback_url) as permit:
+                attempt_started = time.perf_counter()
+                try:
+                    # 每次尝试都从请求体开头重新发送；文件已不存在等本地错误在下面按UNKNOWN_ERROR处理并释放探测名额
+                    encoder = MultipartEncoder(fields=form_data, files=files_to_send)
+                    encoder.throttle = permit.throttle
+                    uploader = None
+                    if not StringUtil.is_string_empty(upload_id):
+                        uploader = ChunkedUploader(callback_url, upload_id, files=files_to_send, fields=form_data)
+                        uploader.throttle = permit.throttle
+                    # 纯http的大请求体直接用sendfile发送
+                    use_sendfile = MultipartEncoder.can_sendfile(callback_url) \
+                        and len(encoder) >= MultipartEncoder.SENDFILE_MIN_BYTES
+
+                    # 发送POST请求（表单形式）
+                    if uploader is not None:
+                        # 分片上传：只补传接收端还没有的分片
+                        response = uploader.upload()
+                    elif use_sendfile:
+                        response = MultipartEncoder.post_with_sendfile(callback_url, encoder, timeout=60)
+                    else:
+                        response = HttpSessionPool.post(
+                            callback_url,
+                            data=encoder,
+                            headers={'Content-Type': encoder.content_type},
+                            timeout=60  # 30秒超时
+                        )
+                    cls.__observe_upload__(
+                        uploader.bytes_sent if uploader is not None else len(encoder),
+                        time.perf_counter() - attempt_started, response.status_code == 200
+                    )
 
-                if response.status_code in error_handlers:
-                    last_error_code, last_error_msg = error_handlers[response.status_code]
-                else:
-                    last_error_code = f"HTTP_{response.status_code}"
-                    last_error_msg = f"HTTP错误: {response.status_code} - {response.text}"
-            except requests.exceptions.Timeout:
-                last_error_code = "TIMEOUT"
-                last_error_msg = "请求超时"
-            except requests.exceptions.ConnectionError:
-                last_error_code = "CONNECTION_ERROR"
-                last_error_msg = "连接错误"
-            except requests.exceptions.RequestException as e:
-                last_error_code = "REQUEST_ERROR"
-                last_error_msg = f"请求异常: {str(e)}"
-            except Exception as e:
-                last_error_code = "UNKNOWN_ERROR"
-                last_error_msg = f"未知错误: {str(e)}"
+                    # 5xx和429说明主机有问题，其余状态码说明主机是正常的
+                    if response.status_code >= 500 or response.status_code == 429:
+                        if response.status_code in (429, 503):
+                            retry_after = CircuitBreaker.parse_retry_after(response.headers.get('Retry-After'))
+                        breaker.record_failure(retry_after)
+                    else:
+                        breaker.record_success()
+
+                    # 检查响应状态
+                    if response.status_code == 200:
+                        # 成功，关闭所有文件
+                        encoder.close()
+                        if len(content_hashes) > 0:
+                            ContentDedup.mark_present(callback_url, content_hashes.values())
+                        Metrics.CALLBACK_ATTEMPTS.inc(1, '200')
+                        Metrics.CALLBACK_DURATION.observe(time.perf_counter() - started, '200')
+                        cls.__logger__.info('callback to {} succeeded after {} attempt(s)'.format(
+                            callback_url, attempt + 1), extra={'duration': time.perf_counter() - started})
+                        return True, '200', ""
+
+                    if response.status_code == 409 and len(skipped) > 0:
+                        # 接收端已不再持有被引用的内容：作废缓存，下次尝试上传完整文件
+                        ContentDedup.mark_present(callback_url, [content_hashes[name] for name in skipped], False)
+                        files_to_send = all_files
+                        skipped = []
+
+                    # 处理不同的HTTP状态码
+                    error_handlers = {
+                        400: ("BAD_REQUEST", f"请求参数错误: {response.text}"),
+                        401: ("UNAUTHORIZED", "认证失败"),
+                        403: ("FORBIDDEN", "权限不足"),
+                        404: ("NOT_FOUND", "回调地址不存在"),
+                        413: ("PAYLOAD_TOO_LARGE", "文件大小超过限制"),
+                        415: ("UNSUPPORTED_MEDIA_TYPE", "不支持的媒体类型"),
+                        429: ("TOO_MANY_REQUESTS", "请求过于频繁"),
+                        500: ("SERVER_ERROR", "服务器内部错误"),
+                        502: ("BAD_GATEWAY", "网关错误"),
+                        503: ("SERVICE_UNAVAILABLE", "服务不可用"),
+                        504: ("GATEWAY_TIMEOUT", "网关超时")
+                    }
+
+                    if response.status_code in error_handlers:
+                        last_error_code, last_error_msg = error_handlers[response.status_code]
+                    else:
+                        last_error_code = f"HTTP_{response.status_code}"
+                        last_error_msg = f"HTTP错误: {response.status_code} - {response.text}"
+                except requests.exceptions.Timeout:
+                    breaker.record_failure()
+                    last_error_code = "TIMEOUT"
+                    last_error_msg = "请求超时"
+                except requests.exceptions.ConnectionError:
+                    breaker.record_failure()
+                    last_error_code = "CONNECTION_ERROR"
+                    last_error_msg = "连接错误"
+                except requests.exceptions.RequestException as e:
+                    breaker.record_failure()
+                    last_error_code = "REQUEST_ERROR"
+                    last_error_msg = f"请求异常: {str(e)}"
+                except Exception as e:
+                    # 本地错误（如文件读取失败）不能说明主机状态
+                    breaker.release()
+                    last_error_code = "UNKNOWN_ERROR"
+                    last_error_msg = f"未知错误: {str(e)}"
+                finally:
+                    if encoder is not None:
+                        encoder.close()
+
+            # 按error_handlers中的错误代码（或HTTP_xxx、异常类型）记录这次失败的尝试
+            Metrics.CALLBACK_ATTEMPTS.inc(1, last_error_code)
 
             # 如果不是最后一次尝试，等待后重试
             if attempt < max_retries - 1:
-                # 指数退避策略，等待时间逐渐增加
-                wait_time = 2 ** attempt
+                # 接收端给了Retry-After就按它等待（熔断器也会至少熔断这么久），否则用decorrelated jitter
+                if retry_after > 0:
+                    if retry_after > CircuitBreaker.BACKOFF_CAP:
+                        continue
+                    wait_time = retry_after
+                else:
+                    wait_time = CircuitBreaker.next_backoff(wait_time)
+                Metrics.CALLBACK_RETRIES.inc()
                 time.sleep(wait_time)
 
-        # 所有重试都失败，关闭所有文件
-        for file_info in files_to_send.values():
-            file_info[1].close()
-
+        Metrics.CALLBACK_DURATION.observe(time.perf_counter() - started, last_error_code)
+        cls.__logger__.warning('callback to {} failed after {} attempt(s): {}'.format(
+            callback_url, max_retries, last_error_code), extra={'duration': time.perf_counter() - started})
         return False, last_error_code, last_error_msg
 
+    @classmethod
+    def __circuit_open__(cls, callback_url: str, remaining: float, last_error_msg: str,
+                         started: float) -> Tuple[bool, str, str]:
+        cls.__logger__.warning('circuit open for {}, skip callback'.format(callback_url))
+        Metrics.CALLBACK_ATTEMPTS.inc(1, "CIRCUIT_OPEN")
+        Metrics.CALLBACK_DURATION.observe(time.perf_counter() - started, "CIRCUIT_OPEN")
+        return False, "CIRCUIT_OPEN", "回调地址连续失败，已熔断，{:.0f}秒后再试 {}".format(
+            remaining, last_error_msg).strip()
+
+    @classmethod
+    def __share_files__(cls, form_data: dict, files_to_send: dict) -> Tuple[dict, dict]:
+        """
+        把磁盘上的文件换成签名下载地址：表单附带 <字段>_url / <字段>_filename / <字段>_size / <字段>_expires，
+        内存中的数据（如转码后的图片）仍直接上传。不在ComfyUI中运行（下载接口未注册）时全部直接上传
+        :return: (新的表单字段, 仍需上传的文件字段)
+        """
+        if not KLServerRoutes.is_registered():
+            cls.__logger__.warning('file route not registered, fall back to form upload')
+            return form_data, files_to_send
+
+        base_url = FileShare.get_base_url(
+            'http://{}:{}'.format(PromptIdFetcher.get_local_ip(), PromptIdFetcher.get_local_port())
+        )
+        new_form = dict(form_data)
+        new_files = {}
+        for name, (filename, source, content_type) in files_to_send.items():
+            if isinstance(source, (bytes, bytearray, memoryview)):
+                new_files[name] = (filename, source, content_type)
+                continue
+
+            url, expires = FileShare.make_url(base_url, source)
+            new_form.update({
+                name + '_url': url,
+                name + '_filename': filename,
+                name + '_size': os.path.getsize(source),
+                name + '_expires': expires,
+            })
+
+        return new_form, new_files
+
+    @staticmethod
+    def __observe_upload__(body_bytes: int, elapsed: float, succeed: bool):
+        """
+        记录一次拿到了响应的回调尝试的上传量和吞吐量
+        """
+        Metrics.CALLBACK_UPLOAD_BYTES.inc(body_bytes)
+        Metrics.CALLBACK_PAYLOAD_BYTES.observe(body_bytes)
+        if succeed and elapsed > 0:
+            Metrics.CALLBACK_THROUGHPUT.observe(body_bytes / elapsed)
+
+    @classmethod
+    def __prepare_image__(cls, img_path: str, use_temp_file: bool = False,
+                          image_budget: Optional[dict] = None) -> Tuple[str, Union[str, bytes], str]:
+        """
+        非jpg图片（或超出预算的jpg）转码为jpg，默认在内存中完成
+        :param img_path: 图片文件路径
+        :param use_temp_file: 是否把转码结果写入临时文件
+        :param image_budget: 图片预算，max_dimension / max_bytes / quality，见PictureUtils.convert_pic_format_to_bytes
+        :return: (上传文件名, 文件路径或图片数据, 需要清理的临时文件路径)，转码失败时上传原始图片
+        """
+        budget = {k: v for k, v in (image_budget or {}).items() if isinstance(v, int) and v > 0}
+        try:
+            pic_real_format = PictureUtils.get_image_real_format(image_file_path=img_path)
+            if StringUtil.is_string_empty(pic_real_format) \
+                    or (pic_real_format in [PictureUtils.IMG_FORMAT_JPEG] and len(budget) == 0):
+                return os.path.basename(img_path), img_path, ''
+
+            cls.__logger__.info(u'reformat img as jpg...')
+            data = PictureUtils.convert_pic_format_to_bytes(
+                src_path=img_path, output_format=PictureUtils.IMG_FORMAT_JPEG, **budget
+            )
+            if len(data) > 0:
+                cls.__logger__.info('img reformatting succeed!')
+                if not use_temp_file:
+                    return os.path.splitext(os.path.basename(img_path))[0] + '.jpg', data, ''
 
+                img_dir = os.path.split(img_path)[0]
+                tmp_pic_path = os.path.join(
+                    img_dir,
+                    '{}-{}.jpg'.format(str(time.time()), StringUtil.get_random_number_string(6))
+                )
+                with open(tmp_pic_path, 'wb') as f:
+                    f.write(data)
+                return os.path.basename(tmp_pic_path), tmp_pic_path, tmp_pic_path
+        except Exception as e:
+            cls.__logger__.exception('img reformatting failed! {}'.format(e))
 
+        # 转换失败就上传原始图片
+        return os.path.basename(img_path), img_path, ''
 
+    @classmethod
+    def __use_temp_file__(cls, use_temp_file: bool, upload_mode: str) -> bool:
+        """
+        reference方式下接收端在回调返回之后才按地址拉取文件，而临时文件在回调结束时就删除了，
+        所以转码结果留在内存中随表单直接上传（__share_files__只共享磁盘上的原始文件）
+        """
+        if use_temp_file is True and upload_mode == cls.UPLOAD_REFERENCE:
+            cls.__logger__.info('reference upload: keep the reformatted image in memory instead of a temp file')
+            return False
+        return use_temp_file
+
+    @classmethod
+    def __remove_temp_file__(cls, tmp_path: str):
+        if StringUtil.is_string_empty(tmp_path):
+            return
+
+        try:
+            FileUtil.delete_file(tmp_path)
+        except OSError as e:
+            cls.__logger__.error('failed to remove temp file[{}]: {}'.format(tmp_path, e))
@@ -6,10 +6,11 @@ import socket
 import sys
 import time
 
-import requests
-
+from ..klutils.metrics import Metrics
+from ..klutils.queue_snapshot import QueueSnapshotCache
 from ..klutils.string_util import StringUtil
 from ..klutils.klLog import Log
+from .server_routes import KLServerRoutes
 
 
 class PromptIdFetcher:
@@ -20,6 +21,9 @@ class PromptIdFetcher:
     __ENV_USERNAME__ = 'COMFYUI_USERNAME'
     __ENV_PASSWD__ = 'COMFYUI_PASSWORD'
 
+    # 读取执行队列时等待队列锁的最长秒数
+    QUEUE_LOCK_TIMEOUT = 1.0
+
     RETURN_TYPES = ("STRING",)
     RETURN_NAMES = ("PROMPT ID",)
     FUNCTION = "get_prompt_id"
@@ -45,18 +49,68 @@ class PromptIdFetcher:
         return inputs
 
     # 添加 IS_CHANGED 方法，确保节点每次都重新执行
-    def IS_CHANGED(self) -> float:
+    @classmethod
+    def IS_CHANGED(cls, **kwargs) -> float:
+        """
+        ComfyUI用返回值判断节点是否需要重新执行，与上次相同时直接使用缓存的输出。
+        节点的输出就是prompt id，而ComfyUI每次运行都分配新的prompt id，所以不能复用缓存的输出
+        """
         # 返回一个总是变化的值，确保节点每次都重新执行
         return float(time.time())
 
+    @Log.contextual(node=__name__, phase='prompt_id')
     def get_prompt_id(self, force_refresh: int = 0) -> tuple:
         """
-        获取工作流的prompt id
+        获取工作流的prompt id：在ComfyUI进程内时直接读取执行队列，否则（或读取失败时）请求/queue接口
         :return:
         """
-        return self.get_prompt_id_by_request(),
+        prompt_id = self.get_prompt_id_in_process()
+        if StringUtil.is_string_empty(prompt_id):
+            prompt_id = self.get_prompt_id_by_request()
+        return prompt_id,
+
+    @classmethod
+    def get_prompt_id_in_process(cls) -> str:
+        """
+        从当前进程的PromptServer读取正在执行的prompt id，不经过HTTP
+        :return: prompt id，不在ComfyUI中运行或读取失败时返回空字符串
+        """
+        started = time.perf_counter()
+        prompt_server = KLServerRoutes.get_prompt_server()
+        if prompt_server is None:
+            return ''
+
+        prompt_id = ''
+        prompt_queue = getattr(prompt_server, 'prompt_queue', None)
+        mutex = getattr(prompt_queue, 'mutex', None)
+        if mutex is not None and mutex.acquire(timeout=cls.QUEUE_LOCK_TIMEOUT):
+            try:
+                running = list(getattr(prompt_queue, 'currently_running', {}).values())
+            finally:
+                mutex.release()
+
+            # 队列项为 (number, prompt_id, prompt, extra_data, outputs_to_execute)，取最早开始的一个
+            running = [item for item in running if isinstance(item, (list, tuple)) and len(item) > 1]
+            if len(running) > 0:
+                prompt_id = min(running, key=lambda item: item[0])[1]
+
+        if StringUtil.is_string_empty(prompt_id):
+            # 执行器开始执行时会记录last_prompt_id
+            prompt_id = getattr(prompt_server, 'last_prompt_id', None) or ''
+
+        Metrics.QUEUE_LOOKUP_DURATION.observe(time.perf_counter() - started, 'in_process' if prompt_id else 'in_process_miss')
+        return str(prompt_id)
 
     def get_prompt_id_by_request(self) -> str:
+        started = time.perf_counter()
+        prompt_id = self.__request_prompt_id__()
+        Metrics.QUEUE_LOOKUP_DURATION.observe(time.perf_counter() - started, 'hit' if prompt_id else 'miss')
+        return prompt_id
+
+    def __request_prompt_id__(self) -> str:
+        # requests只在需要走HTTP时才导入
+        import requests
+
         username, passwd = self.get_auth_info()
         if not StringUtil.is_string_empty(username) and not StringUtil.is_string_empty(passwd):
             headers = {
@@ -70,26 +124,17 @@ class PromptIdFetcher:
             port = self.get_local_port()
             url = f"http://{local_ip}:{port}/queue"
 
-            response = requests.get(url, headers=headers)
-            # 检查响应状态
-            if response.status_code == 200:
-                queue_running = response.json().get("queue_running")
-                if queue_running and len(queue_running) > 0 and len(queue_running[0]) > 1:
-                    # self.__logger__.info('queue-running: {}'.format(queue_running))
-                    # self.__logger__.info('Response Content in queue_running: {}'.format(queue_running[0][1]))
-                    prompt_id = queue_running[0][1]
-                    # self.__logger__.info(u'获取到prompt id: {}'.format(prompt_id))
-                    return prompt_id
-                else:
-                    return ''
-            else:
-                self.__logger__.error(f"Failed to receive a successful response, status code: {response.status_code}")
-                return ''
+            # 多个节点 / 线程同时查询时共享同一次请求，只解析queue_running中的prompt id
+            running_ids = QueueSnapshotCache.get_running_prompt_ids(url, headers=headers)
+            return running_ids[0] if len(running_ids) > 0 else ''
         except requests.exceptions.RequestException as e:
-            self.__logger__.exception('', e)
+            self.__logger__.exception('failed to query queue: {}'.format(e))
             return ''
         except ValueError as e:
-            self.__logger__.exception('', e)
+            self.__logger__.exception('failed to parse queue: {}'.format(e))
+            return ''
+        except TimeoutError as e:
+            self.__logger__.error('failed to query queue: {}'.format(e))
             return ''
 
     # 从环境变量中获取用户名和密码
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+from ..klutils.file_share import FileShare
+from ..klutils.klLog import Log
+from ..klutils.metrics import Metrics
+
+
+class KLServerRoutes:
+    """
+    注册到ComfyUI服务上的HTTP接口：
+    - GET /klnodes/metrics：Prometheus文本格式的运行指标
+    - GET /klnodes/files/{token}：按签名地址下载本地文件（见FileShare），支持Range请求，由sendfile发送
+    """
+    __version__ = '1.0.0'
+    __name__ = 'KLServerRoutes'
+    __logger__ = Log.get_logger(__name__)
+
+    ROUTE_METRICS = '/klnodes/metrics'
+
+    __registered = False
+
+    @classmethod
+    def register(cls) -> bool:
+        """
+        在ComfyUI的PromptServer上注册接口，不在ComfyUI中运行时什么都不做
+        :return: 是否注册成功
+        """
+        if cls.__registered:
+            return True
+
+        prompt_server = cls.get_prompt_server()
+        if prompt_server is None:
+            cls.__logger__.info('ComfyUI server not found, skip registering routes')
+            return False
+
+        try:
+            from aiohttp import web
+        except ImportError as e:
+            cls.__logger__.error('aiohttp not available, skip registering routes: {}'.format(e))
+            return False
+
+        @prompt_server.routes.get(cls.ROUTE_METRICS)
+        async def get_metrics(request):
+            return web.Response(body=Metrics.render().encode('utf-8'),
+                                headers={'Content-Type': Metrics.CONTENT_TYPE})
+
+        @prompt_server.routes.get(FileShare.ROUTE_PREFIX + '{token}')
+        async def get_shared_file(request):
+            file_path = FileShare.verify_token(request.match_info['token'])
+            if file_path is None:
+                # 签名无效、已过期或文件已被删除，统一返回404
+                return web.json_response({'error': 'not found'}, status=404)
+
+            return web.FileResponse(file_path, headers={
+                'Content-Disposition': 'attachment; filename="{}"'.format(
+                    os.path.basename(file_path).replace('"', '_')),
+                'Cache-Control': 'private, no-store',
+            })
+
+        cls.__registered = True
+        return True
+
+    @classmethod
+    def is_registered(cls) -> bool:
+        return cls.__registered
+
+    @staticmethod
+    def get_prompt_server():
+        """
+        :return: 当前进程中ComfyUI的PromptServer实例，不在ComfyUI中运行时返回None
+        """
+        server = sys.modules.get('server')
+        return getattr(getattr(server, 'PromptServer', None), 'instance', None)
@@ -0,0 +1,409 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+from .env_util import EnvUtil
+from .klLog import Log
+
+
+class CallbackOutbox:
+    """
+    持久化的回调发件箱（sqlite3, WAL模式）。
+    每条回调在投递前先落盘，记录prompt id、文件路径、回调地址、尝试次数和下次到期时间，
+    进程重启或重试耗尽后仍可由调度器重新投递。
+    """
+    __version__ = '1.0.0'
+    __name__ = 'CallbackOutbox'
+    __logger__ = Log.get_logger(__name__)
+
+    __ENV_DB_PATH__ = 'KL_CALLBACK_OUTBOX_DB'
+    __ENV_MAX_ATTEMPTS__ = 'KL_CALLBACK_OUTBOX_MAX_ATTEMPTS'
+
+    STATUS_PENDING = 'pending'
+    STATUS_DELIVERED = 'delivered'
+    STATUS_DEAD = 'dead'
+
+    DEFAULT_MAX_ATTEMPTS = 10
+    # 条目被领取后的租期，租期内不会被重复领取；进程崩溃后租期到期即可重新投递。
+    # 投递期间每隔LEASE_RENEW_INTERVAL秒续租一次，慢速上传不会因租期到期被调度器重复投递
+    DEFAULT_LEASE_SECONDS = 300.0
+    LEASE_RENEW_INTERVAL = 60.0
+    BACKOFF_BASE_SECONDS = 5.0
+    BACKOFF_MAX_SECONDS = 3600.0
+
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    __SCHEMA = (
+        '''
+        CREATE TABLE IF NOT EXISTS callback_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            prompt_id TEXT NOT NULL,
+            callback_url TEXT NOT NULL,
+            img_path TEXT,
+            video_path TEXT,
+            options TEXT NOT NULL DEFAULT '{}',
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            next_due REAL NOT NULL,
+            last_error_code TEXT NOT NULL DEFAULT '',
+            last_error_msg TEXT NOT NULL DEFAULT '',
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_callback_outbox_due ON callback_outbox (status, next_due)',
+        'CREATE INDEX IF NOT EXISTS idx_callback_outbox_updated ON callback_outbox (status, updated_at)',
+        'CREATE INDEX IF NOT EXISTS idx_callback_outbox_prompt ON callback_outbox (prompt_id)',
+    )
+
+    @classmethod
+    def get_default_db_path(cls) -> str:
+        """
+        :return: 发件箱数据库路径，默认放在节点包根目录下
+        """
+        db_path = os.getenv(cls.__ENV_DB_PATH__, '')
+        if db_path:
+            return db_path
+
+        return os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'callback_outbox.db')
+
+    @classmethod
+    def has_database(cls) -> bool:
+        """
+        :return: 默认数据库文件是否已存在（用于启动时判断是否有待恢复的回调）
+        """
+        return os.path.isfile(cls.get_default_db_path())
+
+    @classmethod
+    def get_instance(cls) -> 'CallbackOutbox':
+        if cls.__instance is None:
+            with cls.__instance_lock:
+                if cls.__instance is None:
+                    cls.__instance = cls()
+
+        return cls.__instance
+
+    def __init__(self, db_path: Optional[str] = None):
+        """
+        :param db_path: 数据库文件路径，默认见get_default_db_path
+        """
+        self.__db_path = db_path if db_path else self.get_default_db_path()
+        self.__default_max_attempts = EnvUtil.get_int(self.__ENV_MAX_ATTEMPTS__, self.DEFAULT_MAX_ATTEMPTS)
+
+        self.__lock = threading.Lock()
+        self.__conn = sqlite3.connect(self.__db_path, check_same_thread=False, isolation_level=None)
+        self.__conn.row_factory = sqlite3.Row
+        with self.__lock:
+            self.__conn.execute('PRAGMA journal_mode=WAL')
+            self.__conn.execute('PRAGMA synchronous=NORMAL')
+            for statement in self.__SCHEMA:
+                self.__conn.execute(statement)
+
+    @property
+    def db_path(self) -> str:
+        return self.__db_path
+
+    def enqueue(self, prompt_id: str, callback_url: str, img_path: Optional[str], video_path: Optional[str],
+                options: Optional[dict] = None, max_attempts: Optional[int] = None,
+                lease_seconds: float = DEFAULT_LEASE_SECONDS) -> int:
+        """
+        记录一条待投递的回调。新条目默认处于领取状态（租期内不会被调度器取走），
+        由调用方立即投递；调用方崩溃时租期到期后由调度器接手
+        :param prompt_id:
+        :param callback_url: 回调地址
+        :param img_path: 图片文件路径
+        :param video_path: 视频文件路径
+        :param options: 投递参数（会原样传给投递函数）
+        :param max_attempts: 最大投递次数
+        :param lease_seconds: 租期秒数，传0表示立即交给调度器
+        :return: 条目id
+        """
+        if not isinstance(max_attempts, int) or max_attempts <= 0:
+            max_attempts = self.__default_max_attempts
+
+        now = time.time()
+        with self.__lock:
+            cursor = self.__conn.execute(
+                'INSERT INTO callback_outbox (prompt_id, callback_url, img_path, video_path, options, status, '
+                'attempts, max_attempts, next_due, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?, ?, ?)',
+                (prompt_id, callback_url, img_path, video_path, json.dumps(options or {}), self.STATUS_PENDING,
+                 max_attempts, now + max(0.0, lease_seconds), now, now)
+            )
+            return cursor.lastrowid
+
+    def claim_due(self, limit: int = 20, lease_seconds: float = DEFAULT_LEASE_SECONDS) -> List[dict]:
+        """
+        领取一批已到期的条目，领取的同时顺延其到期时间，避免被重复领取
+        :param limit: 批大小
+        :param lease_seconds: 租期秒数
+        :return: 条目列表
+        """
+        now = time.time()
+        with self.__lock:
+            self.__conn.execute('BEGIN IMMEDIATE')
+            try:
+                rows = self.__conn.execute(
+                    'SELECT * FROM callback_outbox WHERE status = ? AND next_due <= ? ORDER BY next_due LIMIT ?',
+                    (self.STATUS_PENDING, now, limit)
+                ).fetchall()
+                self.__conn.executemany(
+                    'UPDATE callback_outbox SET next_due = ?, updated_at = ? WHERE id = ?',
+                    [(now + lease_seconds, now, row['id']) for row in rows]
+                )
+                self.__conn.execute('COMMIT')
+            except Exception:
+                self.__conn.execute('ROLLBACK')
+                raise
+
+        return [self.__row_to_entry__(row) for row in rows]
+
+    def extend_lease(self, entry_id: int, lease_seconds: float = DEFAULT_LEASE_SECONDS) -> bool:
+        """
+        顺延投递中条目的租期
+        :param entry_id: 条目id
+        :param lease_seconds: 从现在起的租期秒数
+        :return: 条目是否仍待投递
+        """
+        now = time.time()
+        with self.__lock:
+            cursor = self.__conn.execute(
+                'UPDATE callback_outbox SET next_due = ?, updated_at = ? WHERE id = ? AND status = ?',
+                (now + lease_seconds, now, entry_id, self.STATUS_PENDING)
+            )
+            return cursor.rowcount > 0
+
+    def mark_delivered(self, entry_id: int):
+        now = time.time()
+        with self.__lock:
+            self.__conn.execute(
+                'UPDATE callback_outbox SET status = ?, attempts = attempts + 1, last_error_code = ?, '
+                'last_error_msg = ?, updated_at = ? WHERE id = ?',
+                (self.STATUS_DELIVERED, '200', '', now, entry_id)
+            )
+
+    def mark_failed(self, entry_id: int, err_code: str, err_msg: str, permanent: bool = False) -> str:
+        """
+        记录一次失败的投递，计算下次到期时间；次数耗尽或永久性错误时标记为dead
+        :param entry_id: 条目id
+        :param err_code: 错误代码
+        :param err_msg: 错误信息
+        :param permanent: 是否为重试也无法恢复的错误（如文件已不存在）
+        :return: 条目的新状态
+        """
+        now = time.time()
+        with self.__lock:
+            row = self.__conn.execute(
+                'SELECT attempts, max_attempts FROM callback_outbox WHERE id = ?', (entry_id,)
+            ).fetchone()
+            if row is None:
+                return ''
+
+            attempts = row['attempts'] + 1
+            if permanent or attempts >= row['max_attempts']:
+                status = self.STATUS_DEAD
+                next_due = now
+            else:
+                status = self.STATUS_PENDING
+                next_due = now + min(self.BACKOFF_MAX_SECONDS, self.BACKOFF_BASE_SECONDS * (2 ** (attempts - 1)))
+
+            self.__conn.execute(
+                'UPDATE callback_outbox SET status = ?, attempts = ?, next_due = ?, last_error_code = ?, '
+                'last_error_msg = ?, updated_at = ? WHERE id = ?',
+                (status, attempts, next_due, str(err_code), str(err_msg), now, entry_id)
+            )
+
+        return status
+
+    def merge_options(self, entry_id: int, options: dict):
+        """
+        把投递进度等参数合并到条目的options中，下次投递时原样传给投递函数
+        :param entry_id: 条目id
+        :param options: 要更新的参数
+        """
+        with self.__lock:
+            self.__conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.__conn.execute(
+                    'SELECT options FROM callback_outbox WHERE id = ?', (entry_id,)
+                ).fetchone()
+                if row is not None:
+                    try:
+                        merged = json.loads(row['options'] or '{}')
+                    except ValueError:
+                        merged = {}
+                    merged.update(options)
+                    self.__conn.execute(
+                        'UPDATE callback_outbox SET options = ?, updated_at = ? WHERE id = ?',
+                        (json.dumps(merged), time.time(), entry_id)
+                    )
+                self.__conn.execute('COMMIT')
+            except Exception:
+                self.__conn.execute('ROLLBACK')
+                raise
+
+    def list_undelivered(self, limit: int = 100, offset: int = 0, include_dead: bool = True) -> List[dict]:
+        """
+        列出未投递成功的条目（走索引，不扫描文件）
+        :param limit:
+        :param offset:
+        :param include_dead: 是否包含已放弃的条目
+        :return: 条目列表
+        """
+        statuses = [self.STATUS_PENDING, self.STATUS_DEAD] if include_dead else [self.STATUS_PENDING]
+        with self.__lock:
+            rows = self.__conn.execute(
+                'SELECT * FROM callback_outbox WHERE status IN ({}) ORDER BY id LIMIT ? OFFSET ?'.format(
+                    ','.join('?' * len(statuses))),
+                (*statuses, limit, offset)
+            ).fetchall()
+
+        return [self.__row_to_entry__(row) for row in rows]
+
+    def count(self, status: str = STATUS_PENDING) -> int:
+        with self.__lock:
+            return self.__conn.execute(
+                'SELECT COUNT(*) FROM callback_outbox WHERE status = ?', (status,)
+            ).fetchone()[0]
+
+    def purge(self, status: str = STATUS_DELIVERED, older_than: float = 0.0) -> int:
+        """
+        清理指定状态、且最后更新时间早于older_than秒之前的条目
+        :param status: delivered / dead / pending
+        :param older_than: 秒数
+        :return: 删除的条数
+        """
+        with self.__lock:
+            cursor = self.__conn.execute(
+                'DELETE FROM callback_outbox WHERE status = ? AND updated_at <= ?',
+                (status, time.time() - max(0.0, older_than))
+            )
+            return cursor.rowcount
+
+    def close(self):
+        with self.__lock:
+            self.__conn.close()
+
+    @staticmethod
+    def __row_to_entry__(row: sqlite3.Row) -> dict:
+        entry = dict(row)
+        try:
+            entry['options'] = json.loads(entry.get('options') or '{}')
+        except ValueError:
+            entry['options'] = {}
+        return entry
+
+
+class CallbackOutboxScheduler:
+    """
+    发件箱调度器：后台线程按批领取到期条目并重新投递
+    """
+    __version__ = '1.0.0'
+    __name__ = 'CallbackOutboxScheduler'
+    __logger__ = Log.get_logger(__name__)
+
+    DEFAULT_POLL_INTERVAL = 10.0
+    DEFAULT_BATCH_SIZE = 20
+
+    def __init__(self, outbox: CallbackOutbox, deliver: Callable[[dict], Tuple[bool, str, str]],
+                 poll_interval: float = DEFAULT_POLL_INTERVAL, batch_size: int = DEFAULT_BATCH_SIZE):
+        """
+        :param outbox: 发件箱
+        :param deliver: 投递函数，参数为条目字典，返回(是否成功, 错误代码, 错误信息)；
+            错误代码为'-1'表示参数或文件错误，不再重试
+        :param poll_interval: 轮询间隔秒数
+        :param batch_size: 每批领取条数
+        """
+        self.__outbox = outbox
+        self.__deliver = deliver
+        self.__poll_interval = poll_interval
+        self.__batch_size = batch_size
+        self.__stop_event = threading.Event()
+        self.__thread = None
+        self.__lock = threading.Lock()
+
+    def start(self):
+        with self.__lock:
+            if self.__thread is not None and self.__thread.is_alive():
+                return
+
+            self.__stop_event.clear()
+            self.__thread = threading.Thread(target=self.__run__, name='KLCallbackOutbox', daemon=True)
+            self.__thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        self.__stop_event.set()
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+
+    def run_once(self) -> int:
+        """
+        投递一批到期条目
+        :return: 本批处理的条数
+        """
+        entries = self.__outbox.claim_due(limit=self.__batch_size)
+        for entry in entries:
+            if self.__stop_event.is_set():
+                break
+            self.deliver_entry(self.__outbox, entry['id'], self.__deliver, entry)
+
+        return len(entries)
+
+    @classmethod
+    def deliver_entry(cls, outbox: CallbackOutbox, entry_id: int,
+                      deliver: Callable[..., Tuple[bool, str, str]], *args, **kwargs) -> Tuple[bool, str, str]:
+        """
+        调用投递函数并把结果记录到发件箱，投递期间在后台线程中定期续租
+        :return: 投递函数的返回值
+        """
+        stop_event = threading.Event()
+        renewer = threading.Thread(target=cls.__renew_lease__, args=(outbox, entry_id, stop_event),
+                                   name='KLCallbackOutboxLease', daemon=True)
+        renewer.start()
+        try:
+            succeed, err_code, err_msg = deliver(*args, **kwargs)
+        except Exception as e:
+            cls.__logger__.exception('outbox entry[{}] delivery raised an exception: {}'.format(entry_id, e))
+            succeed, err_code, err_msg = False, 'UNKNOWN_ERROR', str(e)
+        finally:
+            # 续租线程退出后再记录结果，避免续租覆盖失败后计算的下次到期时间
+            stop_event.set()
+            renewer.join()
+
+        try:
+            if succeed:
+                outbox.mark_delivered(entry_id)
+            else:
+                status = outbox.mark_failed(entry_id, err_code, err_msg, permanent=str(err_code) == '-1')
+                if status == CallbackOutbox.STATUS_DEAD:
+                    cls.__logger__.error('outbox entry[{}] given up: {}, {}'.format(entry_id, err_code, err_msg))
+        except sqlite3.Error as e:
+            cls.__logger__.exception('failed to record outbox entry[{}] result: {}'.format(entry_id, e))
+
+        return succeed, err_code, err_msg
+
+    @classmethod
+    def __renew_lease__(cls, outbox: CallbackOutbox, entry_id: int, stop_event: threading.Event):
+        while not stop_event.wait(CallbackOutbox.LEASE_RENEW_INTERVAL):
+            try:
+                if not outbox.extend_lease(entry_id):
+                    return
+            except sqlite3.Error as e:
+                cls.__logger__.exception('failed to renew outbox entry[{}] lease: {}'.format(entry_id, e))
+
+    def __run__(self):
+        while not self.__stop_event.is_set():
+            try:
+                handled = self.run_once()
+            except Exception as e:
+                self.__logger__.exception('outbox scheduling failed: {}'.format(e))
+                handled = 0
+
+            # 满批说明可能还有积压，立即继续
+            if handled < self.__batch_size:
+                self.__stop_event.wait(self.__poll_interval)
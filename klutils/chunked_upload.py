@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+from typing import Callable, Dict, Optional, Set, Union
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+from .http_util import HttpSessionPool
+from .klLog import Log
+
+
+class ChunkedUploader:
+    """
+    可续传的分片上传。所有请求都发往回调地址本身，通过查询参数区分：
+
+    1. 查询进度：GET  <url>?kl_upload=<id>
+       返回 200 {"parts": {"video": [0, 1], "image": [0]}}，404 表示还没有收到任何分片
+    2. 上传分片：PUT  <url>?kl_upload=<id>&field=<字段>&part=<序号>&offset=<偏移>
+       请求头 X-KL-Part-SHA256 为分片的sha256，校验失败时接收端返回422
+    3. 完成上传：POST <url>?kl_upload=<id>&complete=1
+       表单字段与普通回调相同，另附 manifest（各字段的文件名、大小、分片大小、分片数、类型），
+       接收端拼装文件后按普通回调处理
+
+    upload id由prompt id和文件的名称、大小、修改时间计算，重试（包括发件箱重投）时保持不变，
+    因此每次重试只需补传接收端还没有的分片。
+    """
+    __version__ = '1.0.0'
+    __name__ = 'ChunkedUploader'
+    __logger__ = Log.get_logger(__name__)
+
+    DEFAULT_PART_SIZE = 4 * 1024 * 1024
+    QUERY_UPLOAD_ID = 'kl_upload'
+    HEADER_PART_SHA256 = 'X-KL-Part-SHA256'
+
+    def __init__(self, url: str, upload_id: str, files: dict, fields: Optional[dict] = None,
+                 part_size: int = DEFAULT_PART_SIZE, timeout: float = 60,
+                 throttle: Optional[Callable[[int], None]] = None):
+        """
+        :param url: 回调地址
+        :param upload_id: 上传id，见make_upload_id
+        :param files: 文件字段，name -> (filename, source, content_type)，source为文件路径或bytes
+        :param fields: 普通表单字段
+        :param part_size: 分片大小
+        :param timeout: 单个请求的超时秒数
+        :param throttle: 限速回调，每个分片上传前以分片字节数调用
+        """
+        self.url = url
+        self.upload_id = upload_id
+        self.files = files
+        self.fields = fields or {}
+        self.part_size = part_size if isinstance(part_size, int) and part_size > 0 else self.DEFAULT_PART_SIZE
+        self.timeout = timeout
+        self.throttle = throttle
+        # 最近一次upload()实际上传的分片字节数
+        self.bytes_sent = 0
+
+    @classmethod
+    def make_upload_id(cls, prompt_id: str, files: dict) -> str:
+        """
+        计算稳定的upload id
+        :param prompt_id:
+        :param files: 同构造函数
+        :return: 40位16进制字符串
+        """
+        sha1obj = hashlib.sha1(prompt_id.encode('utf-8'))
+        for name in sorted(files.keys()):
+            filename, source, _ = files[name]
+            sha1obj.update('|{}|{}|'.format(name, filename).encode('utf-8'))
+            if isinstance(source, (bytes, bytearray, memoryview)):
+                sha1obj.update(hashlib.sha1(source).digest())
+            else:
+                stat = os.stat(source)
+                sha1obj.update('{}|{}'.format(stat.st_size, stat.st_mtime_ns).encode('ascii'))
+
+        return sha1obj.hexdigest()
+
+    def fetch_received_parts(self) -> Dict[str, Set[int]]:
+        """
+        查询接收端已经收到的分片
+        :return: 字段名 -> 分片序号集合；接收端没有记录时返回空字典
+        """
+        response = HttpSessionPool.get(self.__make_url__(), timeout=self.timeout)
+        if response.status_code != 200:
+            return {}
+
+        try:
+            parts = response.json().get('parts') or {}
+            return {name: set(int(index) for index in indexes) for name, indexes in parts.items()}
+        except (ValueError, TypeError, AttributeError) as e:
+            self.__logger__.error('invalid upload status from receiver: {}'.format(e))
+            return {}
+
+    def upload(self):
+        """
+        补传缺失的分片并提交完成请求。分片上传失败时直接返回该分片的响应，由调用方决定是否重试
+        :return: 响应对象（有status_code / text属性）
+        """
+        self.bytes_sent = 0
+        received = self.fetch_received_parts()
+
+        manifest = {}
+        for name, (filename, source, content_type) in self.files.items():
+            size = self.__get_source_size__(source)
+            part_count = max(1, (size + self.part_size - 1) // self.part_size)
+            manifest[name] = {
+                'filename': filename, 'size': size, 'part_size': self.part_size,
+                'parts': part_count, 'content_type': content_type
+            }
+
+            done = received.get(name, set())
+            for index in range(part_count):
+                if index in done:
+                    continue
+
+                offset = index * self.part_size
+                data = self.__read_part__(source, offset, self.part_size)
+                if self.throttle is not None:
+                    self.throttle(len(data))
+                response = HttpSessionPool.request(
+                    'PUT',
+                    self.__make_url__(field=name, part=index, offset=offset),
+                    data=data,
+                    headers={
+                        self.HEADER_PART_SHA256: hashlib.sha256(data).hexdigest(),
+                        'Content-Type': 'application/octet-stream',
+                    },
+                    timeout=self.timeout
+                )
+                if response.status_code not in (200, 201, 204):
+                    return response
+                self.bytes_sent += len(data)
+
+        form_data = dict(self.fields)
+        form_data['manifest'] = json.dumps(manifest)
+        return HttpSessionPool.post(self.__make_url__(complete=1), data=form_data, timeout=self.timeout)
+
+    def __make_url__(self, **params) -> str:
+        parsed = urlparse(self.url)
+        query = parse_qsl(parsed.query, keep_blank_values=True)
+        query.append((self.QUERY_UPLOAD_ID, self.upload_id))
+        query.extend((key, str(value)) for key, value in params.items())
+        return urlunparse(parsed._replace(query=urlencode(query)))
+
+    @staticmethod
+    def __get_source_size__(source: Union[str, bytes]) -> int:
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return len(source)
+        return os.path.getsize(source)
+
+    @staticmethod
+    def __read_part__(source: Union[str, bytes], offset: int, length: int) -> bytes:
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return bytes(source[offset:offset + length])
+
+        with open(source, 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+import email.utils
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+
+from .env_util import EnvUtil
+from .klLog import Log
+
+
+class CircuitBreaker:
+    """
+    按目标主机（scheme, host, port）记录失败情况的熔断器：
+
+    - closed：正常放行，连续失败达到阈值后转为open
+    - open：直接拒绝，不发请求；等待reset_timeout（或接收端Retry-After给出的时间）后转为half-open
+    - half-open：只放行一个探测请求，成功则回到closed，失败则重新open且等待时间翻倍（有上限）；
+      探测名额超过PROBE_LEASE秒未归还（调用方异常退出）时视为丢失，再放行一个探测请求
+    - 未到阈值时接收端给了Retry-After：只暂停到Retry-After指定的时间，之后直接回到closed，
+      失败次数继续累计，不进入half-open，也不翻倍等待时间
+
+    另外提供重试等待时间的计算：Retry-After解析和decorrelated jitter退避。
+    """
+    __version__ = '1.0.0'
+    __name__ = 'CircuitBreaker'
+    __logger__ = Log.get_logger(__name__)
+
+    __ENV_FAILURE_THRESHOLD__ = 'KL_CIRCUIT_FAILURE_THRESHOLD'
+    __ENV_RESET_TIMEOUT__ = 'KL_CIRCUIT_RESET_TIMEOUT'
+
+    STATE_CLOSED = 'closed'
+    STATE_OPEN = 'open'
+    STATE_HALF_OPEN = 'half-open'
+
+    DEFAULT_FAILURE_THRESHOLD = 3
+    DEFAULT_RESET_TIMEOUT = 30.0
+    MAX_RESET_TIMEOUT = 600.0
+    PROBE_LEASE = 300.0
+
+    BACKOFF_BASE = 1.0
+    BACKOFF_CAP = 30.0
+
+    __registry_lock = threading.Lock()
+    __registry = {}
+
+    @classmethod
+    def for_url(cls, url: str) -> 'CircuitBreaker':
+        """
+        获取目标主机对应的熔断器，同一主机的所有回调共享
+        :param url: 请求地址
+        :return: CircuitBreaker
+        """
+        key = EnvUtil.get_host_key(url)
+        with cls.__registry_lock:
+            breaker = cls.__registry.get(key)
+            if breaker is None:
+                breaker = cls(
+                    name='{}://{}:{}'.format(*key),
+                    failure_threshold=EnvUtil.get_int(
+                        cls.__ENV_FAILURE_THRESHOLD__, cls.DEFAULT_FAILURE_THRESHOLD),
+                    reset_timeout=EnvUtil.get_number(
+                        cls.__ENV_RESET_TIMEOUT__, cls.DEFAULT_RESET_TIMEOUT)
+                )
+                cls.__registry[key] = breaker
+
+        return breaker
+
+    @classmethod
+    def reset_all(cls):
+        with cls.__registry_lock:
+            cls.__registry = {}
+
+    def __init__(self, name: str = '', failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                 reset_timeout: float = DEFAULT_RESET_TIMEOUT):
+        """
+        :param name: 名称，用于日志
+        :param failure_threshold: 连续失败多少次后熔断
+        :param reset_timeout: 熔断后多久允许探测（秒）
+        """
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = max(0.0, reset_timeout)
+
+        self.__lock = threading.Lock()
+        self.__state = self.STATE_CLOSED
+        self.__failures = 0
+        self.__open_until = 0.0
+        self.__open_timeout = self.reset_timeout
+        self.__probing = False
+        self.__probe_until = 0.0
+        # 当前的open只是按Retry-After暂停（未到失败阈值）
+        self.__paused = False
+        self.__rejected = 0
+
+    @property
+    def state(self) -> str:
+        with self.__lock:
+            if self.__state == self.STATE_OPEN and time.monotonic() >= self.__open_until:
+                return self.STATE_CLOSED if self.__paused else self.STATE_HALF_OPEN
+            return self.__state
+
+    def allow(self) -> Tuple[bool, float]:
+        """
+        判断现在能否发出请求；放行half-open探测后，调用方必须调用record_success / record_failure / release之一
+        :return: (是否放行, 被拒绝时还需等待的秒数)
+        """
+        now = time.monotonic()
+        with self.__lock:
+            if self.__state == self.STATE_OPEN:
+                if now < self.__open_until:
+                    self.__rejected += 1
+                    return False, self.__open_until - now
+                if self.__paused:
+                    # Retry-After要求的暂停结束，回到closed继续累计失败次数
+                    self.__state = self.STATE_CLOSED
+                    self.__paused = False
+                else:
+                    self.__state = self.STATE_HALF_OPEN
+                    self.__probing = False
+
+            if self.__state == self.STATE_HALF_OPEN:
+                if self.__probing and now < self.__probe_until:
+                    # 已有探测请求在进行中，其他请求继续快速失败
+                    self.__rejected += 1
+                    return False, 0.0
+                self.__probing = True
+                self.__probe_until = now + self.PROBE_LEASE
+
+            return True, 0.0
+
+    def record_success(self):
+        with self.__lock:
+            if self.__state != self.STATE_CLOSED:
+                self.__logger__.info('circuit {} closed'.format(self.name))
+            self.__state = self.STATE_CLOSED
+            self.__failures = 0
+            self.__open_timeout = self.reset_timeout
+            self.__probing = False
+            self.__paused = False
+
+    def record_failure(self, retry_after: float = 0.0):
+        """
+        记录一次失败
+        :param retry_after: 接收端通过Retry-After要求等待的秒数，>0 时至少熔断这么久
+        """
+        now = time.monotonic()
+        with self.__lock:
+            self.__failures += 1
+            self.__probing = False
+            paused = False
+            if self.__state == self.STATE_HALF_OPEN:
+                # 探测失败，等待时间翻倍
+                self.__open_timeout = min(max(self.__open_timeout * 2, self.reset_timeout), self.MAX_RESET_TIMEOUT)
+                open_timeout = max(self.__open_timeout, retry_after)
+            elif self.__failures >= self.failure_threshold:
+                open_timeout = max(self.__open_timeout, retry_after)
+            elif retry_after > 0:
+                # 未到阈值，但接收端明确要求等待：只暂停，已经熔断时保持熔断
+                open_timeout = retry_after
+                paused = self.__state != self.STATE_OPEN or self.__paused
+            else:
+                return
+
+            self.__open_until = max(self.__open_until, now + open_timeout)
+            if self.__state != self.STATE_OPEN or (self.__paused and not paused):
+                if paused:
+                    self.__logger__.warning('circuit {} paused for {:.1f}s by Retry-After after {} failure(s)'.format(
+                        self.name, open_timeout, self.__failures))
+                else:
+                    self.__logger__.warning('circuit {} open for {:.1f}s after {} failure(s)'.format(
+                        self.name, open_timeout, self.__failures))
+            self.__state = self.STATE_OPEN
+            self.__paused = paused
+
+    def release(self):
+        """
+        请求因本地原因失败、不能说明主机状态时调用，只释放half-open的探测名额
+        """
+        with self.__lock:
+            self.__probing = False
+
+    def stats(self) -> dict:
+        state = self.state
+        with self.__lock:
+            return {
+                'name': self.name,
+                'state': state,
+                'failures': self.__failures,
+                'rejected': self.__rejected,
+                'open_remaining': max(0.0, self.__open_until - time.monotonic()),
+            }
+
+    @classmethod
+    def next_backoff(cls, previous: float, base: float = BACKOFF_BASE, cap: float = BACKOFF_CAP) -> float:
+        """
+        decorrelated jitter：sleep = min(cap, random(base, previous * 3))
+        :param previous: 上一次的等待秒数，首次传0
+        :return: 本次等待秒数
+        """
+        return min(cap, random.uniform(base, max(base, previous) * 3))
+
+    @classmethod
+    def parse_retry_after(cls, value: Optional[str]) -> float:
+        """
+        解析Retry-After响应头，支持秒数和HTTP日期两种格式
+        :return: 需要等待的秒数，无法解析时返回0
+        """
+        if not value:
+            return 0.0
+
+        value = value.strip()
+        if value.isdigit():
+            return float(value)
+
+        try:
+            retry_at = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return 0.0
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Tuple, Union
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+from .env_util import EnvUtil
+from .file_util import FileUtil
+from .http_util import HttpSessionPool
+from .klLog import Log
+
+
+class ContentDedup:
+    """
+    上传前的内容哈希握手：先问接收端是否已经持有某个sha1的内容，已有的文件只发送引用。
+
+    查询：GET <url>?kl_check=<sha1>,<sha1>...
+    返回：200 {"exists": {"<sha1>": true, "<sha1>": false}}
+    启用后每个文件字段都会附带 <字段>_sha1 和 <字段>_filename 两个表单字段；
+    接收端已持有的文件不再附带文件内容，接收端找不到引用的内容时应返回409。
+
+    查询结果按 (接收端地址, sha1) 缓存在本地，带TTL，条目数有上限。
+    """
+    __version__ = '1.0.0'
+    __name__ = 'ContentDedup'
+    __logger__ = Log.get_logger(__name__)
+
+    __ENV_TTL__ = 'KL_DEDUP_TTL'
+
+    QUERY_CHECK = 'kl_check'
+    FIELD_SHA1_SUFFIX = '_sha1'
+    FIELD_FILENAME_SUFFIX = '_filename'
+    DEFAULT_TTL = 600.0
+    MAX_ENTRIES = 4096
+    CHECK_TIMEOUT = 10
+
+    __lock = threading.Lock()
+    __cache = OrderedDict()
+    __hits = 0
+    __misses = 0
+
+    @classmethod
+    def hash_source(cls, source: Union[str, bytes]) -> str:
+        """
+        :param source: 文件路径或bytes
+        :return: 16进制sha1
+        """
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return hashlib.sha1(source).hexdigest()
+        return FileUtil.get_file_hash_sha1(source)
+
+    @classmethod
+    def apply(cls, url: str, form_data: dict, files: dict) -> Tuple[dict, dict, Dict[str, str], List[str]]:
+        """
+        计算各文件的哈希并询问接收端，去掉接收端已有的文件内容
+        :param url: 回调地址
+        :param form_data: 普通表单字段
+        :param files: 文件字段，name -> (filename, source, content_type)
+        :return: (新的表单字段, 需要上传的文件字段, 字段名 -> sha1, 只发送了引用的字段名)
+        """
+        hashes = {}
+        new_form = dict(form_data)
+        for name, (filename, source, _) in files.items():
+            content_hash = cls.hash_source(source)
+            if content_hash:
+                hashes[name] = content_hash
+                new_form[name + cls.FIELD_SHA1_SUFFIX] = content_hash
+                new_form[name + cls.FIELD_FILENAME_SUFFIX] = filename
+
+        exists = cls.check(url, hashes.values())
+        skipped = [name for name, content_hash in hashes.items() if exists.get(content_hash)]
+        new_files = {name: info for name, info in files.items() if name not in skipped}
+        if len(skipped) > 0:
+            cls.__logger__.info('receiver already holds {}, send reference only'.format(', '.join(skipped)))
+
+        return new_form, new_files, hashes, skipped
+
+    @classmethod
+    def check(cls, url: str, hashes: Iterable[str]) -> Dict[str, bool]:
+        """
+        查询接收端是否持有这些内容，优先使用本地缓存
+        :return: sha1 -> 是否存在；查询失败的哈希不在结果中
+        """
+        endpoint = cls.__get_endpoint__(url)
+        result = {}
+        unknown = []
+        now = time.monotonic()
+        with cls.__lock:
+            for content_hash in hashes:
+                cached = cls.__cache.get((endpoint, content_hash))
+                if cached is not None and cached[1] > now:
+                    cls.__cache.move_to_end((endpoint, content_hash))
+                    cls.__hits += 1
+                    result[content_hash] = cached[0]
+                else:
+                    cls.__misses += 1
+                    unknown.append(content_hash)
+
+        if len(unknown) == 0:
+            return result
+
+        parsed = urlparse(url)
+        query = parse_qsl(parsed.query, keep_blank_values=True)
+        query.append((cls.QUERY_CHECK, ','.join(unknown)))
+        try:
+            response = HttpSessionPool.get(urlunparse(parsed._replace(query=urlencode(query))),
+                                           timeout=cls.CHECK_TIMEOUT)
+            if response.status_code != 200:
+                return result
+            exists = response.json().get('exists') or {}
+        except Exception as e:
+            # 接收端不支持或查询失败时照常上传全部文件
+            cls.__logger__.error('content check failed, upload everything: {}'.format(e))
+            return result
+
+        answered = {content_hash: bool(exists.get(content_hash)) for content_hash in unknown
+                    if content_hash in exists}
+        cls.__remember__(endpoint, answered)
+        result.update(answered)
+        return result
+
+    @classmethod
+    def mark_present(cls, url: str, hashes: Iterable[str], present: bool = True):
+        """
+        上传成功后记录接收端已持有这些内容；接收端报告引用失效时以present=False作废
+        """
+        cls.__remember__(cls.__get_endpoint__(url), {content_hash: present for content_hash in hashes})
+
+    @classmethod
+    def stats(cls) -> dict:
+        with cls.__lock:
+            return {'hits': cls.__hits, 'misses': cls.__misses, 'entries': len(cls.__cache)}
+
+    @classmethod
+    def __remember__(cls, endpoint: str, values: Dict[str, bool]):
+        expire = time.monotonic() + cls.__get_ttl__()
+        with cls.__lock:
+            for content_hash, exists in values.items():
+                cls.__cache[(endpoint, content_hash)] = (exists, expire)
+                cls.__cache.move_to_end((endpoint, content_hash))
+            while len(cls.__cache) > cls.MAX_ENTRIES:
+                cls.__cache.popitem(last=False)
+
+    @classmethod
+    def __get_ttl__(cls) -> float:
+        return EnvUtil.get_number(cls.__ENV_TTL__, cls.DEFAULT_TTL)
+
+    @staticmethod
+    def __get_endpoint__(url: str) -> str:
+        parsed = urlparse(url)
+        return '{}://{}{}'.format(parsed.scheme.lower(), parsed.netloc.lower(), parsed.path or '/')
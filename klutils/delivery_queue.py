@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+import atexit
+import contextvars
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from .env_util import EnvUtil
+from .klLog import Log
+from .metrics import Metrics
+
+
+class CallbackDeliveryQueue:
+    """
+    回调结果的后台投递队列。
+    节点线程只负责入队并立即返回投递句柄，上传和重试由后台工作线程完成；
+    进程退出时在限定时间内尽量把队列中的任务投递完。
+    """
+    __version__ = '1.0.0'
+    __name__ = 'CallbackDeliveryQueue'
+    __logger__ = Log.get_logger(__name__)
+
+    __ENV_WORKERS__ = 'KL_CALLBACK_WORKERS'
+    __ENV_DRAIN_TIMEOUT__ = 'KL_CALLBACK_DRAIN_TIMEOUT'
+
+    DEFAULT_WORKERS = 2
+    DEFAULT_DRAIN_TIMEOUT = 30.0
+    DEFAULT_MAX_HISTORY = 1024
+
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEED = 'succeed'
+    STATUS_FAILED = 'failed'
+
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls) -> 'CallbackDeliveryQueue':
+        """
+        获取全局共享的投递队列，第一次调用时创建并注册退出时的排空处理
+        :return: 投递队列
+        """
+        if cls.__instance is None:
+            with cls.__instance_lock:
+                if cls.__instance is None:
+                    instance = cls()
+                    atexit.register(instance.shutdown)
+                    cls.__instance = instance
+
+        return cls.__instance
+
+    def __init__(self, workers: Optional[int] = None, drain_timeout: Optional[float] = None,
+                 max_history: int = DEFAULT_MAX_HISTORY):
+        """
+        :param workers: 工作线程数，默认读取环境变量KL_CALLBACK_WORKERS
+        :param drain_timeout: 退出时排空队列的最长等待秒数，默认读取环境变量KL_CALLBACK_DRAIN_TIMEOUT
+        :param max_history: 最多保留多少条已结束任务的状态
+        """
+        if not isinstance(workers, int) or workers <= 0:
+            workers = EnvUtil.get_int(self.__ENV_WORKERS__, self.DEFAULT_WORKERS)
+        if not isinstance(drain_timeout, (int, float)) or drain_timeout < 0:
+            drain_timeout = EnvUtil.get_number(self.__ENV_DRAIN_TIMEOUT__, self.DEFAULT_DRAIN_TIMEOUT)
+
+        self.__workers_count = max(1, workers)
+        self.__drain_timeout = drain_timeout
+        self.__max_history = max(1, max_history)
+
+        self.__queue = queue.Queue()
+        self.__lock = threading.Lock()
+        self.__jobs = OrderedDict()
+        self.__threads = []
+        self.__closed = False
+
+    def submit(self, func: Callable, *args, **kwargs) -> str:
+        """
+        提交一个投递任务，立即返回
+        :param func: 投递函数，返回(是否成功, 错误代码, 错误信息)
+        :return: 投递句柄，队列已关闭时返回空字符串
+        """
+        with self.__lock:
+            if self.__closed:
+                self.__logger__.error('delivery queue is closed, cannot accept new job!')
+                return ''
+
+            self.__start_workers__()
+
+            handle = uuid.uuid4().hex
+            self.__jobs[handle] = {
+                'status': self.STATUS_QUEUED,
+                'err_code': '',
+                'err_msg': '',
+                'created': time.time(),
+                'finished': 0.0,
+            }
+            self.__trim_history__()
+
+        Metrics.DELIVERY_QUEUE_DEPTH.inc()
+        # 任务在提交时的上下文中执行，日志的prompt id等字段跟随任务到工作线程
+        self.__queue.put((handle, func, args, kwargs, contextvars.copy_context()))
+        return handle
+
+    def get_status(self, handle: str) -> Optional[dict]:
+        """
+        查询投递状态
+        :param handle: 投递句柄
+        :return: 状态字典的副本，句柄未知时返回None
+        """
+        with self.__lock:
+            job = self.__jobs.get(handle)
+            return dict(job) if job is not None else None
+
+    def pending_count(self) -> int:
+        """
+        :return: 尚未结束的任务数（排队中 + 投递中）
+        """
+        with self.__lock:
+            return sum(1 for job in self.__jobs.values()
+                       if job['status'] in (self.STATUS_QUEUED, self.STATUS_RUNNING))
+
+    def shutdown(self, timeout: Optional[float] = None) -> bool:
+        """
+        停止接收新任务，并在限定时间内等待队列排空
+        :param timeout: 最长等待秒数，默认使用drain_timeout
+        :return: 是否在限定时间内全部投递结束
+        """
+        if not isinstance(timeout, (int, float)) or timeout < 0:
+            timeout = self.__drain_timeout
+
+        with self.__lock:
+            self.__closed = True
+            threads = list(self.__threads)
+
+        # 每个工作线程取到一个结束标记后退出，标记排在已有任务之后
+        for _ in threads:
+            self.__queue.put(None)
+
+        deadline = time.monotonic() + timeout
+        for thread in threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+
+        remaining = self.pending_count()
+        if remaining > 0:
+            self.__logger__.warning('delivery queue drain timed out, {} job(s) not finished'.format(remaining))
+            return False
+
+        return True
+
+    def __start_workers__(self):
+        # 调用方需持有self.__lock
+        if len(self.__threads) > 0:
+            return
+
+        for index in range(self.__workers_count):
+            thread = threading.Thread(
+                target=self.__work_loop__, name='KLCallbackDelivery-{}'.format(index), daemon=True
+            )
+            thread.start()
+            self.__threads.append(thread)
+
+    def __work_loop__(self):
+        while True:
+            job = self.__queue.get()
+            if job is None:
+                break
+
+            handle, func, args, kwargs, context = job
+            self.__update_job__(handle, status=self.STATUS_RUNNING)
+            succeed, err_code, err_msg = context.run(self.__run_job__, handle, func, args, kwargs)
+            self.__update_job__(
+                handle,
+                status=self.STATUS_SUCCEED if succeed else self.STATUS_FAILED,
+                err_code=str(err_code),
+                err_msg=str(err_msg),
+                finished=time.time()
+            )
+            Metrics.DELIVERY_QUEUE_DEPTH.dec()
+
+    def __run_job__(self, handle: str, func: Callable, args: tuple, kwargs: dict) -> tuple:
+        try:
+            succeed, err_code, err_msg = func(*args, **kwargs)
+        except Exception as e:
+            self.__logger__.exception('delivery[{}] raised an exception: {}'.format(handle, e))
+            succeed, err_code, err_msg = False, 'UNKNOWN_ERROR', str(e)
+
+        if not succeed:
+            self.__logger__.error('delivery[{}] failed: {}, {}'.format(handle, err_code, err_msg),
+                                  extra={'log_key': 'delivery_failed:{}'.format(err_code)})
+        return succeed, err_code, err_msg
+
+    def __update_job__(self, handle: str, **values):
+        with self.__lock:
+            job = self.__jobs.get(handle)
+            if job is not None:
+                job.update(values)
+
+    def __trim_history__(self):
+        # 调用方需持有self.__lock，只淘汰已经结束的任务
+        if len(self.__jobs) <= self.__max_history:
+            return
+
+        for handle in list(self.__jobs.keys()):
+            if len(self.__jobs) <= self.__max_history:
+                break
+            if self.__jobs[handle]['status'] in (self.STATUS_SUCCEED, self.STATUS_FAILED):
+                del self.__jobs[handle]
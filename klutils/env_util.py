@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import os
+from typing import Callable, Tuple, TypeVar
+from urllib.parse import urlparse
+
+T = TypeVar('T', int, float)
+
+
+class EnvUtil:
+    """
+    读取环境变量配置，以及按目标主机区分连接池、熔断器等共享状态时用到的主机标识
+    """
+    __version__ = '1.0.0'
+    __name__ = 'EnvUtil'
+
+    @classmethod
+    def get_number(cls, env_name: str, default: T, value_type: Callable[[str], T] = float) -> T:
+        """
+        读取数值型环境变量
+        :param env_name: 环境变量名
+        :param default: 默认值
+        :param value_type: int / float
+        :return: 未设置或无法解析时返回default
+        """
+        value = os.getenv(env_name)
+        if value is None:
+            return default
+
+        try:
+            return value_type(value.strip())
+        except (TypeError, ValueError):
+            return default
+
+    @classmethod
+    def get_int(cls, env_name: str, default: int) -> int:
+        return cls.get_number(env_name, default, int)
+
+    @classmethod
+    def get_host_key(cls, url: str) -> Tuple[str, str, int]:
+        """
+        :param url: 请求地址
+        :return: (scheme, 小写主机名, 端口)，未写端口时按scheme取默认端口
+        """
+        parsed = urlparse(url)
+        scheme = (parsed.scheme or 'http').lower()
+        port = parsed.port or (443 if scheme == 'https' else 80)
+        return scheme, (parsed.hostname or '').lower(), port
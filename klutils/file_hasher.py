@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import importlib.util
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from .env_util import EnvUtil
+from .klLog import Log
+
+
+class FileHasher:
+    """
+    单次读取计算多个摘要：文件只读一遍，用可复用的大缓冲区readinto，再把同一块数据交给每个摘要对象。
+    hashlib在数据块较大时会释放GIL，多个文件可以用hash_files在线程池中并发计算。
+
+    支持hashlib的所有算法（sha1 / md5 / sha256 / blake2b / blake2s 等），
+    安装了xxhash时还支持 xxh64 / xxh3_64 / xxh3_128（非加密，速度快，适合去重和缓存键）
+    """
+    __version__ = '1.0.0'
+    __name__ = 'FileHasher'
+    __logger__ = Log.get_logger(__name__)
+
+    __ENV_BUFFER_BYTES__ = 'KL_HASH_BUFFER_BYTES'
+    __ENV_WORKERS__ = 'KL_HASH_WORKERS'
+
+    DEFAULT_BUFFER_BYTES = 1024 * 1024
+    MIN_BUFFER_BYTES = 64 * 1024
+    DEFAULT_WORKERS = 4
+    XXHASH_ALGORITHMS = ('xxh64', 'xxh3_64', 'xxh3_128')
+
+    # 每个线程一个缓冲区，重复使用，不为每个文件重新分配
+    __local = threading.local()
+
+    @classmethod
+    def hash_file(cls, file_path: str, algorithms: Sequence[str] = ('sha1',)) -> Dict[str, str]:
+        """
+        读取一次文件，计算所有摘要
+        :param file_path: 文件路径
+        :param algorithms: 算法名列表
+        :return: 算法名 -> 16进制摘要；算法不支持时抛出ValueError，文件读取失败时抛出OSError
+        """
+        hashers = {algorithm: cls.new_hasher(algorithm) for algorithm in algorithms}
+        if len(hashers) == 0:
+            return {}
+
+        # 与hashlib.file_digest（Python 3.11+）相同的readinto循环，但缓冲区更大、可同时更新多个摘要
+        buffer = cls.__get_buffer__()
+        view = memoryview(buffer)
+        updates = [hasher.update for hasher in hashers.values()]
+        with open(file_path, 'rb', buffering=0) as f:
+            while True:
+                size = f.readinto(buffer)
+                if not size:
+                    break
+                chunk = view[:size]
+                for update in updates:
+                    update(chunk)
+
+        return {algorithm: hasher.hexdigest() for algorithm, hasher in hashers.items()}
+
+    @classmethod
+    def hash_files(cls, file_paths: Iterable[str], algorithms: Sequence[str] = ('sha1',),
+                   max_workers: Optional[int] = None) -> Dict[str, Dict[str, str]]:
+        """
+        在线程池中并发计算多个文件的摘要
+        :param file_paths: 文件路径列表
+        :param algorithms: 算法名列表
+        :param max_workers: 线程数，默认读取环境变量KL_HASH_WORKERS（默认4）
+        :return: 文件路径 -> (算法名 -> 16进制摘要)，读取失败的文件对应空字典
+        """
+        paths = list(dict.fromkeys(file_paths))
+        for algorithm in algorithms:
+            # 不支持的算法在提交任务之前就报错
+            cls.new_hasher(algorithm)
+
+        if max_workers is None or max_workers <= 0:
+            max_workers = EnvUtil.get_int(cls.__ENV_WORKERS__, cls.DEFAULT_WORKERS)
+        max_workers = max(1, min(max_workers, len(paths)))
+        if max_workers == 1:
+            return {path: cls.__hash_file_quietly__(path, algorithms) for path in paths}
+
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='KLFileHasher') as executor:
+            results = executor.map(lambda path: cls.__hash_file_quietly__(path, algorithms), paths)
+            return dict(zip(paths, results))
+
+    @classmethod
+    def new_hasher(cls, algorithm: str):
+        """
+        :param algorithm: 算法名
+        :return: 带update / hexdigest的摘要对象
+        """
+        name = algorithm.lower()
+        if name in cls.XXHASH_ALGORITHMS:
+            try:
+                import xxhash
+            except ImportError:
+                raise ValueError('{} requires the xxhash package'.format(algorithm))
+            return getattr(xxhash, name)()
+
+        try:
+            return hashlib.new(name)
+        except (ValueError, TypeError):
+            raise ValueError('unsupported hash algorithm: {}'.format(algorithm))
+
+    @classmethod
+    def available_algorithms(cls) -> List[str]:
+        algorithms = sorted(hashlib.algorithms_available)
+        if importlib.util.find_spec('xxhash') is not None:
+            algorithms.extend(cls.XXHASH_ALGORITHMS)
+        return algorithms
+
+    @classmethod
+    def __hash_file_quietly__(cls, file_path: str, algorithms: Sequence[str]) -> Dict[str, str]:
+        try:
+            return cls.hash_file(file_path, algorithms)
+        except OSError as e:
+            cls.__logger__.error('failed to hash file {}: {}'.format(file_path, e))
+            return {}
+
+    @classmethod
+    def __get_buffer__(cls) -> bytearray:
+        buffer = getattr(cls.__local, 'buffer', None)
+        if buffer is None:
+            size = max(EnvUtil.get_int(cls.__ENV_BUFFER_BYTES__, cls.DEFAULT_BUFFER_BYTES), cls.MIN_BUFFER_BYTES)
+            buffer = cls.__local.buffer = bytearray(size)
+        return buffer
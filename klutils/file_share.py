@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+from typing import Optional, Tuple
+
+from .env_util import EnvUtil
+from .klLog import Log
+
+
+class FileShare:
+    """
+    本地文件的签名下载地址：<base_url>/klnodes/files/<token>
+
+    token = base64url(JSON{文件路径, 过期时间}) + '.' + base64url(HMAC-SHA256)，不需要服务端保存状态。
+    密钥来自环境变量KL_FILE_SHARE_SECRET；未配置时每个进程随机生成，进程重启后旧地址失效
+    （发件箱重投时会重新签发地址，不受影响）。
+    下载接口由comfy_nodes/server_routes.py注册，支持Range请求和sendfile。
+    """
+    __version__ = '1.0.0'
+    __name__ = 'FileShare'
+    __logger__ = Log.get_logger(__name__)
+
+    __ENV_SECRET__ = 'KL_FILE_SHARE_SECRET'
+    __ENV_TTL__ = 'KL_FILE_SHARE_TTL'
+    __ENV_BASE_URL__ = 'KL_FILE_SHARE_BASE_URL'
+
+    ROUTE_PREFIX = '/klnodes/files/'
+    DEFAULT_TTL = 3600
+
+    __secret = None
+
+    @classmethod
+    def create_token(cls, file_path: str, ttl: Optional[int] = None) -> Tuple[str, int]:
+        """
+        签发文件的下载token
+        :param file_path: 文件路径
+        :param ttl: 有效秒数，默认读取环境变量KL_FILE_SHARE_TTL
+        :return: (token, 过期时间戳)
+        """
+        if not isinstance(ttl, int) or ttl <= 0:
+            ttl = cls.get_ttl()
+
+        expires = int(time.time()) + ttl
+        payload = cls.__b64encode__(json.dumps(
+            {'p': os.path.abspath(file_path), 'e': expires}, separators=(',', ':')
+        ).encode('utf-8'))
+        return '{}.{}'.format(payload, cls.__sign__(payload)), expires
+
+    @classmethod
+    def verify_token(cls, token: str) -> Optional[str]:
+        """
+        校验token
+        :return: 有效且未过期时返回文件路径，否则返回None
+        """
+        payload, _, signature = (token or '').partition('.')
+        expected = cls.__sign__(payload) if payload and payload.isascii() else ''
+        if not expected or not hmac.compare_digest(signature.encode('utf-8'), expected.encode('ascii')):
+            return None
+
+        try:
+            document = json.loads(cls.__b64decode__(payload))
+            file_path, expires = document['p'], int(document['e'])
+        except (ValueError, KeyError, TypeError):
+            return None
+
+        if expires < time.time() or not os.path.isfile(file_path):
+            return None
+
+        return file_path
+
+    @classmethod
+    def make_url(cls, base_url: str, file_path: str, ttl: Optional[int] = None) -> Tuple[str, int]:
+        """
+        :param base_url: 本机ComfyUI服务的地址，如 http://10.0.0.2:8188
+        :return: (下载地址, 过期时间戳)
+        """
+        token, expires = cls.create_token(file_path, ttl)
+        return base_url.rstrip('/') + cls.ROUTE_PREFIX + token, expires
+
+    @classmethod
+    def get_base_url(cls, default: str = '') -> str:
+        """
+        :return: 环境变量KL_FILE_SHARE_BASE_URL配置的地址，未配置时返回default
+        """
+        return os.getenv(cls.__ENV_BASE_URL__, '') or default
+
+    @classmethod
+    def get_ttl(cls) -> int:
+        return EnvUtil.get_int(cls.__ENV_TTL__, cls.DEFAULT_TTL)
+
+    @classmethod
+    def __sign__(cls, payload: str) -> str:
+        if cls.__secret is None:
+            secret = os.getenv(cls.__ENV_SECRET__, '')
+            cls.__secret = secret.encode('utf-8') if secret else secrets.token_bytes(32)
+        return cls.__b64encode__(hmac.new(cls.__secret, payload.encode('ascii'), hashlib.sha256).digest())
+
+    @staticmethod
+    def __b64encode__(data: bytes) -> str:
+        return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+    @staticmethod
+    def __b64decode__(text: str) -> bytes:
+        return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
@@ -4,8 +4,9 @@ if __name__ == '__main__':
     sys.path.append(os.getcwd())
 
 import shutil
-import hashlib
+from typing import Dict, Sequence
 from urllib.parse import urlparse
+from .file_hasher import FileHasher
 from .klLog import Log
 from .string_util import StringUtil
 
@@ -22,7 +23,7 @@ class FileUtil:
         date:2020-12-22
         details: 增加了计算文件哈希值的方法
     """
-    __version__ = '1.3.0'
+    __version__ = '1.4.0'
     __name__ = "FileUtil"
     __logger = Log.get_logger(__name__)
 
@@ -165,16 +166,7 @@ class FileUtil:
             cls.__logger.error('the file[{}] not exists, cannot calculate it\'s sha1'.format(file_path))
             return ''
 
-        sha1obj = hashlib.sha1()
-        with open(file_path, 'rb') as f:
-            while True:
-                data = f.read(4096)
-                if not data:
-                    break
-
-                sha1obj.update(data)
-
-        return sha1obj.hexdigest()
+        return FileHasher.hash_file(file_path, ('sha1',))['sha1']
 
     @classmethod
     def get_file_hash_md5(cls, file_path: str) -> str:
@@ -183,17 +175,25 @@ class FileUtil:
             :param file_path: 文件路径
             :return: 16进制md5或空字符串
         """
-        md5obj = hashlib.md5()
+        if cls.check_file_exist(file_path) is False:
+            cls.__logger.error('the file[{}] not exists, cannot calculate it\'s md5'.format(file_path))
+            return ''
 
-        with open(file_path, 'rb') as f:
-            while True:
-                data = f.read(4096)
-                if not data:
-                    break
+        return FileHasher.hash_file(file_path, ('md5',))['md5']
 
-                md5obj.update(data)
+    @classmethod
+    def get_file_hashes(cls, file_path: str, algorithms: Sequence[str] = ('sha1', 'md5')) -> Dict[str, str]:
+        """
+            读取一次文件，同时计算多个摘要（见FileHasher）
+            :param file_path: 文件路径
+            :param algorithms: 算法名列表，如 sha1 / md5 / sha256 / blake2b
+            :return: 算法名 -> 16进制摘要，文件不存在时返回空字典
+        """
+        if cls.check_file_exist(file_path) is False:
+            cls.__logger.error('the file[{}] not exists, cannot calculate it\'s hashes'.format(file_path))
+            return {}
 
-        return md5obj.hexdigest()
+        return FileHasher.hash_file(file_path, algorithms)
 
     @classmethod
     def get_file_ext_name(cls, file_path: str) -> str:
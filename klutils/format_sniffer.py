@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+from typing import Optional
+
+
+class FormatSniffer:
+    """
+    按文件头的魔数判断图片和视频容器格式，只需要读取开头的几十个字节。
+    替代已废弃（Python 3.13移除）的imghdr，同时覆盖视频容器：
+
+    图片：JPEG / PNG / WEBP / GIF / BMP，AVIF / HEIC（ISO BMFF，按ftyp的brand识别）
+    视频：MP4 / MOV（ISO BMFF，按ftyp的major brand区分）、WEBM / MKV（EBML，按DocType区分）、AVI
+    """
+    __version__ = '1.0.0'
+    __name__ = 'FormatSniffer'
+
+    HEADER_BYTES = 64
+
+    FORMAT_JPEG = 'JPEG'
+    FORMAT_PNG = 'PNG'
+    FORMAT_WEBP = 'WEBP'
+    FORMAT_GIF = 'GIF'
+    FORMAT_BMP = 'BMP'
+    FORMAT_AVIF = 'AVIF'
+    FORMAT_HEIC = 'HEIC'
+    FORMAT_MP4 = 'MP4'
+    FORMAT_MOV = 'MOV'
+    FORMAT_WEBM = 'WEBM'
+    FORMAT_MKV = 'MKV'
+    FORMAT_AVI = 'AVI'
+
+    IMAGE_FORMATS = (FORMAT_JPEG, FORMAT_PNG, FORMAT_WEBP, FORMAT_GIF, FORMAT_BMP, FORMAT_AVIF, FORMAT_HEIC)
+    # 可以是动图的格式，允许作为视频上传
+    ANIMATED_IMAGE_FORMATS = (FORMAT_GIF, FORMAT_WEBP)
+    VIDEO_FORMATS = (FORMAT_MP4, FORMAT_MOV, FORMAT_WEBM, FORMAT_MKV, FORMAT_AVI)
+
+    # 没有ftyp的老式QuickTime文件，开头直接是这些atom
+    QUICKTIME_ATOMS = (b'moov', b'mdat', b'wide', b'free', b'skip', b'pnot')
+    QUICKTIME_BRANDS = (b'qt  ',)
+    # 同样以ftyp开头的HEIF系列图片（及图片序列），不能当作MP4
+    AVIF_BRANDS = (b'avif', b'avis')
+    HEIF_BRANDS = (b'heic', b'heix', b'heim', b'heis', b'hevc', b'hevx', b'mif1', b'msf1')
+
+    @classmethod
+    def sniff(cls, header: bytes) -> str:
+        """
+        :param header: 文件开头的字节，建议至少HEADER_BYTES个
+        :return: 格式名（见FORMAT_*），无法识别时返回空字符串
+        """
+        if len(header) < 4:
+            return ''
+
+        if header[:3] == b'\xff\xd8\xff':
+            return cls.FORMAT_JPEG
+        if header[:8] == b'\x89PNG\r\n\x1a\n':
+            return cls.FORMAT_PNG
+        if header[:6] in (b'GIF87a', b'GIF89a'):
+            return cls.FORMAT_GIF
+        if header[:4] == b'RIFF' and len(header) >= 12:
+            if header[8:12] == b'WEBP':
+                return cls.FORMAT_WEBP
+            if header[8:12] == b'AVI ':
+                return cls.FORMAT_AVI
+            return ''
+        if header[:4] == b'\x1a\x45\xdf\xa3':
+            # EBML头中的DocType
+            return cls.FORMAT_WEBM if b'webm' in header[:cls.HEADER_BYTES] else cls.FORMAT_MKV
+        if len(header) >= 12 and header[4:8] == b'ftyp':
+            return cls.__sniff_ftyp__(header)
+        if len(header) >= 8 and header[4:8] in cls.QUICKTIME_ATOMS:
+            return cls.FORMAT_MOV
+        if header[:2] == b'BM' and len(header) >= 14 and header[6:10] == b'\x00\x00\x00\x00':
+            # BITMAPFILEHEADER的两个保留字段必须为0，避免把以"BM"开头的文本误判为BMP
+            return cls.FORMAT_BMP
+
+        return ''
+
+    @classmethod
+    def __sniff_ftyp__(cls, header: bytes) -> str:
+        """
+        ftyp box：size(4) 'ftyp' major_brand(4) minor_version(4) compatible_brands(4*n)
+        """
+        major = header[8:12]
+        if major in cls.AVIF_BRANDS:
+            return cls.FORMAT_AVIF
+        if major in cls.HEIF_BRANDS:
+            # mif1 / msf1 是通用的HEIF brand，AVIF文件也会用，再看兼容brand
+            box_end = min(int.from_bytes(header[:4], 'big'), len(header))
+            compatible = [header[i:i + 4] for i in range(16, box_end - 3, 4)]
+            return cls.FORMAT_AVIF if any(brand in cls.AVIF_BRANDS for brand in compatible) else cls.FORMAT_HEIC
+        if major in cls.QUICKTIME_BRANDS:
+            return cls.FORMAT_MOV
+        return cls.FORMAT_MP4
+
+    @classmethod
+    def sniff_file(cls, file_path: str) -> str:
+        """
+        :param file_path: 文件路径
+        :return: 格式名，文件无法读取或无法识别时返回空字符串
+        """
+        try:
+            with open(file_path, 'rb') as f:
+                return cls.sniff(f.read(cls.HEADER_BYTES))
+        except (OSError, TypeError, ValueError):
+            return ''
+
+    @classmethod
+    def is_image_format(cls, real_format: Optional[str]) -> bool:
+        return (real_format or '').upper() in cls.IMAGE_FORMATS
+
+    @classmethod
+    def is_animated_image_format(cls, real_format: Optional[str]) -> bool:
+        return (real_format or '').upper() in cls.ANIMATED_IMAGE_FORMATS
+
+    @classmethod
+    def is_video_format(cls, real_format: Optional[str]) -> bool:
+        return (real_format or '').upper() in cls.VIDEO_FORMATS
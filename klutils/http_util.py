@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+from typing import TYPE_CHECKING, Optional
+
+from .env_util import EnvUtil
+from .klLog import Log
+
+if TYPE_CHECKING:
+    import requests
+
+
+class HttpSessionPool:
+    """
+    线程安全的HTTP连接池：每个目标主机（scheme, host, port）共享一个keep-alive的requests.Session，
+    避免每次回调都重新进行TCP/TLS握手。
+    连接建立失败（请求尚未发出）时由urllib3自动重试；读超时只对幂等方法重试，不会重复提交POST。
+    """
+    __version__ = '1.0.0'
+    __name__ = 'HttpSessionPool'
+    __logger__ = Log.get_logger(__name__)
+
+    __ENV_POOL_CONNECTIONS__ = 'KL_HTTP_POOL_CONNECTIONS'
+    __ENV_POOL_MAXSIZE__ = 'KL_HTTP_POOL_MAXSIZE'
+    __ENV_KEEPALIVE__ = 'KL_HTTP_KEEPALIVE'
+    __ENV_RETRIES__ = 'KL_HTTP_RETRIES'
+
+    DEFAULT_POOL_CONNECTIONS = 4
+    DEFAULT_POOL_MAXSIZE = 16
+    # 会话空闲超过该秒数后重建；<=0 表示不使用keep-alive
+    DEFAULT_KEEPALIVE = 120.0
+    DEFAULT_RETRIES = 2
+    RETRY_BACKOFF_FACTOR = 0.2
+
+    __lock = threading.Lock()
+    __sessions = {}
+    __config = None
+
+    @classmethod
+    def configure(cls, pool_connections: Optional[int] = None, pool_maxsize: Optional[int] = None,
+                  keepalive: Optional[float] = None, retries: Optional[int] = None):
+        """
+        修改连接池配置，未指定的项保持不变；已有会话会被关闭，下次请求时按新配置重建
+        :param pool_connections: 每个会话缓存的连接池个数
+        :param pool_maxsize: 每个主机的最大连接数
+        :param keepalive: 会话空闲多久后重建（秒），<=0 关闭keep-alive
+        :param retries: 连接失败的重试次数
+        """
+        with cls.__lock:
+            config = dict(cls.__get_config__())
+            for key, value in (('pool_connections', pool_connections), ('pool_maxsize', pool_maxsize),
+                               ('keepalive', keepalive), ('retries', retries)):
+                if value is not None:
+                    config[key] = value
+            cls.__config = config
+            cls.__close_sessions__()
+
+    @classmethod
+    def get_session(cls, url: str) -> 'requests.Session':
+        """
+        获取目标主机对应的共享会话
+        :param url: 请求地址
+        :return: requests.Session
+        """
+        key = EnvUtil.get_host_key(url)
+        now = time.monotonic()
+        with cls.__lock:
+            config = cls.__get_config__()
+            session, last_used = cls.__sessions.get(key, (None, 0.0))
+            if session is not None and 0 < config['keepalive'] < now - last_used:
+                # 空闲太久，服务端多半已经断开了连接，直接重建
+                session.close()
+                session = None
+
+            if session is None:
+                session = cls.__create_session__(config)
+
+            cls.__sessions[key] = (session, now)
+
+        return session
+
+    @classmethod
+    def request(cls, method: str, url: str, **kwargs) -> 'requests.Response':
+        return cls.get_session(url).request(method, url, **kwargs)
+
+    @classmethod
+    def get(cls, url: str, **kwargs) -> 'requests.Response':
+        return cls.request('GET', url, **kwargs)
+
+    @classmethod
+    def post(cls, url: str, **kwargs) -> 'requests.Response':
+        return cls.request('POST', url, **kwargs)
+
+    @classmethod
+    def close_all(cls):
+        with cls.__lock:
+            cls.__close_sessions__()
+
+    @classmethod
+    def __close_sessions__(cls):
+        # 调用方需持有cls.__lock
+        for session, _ in cls.__sessions.values():
+            try:
+                session.close()
+            except Exception as e:
+                cls.__logger__.exception('failed to close http session: {}'.format(e))
+        cls.__sessions = {}
+
+    @classmethod
+    def __create_session__(cls, config: dict) -> 'requests.Session':
+        # requests在第一次建立会话时才导入，减少节点包的导入时间
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        retry = Retry(
+            total=config['retries'],
+            connect=config['retries'],
+            read=config['retries'],
+            status=0,
+            allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+            backoff_factor=cls.RETRY_BACKOFF_FACTOR,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(
+            pool_connections=config['pool_connections'],
+            pool_maxsize=config['pool_maxsize'],
+            max_retries=retry
+        )
+
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if config['keepalive'] <= 0:
+            session.headers['Connection'] = 'close'
+
+        return session
+
+    @classmethod
+    def __get_config__(cls) -> dict:
+        if cls.__config is None:
+            cls.__config = {
+                'pool_connections': EnvUtil.get_int(cls.__ENV_POOL_CONNECTIONS__, cls.DEFAULT_POOL_CONNECTIONS),
+                'pool_maxsize': EnvUtil.get_int(cls.__ENV_POOL_MAXSIZE__, cls.DEFAULT_POOL_MAXSIZE),
+                'keepalive': EnvUtil.get_number(cls.__ENV_KEEPALIVE__, cls.DEFAULT_KEEPALIVE),
+                'retries': EnvUtil.get_int(cls.__ENV_RETRIES__, cls.DEFAULT_RETRIES),
+            }
+
+        return cls.__config
@@ -1,25 +1,66 @@
 import os
+import atexit
+import contextvars
+import copy
+import functools
 import logging
+import logging.handlers
+import queue
+import threading
+from contextlib import contextmanager
 from logging import Logger
-import coloredlogs
-import colorama
+from typing import Optional
+
+from .env_util import EnvUtil
+from .log_handlers import GzipTimedRotatingFileHandler, JsonFormatter, RateLimitFilter
 
 
 class Log:
-    # 设置颜色
-    coloredlogs.DEFAULT_FIELD_STYLES = {
+    # 设置颜色（coloredlogs / colorama在第一条日志输出时才导入）
+    FIELD_STYLES = {
         'asctime': {'color': 'green'}, 'hostname': {'color': 'magenta'},
         'levelname': {'color': 'green', 'bold': True},
         'request_id': {'color': 'yellow'},
         'name': {'color': 'blue'}, 'programname': {'color': 'cyan'},
         'threadName': {'color': 'yellow'}
     }
-    colorama.init()
     __instances = {}
+    __lock = threading.Lock()
+    # 所有logger共用一个队列：业务线程只把记录放入队列，由后台监听线程统一格式化、着色和输出
+    __queue = None
+    __queue_handler = None
+    __listener = None
+    # WARNING及以上的重复日志限流（回调接收端宕机时避免每个prompt都刷一遍同样的错误）
+    __rate_limit = None
+    # 当前线程（或被复制到投递线程）的日志上下文：prompt_id / node / phase
+    __context = contextvars.ContextVar('kl_log_context', default={})
+
+    __ENV_LOG_FORMAT__ = 'KL_LOG_FORMAT'
+    __ENV_LOG_FILE__ = 'KL_LOG_FILE'
+    __ENV_LOG_FILE_WHEN__ = 'KL_LOG_FILE_WHEN'
+    __ENV_LOG_FILE_BACKUPS__ = 'KL_LOG_FILE_BACKUPS'
+    __ENV_LOG_RATE_WINDOW__ = 'KL_LOG_RATE_WINDOW'
+    __ENV_LOG_RATE_BURST__ = 'KL_LOG_RATE_BURST'
+
+    DEFAULT_RATE_WINDOW = 60.0
+    DEFAULT_RATE_BURST = 5
+    RATE_LIMIT_MAX_KEYS = 256
+
+    FMT = '%(asctime)s [%(levelname)s] [%(name)s] %(message)s'
+    FORMAT_TEXT = 'text'
+    FORMAT_JSON = 'json'
+    CONTEXT_FIELDS = JsonFormatter.CONTEXT_FIELDS
 
     @classmethod
     def get_logger(cls, name=os.path.abspath(__name__)) -> Logger:
-        if name not in cls.__instances:
+        logger = cls.__instances.get(name)
+        if logger is not None:
+            return logger
+
+        with cls.__lock:
+            if name in cls.__instances:
+                return cls.__instances[name]
+
             # 日志文件夹路径
             # base_dir = os.getcwd()
             # while base_dir != '/':
@@ -35,17 +76,11 @@ class Log:
             #     os.makedirs(log_dir, mode=0o755)
 
             # log_file = os.path.join(log_dir, "app.log")
-            logger = logging.getLogger(name)        # 设置日志格式
-            # fmt = '%(asctime)s [%(levelname)s] [%(name)s] %(filename)s[line:%(lineno)d] [%(threadName)s] %(message)s'
-            fmt = '%(asctime)s [%(levelname)s] [%(name)s] %(message)s'
-            formatter = logging.Formatter(fmt)
-
-            ch = logging.StreamHandler()
-            ch.setLevel(Log.__get_log_level())
-            ch.setFormatter(formatter)
-            logger.addHandler(ch)
-
-            coloredlogs.install(fmt=fmt, level=Log.__get_log_level(), logger=logger)
+            logger = logging.getLogger(name)
+            logger.setLevel(Log.__get_log_level())
+            logger.addHandler(cls.__get_queue_handler())
+            # 不再传给root logger：ComfyUI在root上装了同步的StreamHandler，会在调用线程上再格式化、输出一遍
+            logger.propagate = False
 
             # fh = TimedRotatingFileHandler(log_file, when='M', interval=1, backupCount=7, encoding='utf-8')
             # fh.setLevel(Log.__get_log_level())
@@ -54,7 +89,151 @@ class Log:
             # logger.addHandler(fh)
             cls.__instances[name] = logger
 
-        return cls.__instances[name]
+        return logger
+
+    @classmethod
+    @contextmanager
+    def context(cls, **fields):
+        """
+        在with块内记录的日志都带上这些字段（prompt_id / node / phase），嵌套时内层覆盖外层；
+        字段在调用日志的线程上写入记录，JSON格式时输出
+        :param fields: 值为None的字段忽略
+        """
+        current = cls.__context.get()
+        values = {key: value for key, value in fields.items() if key in cls.CONTEXT_FIELDS and value is not None}
+        token = cls.__context.set(dict(current, **values))
+        try:
+            yield
+        finally:
+            cls.__context.reset(token)
+
+    @classmethod
+    def contextual(cls, node: str = None, phase: str = None, prompt_id_arg: str = 'prompt_id'):
+        """
+        装饰器：函数执行期间使用Log.context，prompt id从同名的关键字参数中取得
+        :param node: 节点名
+        :param phase: 阶段名
+        :param prompt_id_arg: prompt id所在的关键字参数名
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                prompt_id = kwargs.get(prompt_id_arg) or None
+                with cls.context(prompt_id=prompt_id, node=node, phase=phase):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    @classmethod
+    def get_context(cls) -> dict:
+        return dict(cls.__context.get())
+
+    @classmethod
+    def set_rate_limit(cls, window: Optional[float], burst: Optional[int], logger_name: Optional[str] = None,
+                       key: Optional[str] = None):
+        """
+        设置重复日志的限流规则：每window秒内同一logger、同一消息key的日志只输出前burst条，其余汇总成一条。
+        默认规则来自环境变量KL_LOG_RATE_WINDOW（秒，默认60）和KL_LOG_RATE_BURST（默认5）
+        :param window: 窗口秒数，为0时不限流；window和burst都为None时删除这条规则
+        :param burst: 每个窗口内输出的条数，为0时不限流
+        :param logger_name: 只对这个logger生效，None表示所有logger
+        :param key: 只对这个消息key生效（记录日志时用 extra={'log_key': key} 指定），None表示所有消息；
+                    logger_name和key都为None时修改默认规则
+        """
+        with cls.__lock:
+            cls.__get_queue_handler()
+        cls.__rate_limit.set_rule(window, burst, logger_name=logger_name, key=key)
+
+    @classmethod
+    def shutdown(cls):
+        """
+        停止后台监听线程，被限流的日志汇总和队列中已有的记录会先全部输出（进程退出时自动调用）。
+        之后再有日志时重新启动监听线程
+        """
+        if cls.__rate_limit is not None:
+            cls.__rate_limit.flush()
+        with cls.__lock:
+            listener, cls.__listener = cls.__listener, None
+        if listener is not None:
+            listener.stop()
+
+    @classmethod
+    def __get_queue_handler(cls) -> logging.Handler:
+        """
+        调用方需持有cls.__lock
+        :return: 所有logger共用的QueueHandler，第一次调用时创建；监听线程等到第一条日志入队时才启动
+        """
+        if cls.__queue_handler is None:
+            cls.__queue = queue.SimpleQueue()
+            cls.__queue_handler = _ContextQueueHandler(cls.__queue, cls.__context, cls.__ensure_listener)
+            # 限流在调用线程上完成，被抑制的记录不会进入队列
+            cls.__rate_limit = RateLimitFilter(
+                window=EnvUtil.get_number(cls.__ENV_LOG_RATE_WINDOW__, cls.DEFAULT_RATE_WINDOW),
+                burst=EnvUtil.get_int(cls.__ENV_LOG_RATE_BURST__, cls.DEFAULT_RATE_BURST),
+                max_keys=cls.RATE_LIMIT_MAX_KEYS, emit=cls.__queue_handler.handle)
+            cls.__queue_handler.addFilter(cls.__rate_limit)
+            atexit.register(cls.shutdown)
+        return cls.__queue_handler
+
+    @classmethod
+    def __ensure_listener(cls):
+        if cls.__listener is not None:
+            return
+        with cls.__lock:
+            if cls.__listener is not None:
+                return
+            listener = logging.handlers.QueueListener(cls.__queue, *cls.__create_handlers(),
+                                                      respect_handler_level=True)
+            try:
+                listener.start()
+            except RuntimeError:
+                # 解释器退出过程中不能再创建线程，记录留在队列中
+                return
+            cls.__listener = listener
+
+    @classmethod
+    def __create_handlers(cls) -> list:
+        """
+        :return: 监听线程中实际输出的handler
+        """
+        use_json = os.getenv(cls.__ENV_LOG_FORMAT__, cls.FORMAT_TEXT).strip().lower() == cls.FORMAT_JSON
+        coloredlogs = None
+        if not use_json:
+            import colorama
+            import coloredlogs
+            # colorama替换sys.stderr后再创建StreamHandler（Windows控制台输出颜色）
+            colorama.init()
+
+        ch = logging.StreamHandler()
+        ch.setLevel(Log.__get_log_level())
+        if use_json:
+            ch.setFormatter(JsonFormatter())
+        elif coloredlogs.terminal_supports_colors(ch.stream):
+            ch.setFormatter(coloredlogs.ColoredFormatter(fmt=cls.FMT, field_styles=cls.FIELD_STYLES))
+        else:
+            ch.setFormatter(logging.Formatter(cls.FMT))
+        handlers = [ch]
+
+        log_file = os.getenv(cls.__ENV_LOG_FILE__, '').strip()
+        if log_file != '':
+            backups = EnvUtil.get_int(cls.__ENV_LOG_FILE_BACKUPS__, 7)
+            try:
+                # 轮转出来的旧文件在后台线程中压缩
+                fh = GzipTimedRotatingFileHandler(
+                    log_file, when=os.getenv(cls.__ENV_LOG_FILE_WHEN__, 'midnight'), backup_count=max(backups, 0))
+            except (OSError, ValueError) as e:
+                ch.handle(logging.makeLogRecord({
+                    'name': 'Log', 'msg': 'cannot open log file {}: {}'.format(log_file, e),
+                    'levelno': logging.ERROR, 'levelname': 'ERROR',
+                }))
+            else:
+                fh.setLevel(Log.__get_log_level())
+                fh.setFormatter(JsonFormatter() if use_json else logging.Formatter(cls.FMT))
+                handlers.append(fh)
+
+        return handlers
 
     @staticmethod  # 设置日志等级
     def __get_log_level():
@@ -77,6 +256,37 @@ class Log:
             return os.path.split(abs_path)[0]
 
 
+class _ContextQueueHandler(logging.handlers.QueueHandler):
+    """
+    在调用日志的线程上把Log.context的字段写入记录，再放入队列（监听线程在第一次入队时启动）；
+    消息在这里合并好参数，异常堆栈转为文本，保留在exc_text中交给监听线程的formatter输出
+    """
+
+    def __init__(self, log_queue, context: contextvars.ContextVar, ensure_listener):
+        super().__init__(log_queue)
+        self.context = context
+        self.ensure_listener = ensure_listener
+
+    def enqueue(self, record: logging.LogRecord):
+        self.ensure_listener()
+        super().enqueue(record)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        for key, value in self.context.get().items():
+            if getattr(record, key, None) is None:
+                setattr(record, key, value)
+
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
 # if __name__ == '__main__':
 #     logger = Log.get_logger('test')
 #     logger.info('this is info')
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+import datetime
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    每条记录输出一行JSON，便于日志管道解析。
+    除时间、级别、logger名、线程和消息外，记录上有prompt_id / node / phase / duration时一并输出
+    （由Log.context注入，duration可通过 extra={'duration': 秒} 传入）
+    """
+    CONTEXT_FIELDS = ('prompt_id', 'node', 'phase')
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': datetime.datetime.fromtimestamp(record.created).astimezone().isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        for field in self.CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None and value != '':
+                data[field] = value
+
+        duration = getattr(record, 'duration', None)
+        if isinstance(duration, (int, float)):
+            data['duration'] = round(float(duration), 6)
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+        if record.stack_info:
+            data['stack'] = self.formatStack(record.stack_info)
+
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class GzipTimedRotatingFileHandler(logging.handlers.TimedRotatingFileHandler):
+    """
+    按时间轮转的日志文件，轮转出来的旧文件在后台线程中压缩为.gz。
+    轮转时只做一次rename，压缩和删除原文件都不占用写日志的线程
+    """
+    COMPRESS_TIMEOUT = 30
+
+    def __init__(self, filename: str, when: str = 'midnight', backup_count: int = 7, **kwargs):
+        directory = os.path.dirname(os.path.abspath(filename))
+        if not os.path.isdir(directory):
+            os.makedirs(directory, mode=0o755, exist_ok=True)
+
+        super().__init__(filename, when=when, backupCount=backup_count, encoding='utf-8', delay=True, **kwargs)
+        self.namer = self.__gzip_name__
+        self.rotator = self.__rotate__
+        self.__pending = queue.Queue()
+        self.__compressor = None
+        self.__compressor_lock = threading.Lock()
+
+    def close(self):
+        """
+        关闭文件，并等待已轮转的文件压缩完成（最多COMPRESS_TIMEOUT秒）
+        """
+        super().close()
+        with self.__compressor_lock:
+            compressor = self.__compressor
+            self.__compressor = None
+        if compressor is not None:
+            self.__pending.put(None)
+            compressor.join(self.COMPRESS_TIMEOUT)
+
+    @staticmethod
+    def __gzip_name__(name: str) -> str:
+        return name + '.gz'
+
+    def __rotate__(self, source: str, dest: str):
+        """
+        :param source: 当前日志文件
+        :param dest: 压缩后的文件名（namer已加上.gz）
+        """
+        if not os.path.exists(source):
+            return
+
+        plain = dest[:-len('.gz')]
+        os.replace(source, plain)
+        self.__pending.put((plain, dest))
+        with self.__compressor_lock:
+            if self.__compressor is None:
+                self.__compressor = threading.Thread(
+                    target=self.__compress_loop__, name='KLLogCompressor', daemon=True)
+                self.__compressor.start()
+
+    def __compress_loop__(self):
+        while True:
+            job = self.__pending.get()
+            if job is None:
+                break
+
+            plain, dest = job
+            try:
+                with open(plain, 'rb') as src, gzip.open(dest + '.tmp', 'wb') as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+                os.replace(dest + '.tmp', dest)
+                os.remove(plain)
+            except OSError as e:
+                # 这里不能再写日志（会回到同一个handler），直接输出到stderr
+                logging.lastResort.handle(logging.makeLogRecord({
+                    'msg': 'failed to compress rotated log {}: {}'.format(plain, e), 'levelno': logging.ERROR,
+                    'levelname': 'ERROR',
+                }))
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    WARNING及以上级别的日志按 (logger名, 消息key) 限流：每个窗口内前burst条正常输出，其余只计数，
+    窗口结束后输出一条带重复次数的汇总（有被抑制的记录时由后台定时线程在窗口结束时输出，不依赖后续日志）。
+    消息key默认取消息首行并把数字、十六进制串（如uuid、端口、耗时）替换掉，也可以通过 extra={'log_key': ...} 指定。
+    同时最多跟踪max_keys个key，超出时淘汰最早的，内存占用固定
+    """
+    SUMMARY_ATTR = 'kl_rate_summary'
+    KEY_ATTR = 'log_key'
+    MAX_KEY_CHARS = 160
+    NORMALIZE_PATTERN = re.compile(r'\b[0-9a-fA-F]{8,}\b|\d+')
+
+    def __init__(self, window: float = 60.0, burst: int = 5, max_keys: int = 256, level: int = logging.WARNING,
+                 emit: Optional[Callable[[logging.LogRecord], None]] = None):
+        """
+        :param window: 窗口秒数，<=0时不限流
+        :param burst: 每个窗口内正常输出的条数，<=0时不限流
+        :param max_keys: 最多跟踪的key数量
+        :param level: 只对这个级别及以上的日志限流
+        :param emit: 输出汇总记录的函数，为None时汇总丢弃
+        """
+        super().__init__()
+        self.level = level
+        self.max_keys = max(int(max_keys), 1)
+        self.emit = emit
+        self.__default_rule = (float(window), int(burst))
+        self.__rules = {}
+        # (logger名, key) -> [窗口开始时间, 窗口秒数, 已输出条数, 被抑制条数, 最后一条被抑制的消息]
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+        # 有被抑制的记录时才运行的定时线程，所有窗口都汇总完后退出
+        self.__timer = None
+
+    def set_rule(self, window: Optional[float], burst: Optional[int], logger_name: Optional[str] = None,
+                 key: Optional[str] = None):
+        """
+        设置限流规则，查找顺序：logger+key、logger、key、默认规则
+        :param window: 窗口秒数，window和burst都为None时删除这条规则
+        :param burst: 每个窗口内正常输出的条数
+        :param logger_name: logger名，None表示所有logger
+        :param key: 消息key，None表示所有消息
+        """
+        with self.__lock:
+            if logger_name is None and key is None:
+                if window is not None and burst is not None:
+                    self.__default_rule = (float(window), int(burst))
+            elif window is None and burst is None:
+                self.__rules.pop((logger_name, key), None)
+            else:
+                self.__rules[(logger_name, key)] = (float(window or 0), int(burst or 0))
+
+    def get_key(self, record: logging.LogRecord) -> str:
+        key = getattr(record, self.KEY_ATTR, None)
+        if key:
+            return str(key)
+
+        message = record.msg if isinstance(record.msg, str) else str(record.msg)
+        return self.NORMALIZE_PATTERN.sub('#', message.split('\n', 1)[0][:self.MAX_KEY_CHARS])
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < self.level or getattr(record, self.SUMMARY_ATTR, False):
+            return True
+
+        key = self.get_key(record)
+        now = time.monotonic()
+        summaries = []
+        with self.__lock:
+            window, burst = self.__get_rule__(record.name, key)
+            if window <= 0 or burst <= 0:
+                return True
+
+            self.__expire__(now, summaries, (record.name, key))
+            entry = self.__entries.get((record.name, key))
+            if entry is None:
+                entry = self.__entries[(record.name, key)] = [now, window, 0, 0, None]
+                while len(self.__entries) > self.max_keys:
+                    self.__summarize__(self.__entries.popitem(last=False)[1], summaries)
+
+            allowed = entry[2] < burst
+            timer = None
+            if allowed:
+                entry[2] += 1
+            else:
+                entry[3] += 1
+                entry[4] = (record.name, record.levelno, record.getMessage().split('\n', 1)[0])
+                if self.__timer is None:
+                    timer = self.__timer = threading.Thread(
+                        target=self.__timer_loop__, name='KLLogRateLimit', daemon=True)
+
+        if timer is not None:
+            timer.start()
+        self.__emit_summaries__(summaries)
+        return allowed
+
+    def flush_expired(self):
+        """
+        输出所有已结束窗口的汇总
+        """
+        summaries = []
+        now = time.monotonic()
+        with self.__lock:
+            for entry_key, entry in list(self.__entries.items()):
+                if now - entry[0] >= entry[1]:
+                    self.__summarize__(self.__entries.pop(entry_key), summaries)
+        self.__emit_summaries__(summaries)
+
+    def flush(self):
+        """
+        立即输出所有还有被抑制记录的汇总，并清空计数
+        """
+        summaries = []
+        with self.__lock:
+            for entry in self.__entries.values():
+                self.__summarize__(entry, summaries)
+            self.__entries.clear()
+        self.__emit_summaries__(summaries)
+
+    def __timer_loop__(self):
+        while True:
+            with self.__lock:
+                deadlines = [entry[0] + entry[1] for entry in self.__entries.values() if entry[3] > 0]
+                if len(deadlines) == 0:
+                    self.__timer = None
+                    return
+                delay = min(deadlines) - time.monotonic()
+
+            if delay > 0:
+                time.sleep(delay)
+            self.flush_expired()
+
+    def __get_rule__(self, logger_name: str, key: str) -> tuple:
+        for rule_key in ((logger_name, key), (logger_name, None), (None, key)):
+            rule = self.__rules.get(rule_key)
+            if rule is not None:
+                return rule
+        return self.__default_rule
+
+    def __expire__(self, now: float, summaries: list, current: tuple):
+        """
+        调用方需持有self.__lock。按开始时间从最早的开始淘汰已结束的窗口，遇到未结束的即停止；
+        当前key的窗口单独检查
+        """
+        while len(self.__entries) > 0:
+            entry_key, entry = next(iter(self.__entries.items()))
+            if now - entry[0] < entry[1]:
+                break
+            self.__summarize__(self.__entries.pop(entry_key), summaries)
+
+        entry = self.__entries.get(current)
+        if entry is not None and now - entry[0] >= entry[1]:
+            self.__summarize__(self.__entries.pop(current), summaries)
+
+    @staticmethod
+    def __summarize__(entry: list, summaries: list):
+        if entry[3] > 0:
+            name, levelno, message = entry[4]
+            summaries.append(logging.makeLogRecord({
+                'name': name, 'levelno': levelno, 'levelname': logging.getLevelName(levelno),
+                'msg': '{} (suppressed {} similar message(s) in {:.0f}s)'.format(message, entry[3], entry[1]),
+            }))
+
+    def __emit_summaries__(self, summaries: list):
+        if self.emit is None:
+            return
+        for summary in summaries:
+            setattr(summary, self.SUMMARY_ATTR, True)
+            self.emit(summary)
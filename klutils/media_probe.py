@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+import os
+import stat
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from .format_sniffer import FormatSniffer
+from .klLog import Log
+
+
+class MediaInfo:
+    """
+    MediaProbe.probe的结果。文件不存在时exists为False，其余字段为默认值
+    """
+
+    def __init__(self, path: str, exists: bool = False, size: int = 0, mtime_ns: int = 0, inode: int = 0,
+                 real_format: str = '', width: int = 0, height: int = 0, mode: str = ''):
+        self.path = path
+        self.exists = exists
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.inode = inode
+        # 大写的格式名，如 JPEG / PNG / MP4，见FormatSniffer；无法识别时为空字符串
+        self.format = real_format
+        self.width = width
+        self.height = height
+        self.mode = mode
+
+    @property
+    def is_image(self) -> bool:
+        return self.width > 0 and self.height > 0
+
+    @property
+    def is_video(self) -> bool:
+        return FormatSniffer.is_video_format(self.format)
+
+    def __repr__(self) -> str:
+        return 'MediaInfo(path={!r}, exists={}, size={}, format={!r}, {}x{}, mode={!r})'.format(
+            self.path, self.exists, self.size, self.format, self.width, self.height, self.mode)
+
+
+class MediaProbe:
+    """
+    媒体文件探测：每个文件只stat一次、只打开一次，一次性取得是否存在、大小、修改时间、真实格式、尺寸和颜色模式。
+    结果按 (路径, inode, 大小, mtime_ns) 缓存，文件被替换或修改后自动失效；
+    同一次回调中的存在性检查、格式判断、转码前检查都复用同一份结果。
+    """
+    __version__ = '1.0.0'
+    __name__ = 'MediaProbe'
+    __logger__ = Log.get_logger(__name__)
+
+    MAX_ENTRIES = 1024
+
+    __lock = threading.Lock()
+    __cache = OrderedDict()
+    __hits = 0
+    __misses = 0
+
+    @classmethod
+    def probe(cls, path: Optional[str]) -> MediaInfo:
+        """
+        探测文件
+        :param path: 文件路径
+        :return: MediaInfo
+        """
+        if path is None or path == '':
+            return MediaInfo('')
+
+        try:
+            st = os.stat(path)
+        except (OSError, ValueError):
+            return MediaInfo(path)
+        if not stat.S_ISREG(st.st_mode):
+            return MediaInfo(path)
+
+        key = (path, st.st_ino, st.st_size, st.st_mtime_ns)
+        with cls.__lock:
+            info = cls.__cache.get(key)
+            if info is not None:
+                cls.__cache.move_to_end(key)
+                cls.__hits += 1
+                return info
+            cls.__misses += 1
+
+        info = MediaInfo(path, exists=True, size=st.st_size, mtime_ns=st.st_mtime_ns, inode=st.st_ino)
+        try:
+            with open(path, 'rb') as f:
+                cls.__read_media_info__(f, info)
+        except OSError as e:
+            cls.__logger__.error('failed to probe {}: {}'.format(path, e))
+            return MediaInfo(path)
+
+        with cls.__lock:
+            cls.__cache[key] = info
+            while len(cls.__cache) > cls.MAX_ENTRIES:
+                cls.__cache.popitem(last=False)
+
+        return info
+
+    @classmethod
+    def stats(cls) -> dict:
+        with cls.__lock:
+            return {'hits': cls.__hits, 'misses': cls.__misses, 'entries': len(cls.__cache)}
+
+    @classmethod
+    def clear(cls):
+        with cls.__lock:
+            cls.__cache.clear()
+
+    @classmethod
+    def __read_media_info__(cls, f, info: MediaInfo):
+        info.format = FormatSniffer.sniff(f.read(FormatSniffer.HEADER_BYTES))
+        if FormatSniffer.is_video_format(info.format):
+            return
+
+        # Image.open只解析文件头，不解码像素；文件头无法识别时也交给Pillow再判断一次。
+        # 视频不需要Pillow，第一次探测图片时才导入
+        from PIL import Image
+
+        f.seek(0)
+        try:
+            with Image.open(f) as img:
+                # 相机拍的JPEG常带多图扩展，Pillow报告为MPO；文件头已经识别出来的格式优先
+                if img.format and not (img.format == 'MPO' and info.format == FormatSniffer.FORMAT_JPEG):
+                    info.format = img.format
+                info.width, info.height = img.size
+                info.mode = img.mode
+        except Exception:
+            # 不是Pillow能识别的图片（如视频），保留文件头判断的结果
+            pass
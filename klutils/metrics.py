@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+import bisect
+import math
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+
+class Counter:
+    """
+    只增不减的计数器
+    """
+    TYPE = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount: float = 1, *labels):
+        key = tuple(str(label) for label in labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, *labels) -> float:
+        with self._lock:
+            return self._values.get(tuple(str(label) for label in labels), 0)
+
+    def collect(self) -> List[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            items = list(self._values.items())
+        if len(items) == 0 and len(self.labelnames) == 0:
+            # 没有标签的指标在第一次记录之前也导出0
+            items = [((), 0)]
+        return [(self.name, dict(zip(self.labelnames, key)), value) for key, value in items]
+
+
+class Gauge(Counter):
+    """
+    可增可减的数值；指定callback时在导出时取值，热路径上没有任何开销
+    """
+    TYPE = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 callback: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def set(self, value: float, *labels):
+        key = tuple(str(label) for label in labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1, *labels):
+        self.inc(-amount, *labels)
+
+    def collect(self) -> List[Tuple[str, Dict[str, str], float]]:
+        if self.callback is not None:
+            try:
+                return [(self.name, {}, float(self.callback()))]
+            except Exception:
+                return []
+        return super().collect()
+
+
+class Histogram:
+    """
+    固定分桶的直方图，记录时只做一次二分查找和几次加法
+    """
+    TYPE = 'histogram'
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # 标签 -> [各分桶计数..., +Inf计数, 总和]
+        self._values = {}
+
+    def observe(self, value: float, *labels):
+        key = tuple(str(label) for label in labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = [0] * (len(self.buckets) + 2)
+            values[index] += 1
+            values[-1] += value
+
+    def collect(self) -> List[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            items = [(key, list(values)) for key, values in self._values.items()]
+
+        samples = []
+        for key, values in items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), values[:-1]):
+                cumulative += count
+                samples.append((self.name + '_bucket', dict(labels, le=Metrics.format_value(bound)), cumulative))
+            samples.append((self.name + '_sum', labels, values[-1]))
+            samples.append((self.name + '_count', labels, cumulative))
+        return samples
+
+
+class Metrics:
+    """
+    进程内的运行指标，以Prometheus文本格式导出（见comfy_nodes/server_routes.py的/klnodes/metrics）。
+    指标在这里集中定义，调用方直接使用类属性记录，例如：
+        Metrics.CALLBACK_DURATION.observe(elapsed, '200')
+    """
+    __version__ = '1.0.0'
+    __name__ = 'Metrics'
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+    BYTES_BUCKETS = tuple(float(1 << shift) for shift in range(10, 32, 2))
+    THROUGHPUT_BUCKETS = tuple(float(1 << shift) for shift in range(14, 34, 2))
+
+    CALLBACK_DURATION = Histogram(
+        'klnodes_callback_duration_seconds', 'Callback delivery time including retries.', ('result',))
+    CALLBACK_ATTEMPTS = Counter(
+        'klnodes_callback_attempts_total', 'Callback HTTP attempts by result code.', ('code',))
+    CALLBACK_RETRIES = Counter(
+        'klnodes_callback_retries_total', 'Callback attempts that were retried.')
+    CALLBACK_UPLOAD_BYTES = Counter(
+        'klnodes_callback_upload_bytes_total', 'Request body bytes sent by callback attempts.')
+    CALLBACK_THROUGHPUT = Histogram(
+        'klnodes_callback_upload_throughput_bytes_per_second', 'Upload throughput of successful callbacks.',
+        buckets=THROUGHPUT_BUCKETS)
+    CALLBACK_PAYLOAD_BYTES = Histogram(
+        'klnodes_callback_payload_bytes', 'Request body size of callback attempts.', buckets=BYTES_BUCKETS)
+    TRANSCODE_DURATION = Histogram(
+        'klnodes_transcode_duration_seconds', 'Image transcoding time (cache misses only).', ('format',))
+    DELIVERY_QUEUE_DEPTH = Gauge(
+        'klnodes_delivery_queue_depth', 'Background callback jobs queued or running.')
+    QUEUE_LOOKUP_DURATION = Histogram(
+        'klnodes_queue_lookup_duration_seconds', 'Prompt id lookup time against the ComfyUI queue.', ('result',))
+    UPLOAD_WAIT = Histogram(
+        'klnodes_upload_wait_seconds', 'Time an upload waited for a concurrency slot and bandwidth.')
+    QUEUE_SNAPSHOT_LOOKUPS = Counter(
+        'klnodes_queue_snapshot_lookups_total', 'Shared /queue snapshot lookups by result (hit, miss, coalesced).',
+        ('result',))
+
+    __lock = threading.Lock()
+    __metrics = [CALLBACK_DURATION, CALLBACK_ATTEMPTS, CALLBACK_RETRIES, CALLBACK_UPLOAD_BYTES, CALLBACK_THROUGHPUT,
+                 CALLBACK_PAYLOAD_BYTES, TRANSCODE_DURATION, DELIVERY_QUEUE_DEPTH, QUEUE_LOOKUP_DURATION, UPLOAD_WAIT,
+                 QUEUE_SNAPSHOT_LOOKUPS]
+
+    @classmethod
+    def register(cls, metric):
+        """
+        注册额外的指标（Counter / Gauge / Histogram），同名指标只保留第一个
+        :return: 实际生效的指标对象
+        """
+        with cls.__lock:
+            for existing in cls.__metrics:
+                if existing.name == metric.name:
+                    return existing
+            cls.__metrics.append(metric)
+        return metric
+
+    @classmethod
+    def render(cls) -> str:
+        """
+        :return: Prometheus文本格式的全部指标
+        """
+        with cls.__lock:
+            metrics = list(cls.__metrics)
+
+        lines = []
+        for metric in metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.documentation.replace('\n', ' ')))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.TYPE))
+            for name, labels, value in metric.collect():
+                if labels:
+                    label_text = ','.join('{}="{}"'.format(k, cls.__escape__(v)) for k, v in labels.items())
+                    lines.append('{}{{{}}} {}'.format(name, label_text, cls.format_value(value)))
+                else:
+                    lines.append('{} {}'.format(name, cls.format_value(value)))
+        lines.append('')
+        return '\n'.join(lines)
+
+    @staticmethod
+    def format_value(value: float) -> str:
+        if value == math.inf:
+            return '+Inf'
+        if isinstance(value, int) or float(value).is_integer():
+            return str(int(value))
+        return repr(float(value))
+
+    @staticmethod
+    def __escape__(value: str) -> str:
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
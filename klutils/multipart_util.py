@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+import http.client
+import os
+import socket
+import uuid
+from typing import Callable, Iterator, Optional, Union
+from urllib.parse import urlparse
+
+from .klLog import Log
+
+
+class UploadResponse:
+    """
+    sendfile上传的响应，提供回调代码用到的requests.Response同名属性
+    """
+
+    def __init__(self, status_code: int, content: bytes, headers: dict):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+
+    @property
+    def text(self) -> str:
+        return self.content.decode('utf-8', errors='replace')
+
+
+class MultipartEncoder:
+    """
+    流式multipart/form-data请求体。
+    以类文件对象的形式提供给requests（read + __len__），按固定大小的块从磁盘读取文件，
+    内存占用与文件大小无关；纯http目标还可以通过post_with_sendfile由内核直接发送文件内容。
+    """
+    __version__ = '1.0.0'
+    __name__ = 'MultipartEncoder'
+    __logger__ = Log.get_logger(__name__)
+
+    DEFAULT_CHUNK_SIZE = 64 * 1024
+    # 请求体小于该值时走连接池更划算，超过时才值得为sendfile单独建连接
+    SENDFILE_MIN_BYTES = 8 * 1024 * 1024
+    # 设置了限速时sendfile按该大小分段发送
+    SENDFILE_SLICE_BYTES = 1024 * 1024
+
+    def __init__(self, fields: Optional[dict] = None, files: Optional[dict] = None,
+                 boundary: Optional[str] = None, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        """
+        :param fields: 普通表单字段，name -> value
+        :param files: 文件字段，name -> (filename, source, content_type)，source为文件路径或bytes
+        :param boundary: 分隔符，默认随机生成
+        :param chunk_size: 读取文件的块大小
+        """
+        self.boundary = boundary if boundary else uuid.uuid4().hex
+        self.chunk_size = chunk_size if isinstance(chunk_size, int) and chunk_size > 0 else self.DEFAULT_CHUNK_SIZE
+
+        # 每个片段为bytes，或(文件路径, 文件大小)
+        self.__segments = []
+        for name, value in (fields or {}).items():
+            self.__segments.append(self.__part_header__(name) + b'\r\n' + str(value).encode('utf-8') + b'\r\n')
+        for name, (filename, source, content_type) in (files or {}).items():
+            self.__segments.append(self.__part_header__(name, filename, content_type) + b'\r\n')
+            if isinstance(source, (bytes, bytearray, memoryview)):
+                self.__segments.append(bytes(source))
+            else:
+                self.__segments.append((source, os.path.getsize(source)))
+            self.__segments.append(b'\r\n')
+        self.__segments.append('--{}--\r\n'.format(self.boundary).encode('ascii'))
+
+        self.__length = sum(len(s) if isinstance(s, bytes) else s[1] for s in self.__segments)
+        self.__index = 0
+        self.__offset = 0
+        self.__file = None
+        # 限速回调，每读出一段数据后以字节数调用，见UploadPermit.throttle
+        self.throttle: Optional[Callable[[int], None]] = None
+
+    @property
+    def content_type(self) -> str:
+        return 'multipart/form-data; boundary={}'.format(self.boundary)
+
+    @property
+    def len(self) -> int:
+        return self.__length
+
+    def __len__(self) -> int:
+        return self.__length
+
+    def __iter__(self) -> Iterator[bytes]:
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def read(self, size: int = -1) -> bytes:
+        """
+        读取请求体的下一段
+        :param size: 最多读取的字节数，<0 表示读取剩余全部内容（仅用于小请求体）
+        :return: bytes，读完时返回空bytes
+        """
+        if size is None or size < 0:
+            size = self.__length
+
+        out = []
+        remaining = size
+        while remaining > 0 and self.__index < len(self.__segments):
+            segment = self.__segments[self.__index]
+            segment_length = len(segment) if isinstance(segment, bytes) else segment[1]
+            if self.__offset >= segment_length:
+                self.__next_segment__()
+                continue
+
+            if isinstance(segment, bytes):
+                data = segment[self.__offset:self.__offset + remaining]
+            else:
+                if self.__file is None:
+                    self.__file = open(segment[0], 'rb')
+                    self.__file.seek(self.__offset)
+                # 只读到片段末尾：文件在编码后变大时，多出的内容不能写进请求体
+                data = self.__file.read(min(remaining, self.chunk_size, segment_length - self.__offset))
+                if not data:
+                    # 文件在编码后被截断，Content-Length已经按原大小发出，继续发送会让请求体错位
+                    raise OSError('{} shrank while uploading: expected {} bytes, got {}'.format(
+                        segment[0], segment_length, self.__offset))
+
+            if self.throttle is not None:
+                self.throttle(len(data))
+            out.append(data)
+            remaining -= len(data)
+            self.__offset += len(data)
+            if self.__offset >= segment_length:
+                self.__next_segment__()
+
+        return b''.join(out)
+
+    def iter_segments(self) -> Iterator[Union[bytes, tuple]]:
+        """
+        按顺序返回请求体的各个片段：bytes，或(文件路径, 偏移, 长度)
+        """
+        for segment in self.__segments:
+            if isinstance(segment, bytes):
+                yield segment
+            else:
+                yield segment[0], 0, segment[1]
+
+    def reset(self):
+        """
+        回到请求体开头，用于重试
+        """
+        self.close()
+        self.__index = 0
+        self.__offset = 0
+
+    def close(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+    @staticmethod
+    def __check_sent__(file_path: str, expected: int, sent: int):
+        """
+        sendfile读到文件末尾时会少发，说明文件在编码后被截断
+        """
+        if sent != expected:
+            raise OSError('{} shrank while uploading: expected {} bytes, sent {}'.format(file_path, expected, sent))
+
+    def __next_segment__(self):
+        self.close()
+        self.__index += 1
+        self.__offset = 0
+
+    def __part_header__(self, name: str, filename: Optional[str] = None, content_type: Optional[str] = None) -> bytes:
+        disposition = 'form-data; name="{}"'.format(self.__quote__(name))
+        if filename is not None:
+            disposition += '; filename="{}"'.format(self.__quote__(filename))
+        header = '--{}\r\nContent-Disposition: {}\r\n'.format(self.boundary, disposition)
+        if content_type:
+            header += 'Content-Type: {}\r\n'.format(content_type)
+        return header.encode('utf-8')
+
+    @staticmethod
+    def __quote__(value: str) -> str:
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\r', ' ').replace('\n', ' ')
+
+    @classmethod
+    def can_sendfile(cls, url: str) -> bool:
+        """
+        :return: 目标地址是否可以走sendfile（纯http、系统支持os.sendfile，且没有配置代理；
+            sendfile直连目标主机，走代理的请求交给requests发送）
+        """
+        parsed = urlparse(url)
+        if not hasattr(os, 'sendfile') or parsed.scheme.lower() != 'http':
+            return False
+
+        # 只在真正要判断时才导入，urllib.request导入较慢
+        import urllib.request
+        proxies = urllib.request.getproxies()
+        if not proxies.get('http') and not proxies.get('all'):
+            return True
+        return bool(urllib.request.proxy_bypass(parsed.hostname or ''))
+
+    @classmethod
+    def post_with_sendfile(cls, url: str, encoder: 'MultipartEncoder', timeout: float = 60,
+                           headers: Optional[dict] = None) -> UploadResponse:
+        """
+        用sendfile发送multipart请求体：表单头部用sendall，文件内容由内核直接从页缓存发送，
+        不经过用户态缓冲。错误统一转换成requests的异常类型，便于调用方按原有方式处理
+        :param url: 纯http地址
+        :param encoder: 请求体
+        :param timeout: 超时秒数
+        :param headers: 额外的请求头
+        :return: UploadResponse
+        """
+        parsed = urlparse(url)
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+
+        conn = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=timeout)
+        try:
+            conn.putrequest('POST', path, skip_accept_encoding=True)
+            for key, value in (headers or {}).items():
+                conn.putheader(key, value)
+            conn.putheader('Content-Type', encoder.content_type)
+            conn.putheader('Content-Length', str(len(encoder)))
+            conn.putheader('Connection', 'close')
+            conn.endheaders()
+
+            for segment in encoder.iter_segments():
+                if isinstance(segment, bytes):
+                    if encoder.throttle is not None:
+                        encoder.throttle(len(segment))
+                    conn.sock.sendall(segment)
+                    continue
+
+                file_path, offset, count = segment
+                with open(file_path, 'rb') as f:
+                    if encoder.throttle is None:
+                        cls.__check_sent__(file_path, count, conn.sock.sendfile(f, offset, count))
+                        continue
+
+                    # 限速时分段sendfile，每段之前先取得带宽
+                    end = offset + count
+                    while offset < end:
+                        size = min(cls.SENDFILE_SLICE_BYTES, end - offset)
+                        encoder.throttle(size)
+                        cls.__check_sent__(file_path, size, conn.sock.sendfile(f, offset, size))
+                        offset += size
+
+            response = conn.getresponse()
+            return UploadResponse(response.status, response.read(), dict(response.getheaders()))
+        except socket.timeout as e:
+            # 转换为requests的异常，回调代码按同样的方式处理
+            import requests
+            raise requests.exceptions.Timeout(str(e))
+        except (OSError, http.client.HTTPException) as e:
+            import requests
+            raise requests.exceptions.ConnectionError(str(e))
+        finally:
+            conn.close()
@@ -1,11 +1,14 @@
 # -*- coding: utf-8 -*-
-import imghdr
-
-from PIL import Image
+import io
+import time
 
 from .klLog import Log
 from .string_util import StringUtil
 from .file_util import FileUtil
+from .format_sniffer import FormatSniffer
+from .media_probe import MediaProbe
+from .metrics import Metrics
+from .transcode_cache import TranscodeCache
 
 
 class PictureUtils:
@@ -17,9 +20,15 @@ class PictureUtils:
     IMG_FORMAT_GIF = 'GIF'
     IMG_FORMAT_JPEG = 'JPEG'
     IMG_FORMAT_PNG = 'PNG'
-    IMG_FORMAT_BMP = 'BMP',
+    IMG_FORMAT_BMP = 'BMP'
     IMG_FORMAT_UNKNOWN = 'unknown'
 
+    # 支持quality参数的格式
+    QUALITY_IMG_FORMATS = (IMG_FORMAT_JPEG, IMG_FORMAT_WEBP)
+    BUDGET_DEFAULT_QUALITY = 90
+    BUDGET_MIN_QUALITY = 30
+    BUDGET_MAX_DOWNSCALES = 3
+
     @classmethod
     def get_supported_img_formats(cls) -> list:
         return [
@@ -34,13 +43,13 @@ class PictureUtils:
         :param image_file_path: 图片路径
         :return:
         """
-        if FileUtil.check_file_exist(image_file_path) is False:
+        # 文件头和Pillow的判断由MediaProbe一次完成并缓存，同一文件多次调用不会重复读取
+        media_info = MediaProbe.probe(image_file_path)
+        if media_info.exists is False:
             cls.__logger__.error('图片文件【{}】不存在，无法检查其真实类型！'.format(image_file_path))
             return cls.IMG_FORMAT_UNKNOWN
 
-        img_type = cls.get_image_real_format_with_imghdr(image_file_path=image_file_path)
-        if StringUtil.is_string_empty(img_type):
-            img_type = cls.get_image_real_format_with_pillow(image_file_path)
+        img_type = media_info.format
 
         if img_type.upper() in cls.get_supported_img_formats():
             return img_type.upper()
@@ -50,15 +59,23 @@ class PictureUtils:
 
     @classmethod
     def get_image_real_format_with_imghdr(cls, image_file_path: str) -> str:
-        return imghdr.what(image_file_path)
+        """
+        按文件头判断图片格式。imghdr已废弃（Python 3.13移除），保留方法名，改用FormatSniffer实现
+        :return: 小写的格式名（与imghdr一致），无法识别时返回None
+        """
+        real_format = FormatSniffer.sniff_file(image_file_path)
+        return real_format.lower() if FormatSniffer.is_image_format(real_format) else None
 
     @classmethod
     def get_image_real_format_with_pillow(cls, image_file_path: str) -> str:
+        # Pillow只在真正处理图片时才导入，减少节点包的导入时间
+        from PIL import Image
+
         try:
             image = Image.open(image_file_path)
             image_format = image.format
         except Exception as e:
-            cls.__logger__.exception('', e)
+            cls.__logger__.exception('failed to read image format of {}: {}'.format(image_file_path, e))
             image_format = ''
 
         return image_format
@@ -76,7 +93,7 @@ class PictureUtils:
             cls.__logger__.error(u'原图片路径为空，无法进行格式转换！')
             return False
 
-        if not FileUtil.check_file_exist(src_path):
+        if not MediaProbe.probe(src_path).exists:
             cls.__logger__.error(u'原图片【{}】不存在，无法进行格式转换！'.format(src_path))
             return False
 
@@ -98,11 +115,139 @@ class PictureUtils:
         if StringUtil.equals_ignore_case(output_format, real_format):
             return FileUtil.copy_file(src_file=src_path, dst_file=output_path)
 
+        from PIL import Image
+
         try:
             with Image.open(src_path) as img:
                 # 保存
-                img.save(output_path, output_format.lower())
+                cls.__save_image__(img, output_path, output_format)
         except Exception as e:
-            cls.__logger__.exception('', e)
+            cls.__logger__.exception('failed to convert image {}: {}'.format(src_path, e))
 
         return FileUtil.check_file_exist(output_path)
+
+    @classmethod
+    def convert_pic_format_to_bytes(cls, src_path: str, output_format: str, use_cache: bool = True,
+                                    max_dimension: int = 0, max_bytes: int = 0, quality: int = 0) -> bytes:
+        """
+        在内存中进行图片格式转换，不产生临时文件
+        :param src_path: 图片源文件路径
+        :param output_format: 输出图片格式
+        :param use_cache: 是否使用转码缓存（按源文件内容哈希命中，同一图片多次回调或重试时不再重复编码）
+        :param max_dimension: 长边的最大像素数，超过则等比缩小，0为不限制
+        :param max_bytes: 输出的最大字节数，超过时二分查找质量、必要时再缩小尺寸，0为不限制
+        :param quality: 编码质量（JPEG/WEBP，1-100），设置了max_bytes时为质量上限，0为Pillow默认值
+        :return: 转换后的图片数据，失败时返回空bytes
+        """
+        if StringUtil.is_string_empty(src_path):
+            cls.__logger__.error(u'原图片路径为空，无法进行格式转换！')
+            return b''
+
+        media_info = MediaProbe.probe(src_path)
+        if not media_info.exists:
+            cls.__logger__.error(u'原图片【{}】不存在，无法进行格式转换！'.format(src_path))
+            return b''
+
+        if output_format not in cls.get_supported_img_formats():
+            cls.__logger__.error(u'输出图片格式【{}】有误，无法进行格式转换'.format(output_format))
+            return b''
+
+        budget = {
+            'max_dimension': max(0, max_dimension or 0),
+            'max_bytes': max(0, max_bytes or 0),
+            'quality': min(100, max(0, quality or 0)),
+        }
+
+        # 取源图片的真实格式，格式相同且没有预算限制则直接返回原始数据
+        real_format = cls.get_image_real_format(image_file_path=src_path)
+        if StringUtil.equals_ignore_case(output_format, real_format) \
+                and budget['max_dimension'] == 0 and budget['quality'] == 0 \
+                and (budget['max_bytes'] == 0 or media_info.size <= budget['max_bytes']):
+            with open(src_path, 'rb') as f:
+                return f.read()
+
+        def encode() -> bytes:
+            from PIL import Image
+
+            started = time.perf_counter()
+            try:
+                with Image.open(src_path) as img:
+                    return cls.__encode_with_budget__(img, output_format, **budget)
+            except Exception as e:
+                cls.__logger__.exception('failed to transcode image {}: {}'.format(src_path, e))
+                return b''
+            finally:
+                Metrics.TRANSCODE_DURATION.observe(time.perf_counter() - started, output_format)
+
+        if not use_cache:
+            return encode()
+
+        return TranscodeCache.get_instance().get_or_create(src_path, output_format, budget, encode)
+
+    @classmethod
+    def __encode_with_budget__(cls, img, output_format: str, max_dimension: int = 0, max_bytes: int = 0,
+                               quality: int = 0) -> bytes:
+        """
+        按预算编码：先按长边缩小，再在[MIN_QUALITY, 质量上限]内二分查找不超过max_bytes的最高质量；
+        最低质量仍然超出时按字节比例缩小尺寸后再查找，最多BUDGET_MAX_DOWNSCALES轮
+        :return: 编码结果，无法满足预算时返回尝试过的最小结果
+        """
+        from PIL import Image
+
+        if max_dimension > 0 and max(img.size) > max_dimension:
+            img = img.copy()
+            img.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+        has_quality = output_format in cls.QUALITY_IMG_FORMATS
+        if max_bytes <= 0 or not has_quality:
+            top_quality = quality
+        else:
+            top_quality = quality if quality > 0 else cls.BUDGET_DEFAULT_QUALITY
+
+        smallest = b''
+        for _ in range(cls.BUDGET_MAX_DOWNSCALES + 1):
+            data = cls.__encode_image__(img, output_format, top_quality)
+            if max_bytes <= 0 or len(data) <= max_bytes:
+                return data
+            smallest = data if not smallest or len(data) < len(smallest) else smallest
+
+            if has_quality:
+                best = b''
+                low, high = cls.BUDGET_MIN_QUALITY, top_quality - 1
+                while low <= high:
+                    middle = (low + high) // 2
+                    candidate = cls.__encode_image__(img, output_format, middle)
+                    if len(candidate) <= max_bytes:
+                        best = candidate
+                        low = middle + 1
+                    else:
+                        smallest = candidate if len(candidate) < len(smallest) else smallest
+                        high = middle - 1
+                if best:
+                    return best
+
+            # 最低质量仍然超出，字节数大致与面积成正比，按比例缩小边长
+            scale = (max_bytes / float(len(smallest))) ** 0.5 * 0.9
+            width, height = max(16, int(img.size[0] * scale)), max(16, int(img.size[1] * scale))
+            if (width, height) == img.size:
+                break
+            img = img.resize((width, height), Image.LANCZOS)
+
+        cls.__logger__.warning(u'图片无法压缩到{}字节以内，使用最小结果{}字节'.format(max_bytes, len(smallest)))
+        return smallest
+
+    @classmethod
+    def __encode_image__(cls, img, output_format: str, quality: int = 0) -> bytes:
+        buffer = io.BytesIO()
+        cls.__save_image__(img, buffer, output_format, quality)
+        return buffer.getvalue()
+
+    @classmethod
+    def __save_image__(cls, img, fp, output_format: str, quality: int = 0):
+        # JPEG不支持透明通道和调色板，先转成RGB
+        if output_format == cls.IMG_FORMAT_JPEG and img.mode not in ('RGB', 'L', 'CMYK'):
+            img = img.convert('RGB')
+        if quality > 0 and output_format in cls.QUALITY_IMG_FORMATS:
+            img.save(fp, output_format.lower(), quality=quality)
+        else:
+            img.save(fp, output_format.lower())
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+import copy
+import json
+import re
+import threading
+import time
+from typing import List, Optional
+
+from .env_util import EnvUtil
+from .http_util import HttpSessionPool
+from .klLog import Log
+from .metrics import Metrics
+
+
+class QueueSnapshotCache:
+    """
+    ComfyUI /queue 查询结果的共享缓存：
+    - 同一地址的结果在TTL内直接复用（KL_QUEUE_SNAPSHOT_TTL，秒，默认0.5）
+    - single-flight：缓存过期时只有一个线程发请求，同时到达的其他线程等待这次请求的结果
+    - 轻量解析：只扫描出queue_running中各项的prompt id，不构建完整的工作流字典（queue_pending可能非常大）
+    """
+    __version__ = '1.0.0'
+    __name__ = 'QueueSnapshotCache'
+    __logger__ = Log.get_logger(__name__)
+
+    __ENV_TTL__ = 'KL_QUEUE_SNAPSHOT_TTL'
+
+    DEFAULT_TTL = 0.5
+    REQUEST_TIMEOUT = 10
+    KEY_QUEUE_RUNNING = '"queue_running"'
+    # 字符串（含转义）或括号，其余内容（数字、冒号、逗号、空白）直接跳过
+    TOKEN_PATTERN = re.compile(r'"(?:[^"\\]|\\.)*"|[\[\]{}]')
+
+    __lock = threading.Lock()
+    __entries = {}
+    __hits = 0
+    __misses = 0
+    __coalesced = 0
+
+    @classmethod
+    def get_running_prompt_ids(cls, url: str, headers: Optional[dict] = None, ttl: Optional[float] = None) -> List[str]:
+        """
+        获取正在执行的prompt id列表
+        :param url: /queue 接口地址
+        :param headers: 请求头（如认证信息）
+        :param ttl: 缓存秒数，默认读取环境变量KL_QUEUE_SNAPSHOT_TTL
+        :return: prompt id列表；接口返回非200时返回空列表，请求异常时抛出（同时等待的调用方各自抛出同类型的新异常，
+                 __cause__为这次请求的异常），
+                 等待进行中的请求超时时抛出TimeoutError
+        """
+        if ttl is None or ttl < 0:
+            ttl = cls.get_ttl()
+
+        with cls.__lock:
+            entry = cls.__entries.get(url)
+            if entry is not None and entry['event'] is None and time.monotonic() - entry['time'] <= ttl:
+                cls.__hits += 1
+                Metrics.QUEUE_SNAPSHOT_LOOKUPS.inc(1, 'hit')
+                return list(entry['ids'])
+
+            if entry is not None and entry['event'] is not None:
+                # 已有请求在进行中，等它的结果
+                cls.__coalesced += 1
+                Metrics.QUEUE_SNAPSHOT_LOOKUPS.inc(1, 'coalesced')
+                event = entry['event']
+                leader = False
+            else:
+                cls.__misses += 1
+                Metrics.QUEUE_SNAPSHOT_LOOKUPS.inc(1, 'miss')
+                event = threading.Event()
+                entry = cls.__entries[url] = {'time': 0.0, 'ids': [], 'error': None, 'event': event}
+                leader = True
+
+        if not leader:
+            # 结果从等待前拿到的entry中读取：请求失败时leader会把它从缓存中移除
+            if not event.wait(cls.REQUEST_TIMEOUT * 2):
+                cls.__logger__.warning('timed out waiting for the in-flight /queue request to {}'.format(url))
+                raise TimeoutError('timed out waiting for the in-flight /queue request')
+            with cls.__lock:
+                error, ids = entry['error'], list(entry['ids'])
+            if error is not None:
+                raise cls.__follower_error__(error) from error
+            return ids
+
+        ids, error, fetched = [], None, False
+        try:
+            ids = cls.__fetch__(url, headers)
+            fetched = True
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            # BaseException（如KeyboardInterrupt）也要唤醒等待的调用方，否则它们一直等到超时
+            with cls.__lock:
+                if not fetched and error is None:
+                    error = ConnectionError('the in-flight /queue request was interrupted')
+                entry.update(time=time.monotonic(), ids=ids, error=error, event=None)
+                if error is not None and cls.__entries.get(url) is entry:
+                    # 失败的结果不缓存，下一次调用重新请求
+                    cls.__entries.pop(url, None)
+            event.set()
+
+        return list(ids)
+
+    @classmethod
+    def parse_running_prompt_ids(cls, text: str) -> List[str]:
+        """
+        从/queue的JSON文本中取出queue_running各项的prompt id（每项为 [number, prompt_id, prompt, ...]）。
+        只用正则扫描字符串和括号，不反序列化工作流内容；扫完queue_running即停止
+        :param text: 响应文本
+        :return: prompt id列表
+        """
+        ids = []
+        depth = 0
+        running = False
+        expect_array = False
+        item_id_found = False
+        for match in cls.TOKEN_PATTERN.finditer(text):
+            token = match.group()
+            if token in ('[', '{'):
+                depth += 1
+                if expect_array:
+                    running = token == '['
+                    expect_array = False
+                elif running and depth == 3:
+                    item_id_found = False
+                continue
+
+            if token in (']', '}'):
+                depth -= 1
+                if running and depth == 1:
+                    break
+                continue
+
+            if depth == 1 and not running:
+                expect_array = token == cls.KEY_QUEUE_RUNNING
+            elif running and depth == 3 and not item_id_found:
+                # 每项中的第一个字符串就是prompt id（第0个元素是数字）
+                ids.append(json.loads(token))
+                item_id_found = True
+
+        return ids
+
+    @classmethod
+    def stats(cls) -> dict:
+        """
+        :return: 命中次数、实际请求次数、合并到进行中请求的次数和命中率（后两者都算作没有发出新请求）
+        """
+        with cls.__lock:
+            total = cls.__hits + cls.__misses + cls.__coalesced
+            return {
+                'hits': cls.__hits,
+                'misses': cls.__misses,
+                'coalesced': cls.__coalesced,
+                'hit_rate': (cls.__hits + cls.__coalesced) / total if total > 0 else 0.0,
+            }
+
+    @classmethod
+    def clear(cls):
+        with cls.__lock:
+            cls.__entries = {key: entry for key, entry in cls.__entries.items() if entry['event'] is not None}
+
+    @classmethod
+    def get_ttl(cls) -> float:
+        return EnvUtil.get_number(cls.__ENV_TTL__, cls.DEFAULT_TTL)
+
+    @staticmethod
+    def __follower_error__(error: Exception) -> Exception:
+        """
+        等待的调用方各自抛出新的异常实例（类型、参数和属性与leader的异常相同），调用方仍可按类型捕获；
+        多个线程抛出同一个实例会互相改写它的__traceback__和__context__
+        """
+        try:
+            follower_error = copy.copy(error)
+        except Exception:
+            follower_error = None
+        if not isinstance(follower_error, Exception) or follower_error is error:
+            follower_error = ConnectionError('the in-flight /queue request failed: {}'.format(error))
+        return follower_error
+
+    @classmethod
+    def __fetch__(cls, url: str, headers: Optional[dict]) -> List[str]:
+        response = HttpSessionPool.get(url, headers=headers, timeout=cls.REQUEST_TIMEOUT)
+        if response.status_code != 200:
+            cls.__logger__.error('Failed to receive a successful response, status code: {}'.format(
+                response.status_code))
+            return []
+
+        return cls.parse_running_prompt_ids(response.text)
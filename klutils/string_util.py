@@ -4,9 +4,6 @@ import time
 import random
 from datetime import timedelta, datetime
 
-import pytz
-from dateutil import parser
-
 
 class StringUtil:
     __version__ = '1.1.0'
@@ -235,6 +232,9 @@ class StringUtil:
             print(u'时区【{}】有误，无法转换！'.format(local_timezone))
             return ''
 
+        # dateutil / pytz只在用到时才导入，减少节点包的导入时间
+        from dateutil import parser
+
         utc_time = parser.parse(utc_string)
         local_time = utc_time + timedelta(hours=local_timezone)
 
@@ -255,6 +255,8 @@ class StringUtil:
             print(u'时区【{}】有误，无法转换！'.format(local_timezone))
             return ''
 
+        from dateutil import parser
+
         utc_time = parser.parse(utc_string)
         local_time = utc_time + timedelta(hours=local_timezone)
 
@@ -302,6 +304,8 @@ class StringUtil:
         if target_timezone == local_timezone:
             return time_str
 
+        import pytz
+
         try:
             # 将字符串转换为datetime对象 (无时区信息)
             naive_time = datetime.strptime(time_str, "%Y-%m-%d %H:%M:%S")
@@ -327,6 +331,8 @@ class StringUtil:
         if from_timezone == 8:  # 已经是UTC+8，不需要转换
             return time_str
 
+        import pytz
+
         try:
             # 解析原始时间字符串
             naive_time = datetime.strptime(time_str, "%Y-%m-%d %H:%M:%S")
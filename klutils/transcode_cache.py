@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from .env_util import EnvUtil
+from .file_util import FileUtil
+from .klLog import Log
+
+
+class TranscodeCache:
+    """
+    图片转码结果缓存，键为 源文件内容哈希 + 目标格式 + 编码参数。
+    内存层和可选的磁盘层各自有容量上限，按LRU淘汰；磁盘层命中时会提升到内存层。
+    """
+    __version__ = '1.0.0'
+    __name__ = 'TranscodeCache'
+    __logger__ = Log.get_logger(__name__)
+
+    __ENV_MEMORY_BYTES__ = 'KL_TRANSCODE_CACHE_MEMORY_BYTES'
+    __ENV_DISK_DIR__ = 'KL_TRANSCODE_CACHE_DIR'
+    __ENV_DISK_BYTES__ = 'KL_TRANSCODE_CACHE_DISK_BYTES'
+
+    DEFAULT_MEMORY_BYTES = 64 * 1024 * 1024
+    DEFAULT_DISK_BYTES = 512 * 1024 * 1024
+    DISK_FILE_EXT = '.bin'
+
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls) -> 'TranscodeCache':
+        """
+        获取全局共享的缓存，容量和磁盘目录由环境变量配置；磁盘目录未配置时只使用内存层
+        """
+        if cls.__instance is None:
+            with cls.__instance_lock:
+                if cls.__instance is None:
+                    cls.__instance = cls(
+                        memory_bytes=EnvUtil.get_int(cls.__ENV_MEMORY_BYTES__, cls.DEFAULT_MEMORY_BYTES),
+                        disk_dir=os.getenv(cls.__ENV_DISK_DIR__, ''),
+                        disk_bytes=EnvUtil.get_int(cls.__ENV_DISK_BYTES__, cls.DEFAULT_DISK_BYTES)
+                    )
+
+        return cls.__instance
+
+    def __init__(self, memory_bytes: int = DEFAULT_MEMORY_BYTES, disk_dir: str = '',
+                 disk_bytes: int = DEFAULT_DISK_BYTES):
+        """
+        :param memory_bytes: 内存层容量（字节），<=0 表示不使用内存层
+        :param disk_dir: 磁盘层目录，为空表示不使用磁盘层
+        :param disk_bytes: 磁盘层容量（字节）
+        """
+        self.__lock = threading.Lock()
+        self.__memory_limit = max(0, memory_bytes)
+        self.__memory = OrderedDict()
+        self.__memory_size = 0
+
+        self.__disk_dir = disk_dir if disk_dir else ''
+        self.__disk_limit = max(0, disk_bytes)
+        self.__disk = OrderedDict()
+        self.__disk_size = 0
+        if self.__disk_dir:
+            self.__load_disk_index__()
+
+        self.__memory_hits = 0
+        self.__disk_hits = 0
+        self.__misses = 0
+
+    @classmethod
+    def make_key(cls, src_path: str, output_format: str, params: Optional[dict] = None) -> str:
+        """
+        计算缓存键
+        :param src_path: 源文件路径
+        :param output_format: 目标格式
+        :param params: 编码参数
+        :return: 16进制字符串，源文件不存在时返回空字符串
+        """
+        content_hash = FileUtil.get_file_hash_sha1(src_path)
+        if not content_hash:
+            return ''
+
+        raw = '{}|{}|{}'.format(content_hash, output_format.upper(), json.dumps(params or {}, sort_keys=True))
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self.__lock:
+            data = self.__memory.get(key)
+            if data is not None:
+                self.__memory.move_to_end(key)
+                self.__memory_hits += 1
+                return data
+
+            if key in self.__disk:
+                data = self.__read_disk__(key)
+                if data is not None:
+                    self.__disk.move_to_end(key)
+                    self.__disk_hits += 1
+                    self.__put_memory__(key, data)
+                    return data
+
+            self.__misses += 1
+            return None
+
+    def put(self, key: str, data: bytes):
+        if not key or not data:
+            return
+
+        with self.__lock:
+            self.__put_memory__(key, data)
+            self.__put_disk__(key, data)
+
+    def get_or_create(self, src_path: str, output_format: str, params: Optional[dict],
+                      create: Callable[[], bytes]) -> bytes:
+        """
+        命中缓存则直接返回，否则调用create生成并写入缓存
+        :param src_path: 源文件路径
+        :param output_format: 目标格式
+        :param params: 编码参数
+        :param create: 生成转码结果的函数，失败时返回空bytes
+        :return: 转码结果
+        """
+        key = self.make_key(src_path, output_format, params)
+        if key:
+            data = self.get(key)
+            if data is not None:
+                return data
+
+        data = create()
+        if key and data:
+            self.put(key, data)
+        return data
+
+    def stats(self) -> dict:
+        with self.__lock:
+            return {
+                'memory_hits': self.__memory_hits,
+                'disk_hits': self.__disk_hits,
+                'misses': self.__misses,
+                'memory_entries': len(self.__memory),
+                'memory_bytes': self.__memory_size,
+                'disk_entries': len(self.__disk),
+                'disk_bytes': self.__disk_size,
+            }
+
+    def clear(self):
+        with self.__lock:
+            self.__memory.clear()
+            self.__memory_size = 0
+            for key in list(self.__disk.keys()):
+                self.__remove_disk__(key)
+
+    def __put_memory__(self, key: str, data: bytes):
+        # 调用方需持有self.__lock
+        if len(data) > self.__memory_limit:
+            return
+
+        old = self.__memory.pop(key, None)
+        if old is not None:
+            self.__memory_size -= len(old)
+        self.__memory[key] = data
+        self.__memory_size += len(data)
+        while self.__memory_size > self.__memory_limit:
+            _, evicted = self.__memory.popitem(last=False)
+            self.__memory_size -= len(evicted)
+
+    def __put_disk__(self, key: str, data: bytes):
+        # 调用方需持有self.__lock
+        if not self.__disk_dir or len(data) > self.__disk_limit:
+            return
+
+        path = self.__disk_path__(key)
+        try:
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            self.__logger__.error('failed to write transcode cache[{}]: {}'.format(path, e))
+            return
+
+        self.__disk_size -= self.__disk.pop(key, 0)
+        self.__disk[key] = len(data)
+        self.__disk_size += len(data)
+        while self.__disk_size > self.__disk_limit and len(self.__disk) > 0:
+            self.__remove_disk__(next(iter(self.__disk)))
+
+    def __read_disk__(self, key: str) -> Optional[bytes]:
+        path = self.__disk_path__(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            # 更新修改时间，重启后按此恢复LRU顺序
+            os.utime(path)
+            return data
+        except OSError:
+            self.__disk_size -= self.__disk.pop(key, 0)
+            return None
+
+    def __remove_disk__(self, key: str):
+        self.__disk_size -= self.__disk.pop(key, 0)
+        try:
+            os.remove(self.__disk_path__(key))
+        except OSError:
+            pass
+
+    def __load_disk_index__(self):
+        if not FileUtil.check_directory_exist(self.__disk_dir):
+            FileUtil.create_directory(self.__disk_dir)
+
+        entries = []
+        for entry in os.scandir(self.__disk_dir):
+            if entry.is_file() and entry.name.endswith(self.DISK_FILE_EXT):
+                stat = entry.stat()
+                entries.append((stat.st_mtime_ns, entry.name[:-len(self.DISK_FILE_EXT)], stat.st_size))
+
+        for _, key, size in sorted(entries):
+            self.__disk[key] = size
+            self.__disk_size += size
+
+        while self.__disk_size > self.__disk_limit and len(self.__disk) > 0:
+            self.__remove_disk__(next(iter(self.__disk)))
+
+    def __disk_path__(self, key: str) -> str:
+        return os.path.join(self.__disk_dir, key + self.DISK_FILE_EXT)
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+import time
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+from .env_util import EnvUtil
+from .klLog import Log
+from .metrics import Metrics
+
+
+class TokenBucket:
+    """
+    令牌桶限速。consume按预约方式扣减令牌：令牌不足时记为欠账并让调用方睡眠到欠账还清，
+    单次消费超过桶容量也能按平均速率放行，多个线程之间按到达顺序公平分配带宽。
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        """
+        :param rate: 每秒字节数
+        :param burst: 桶容量（字节），默认为1秒的量
+        """
+        self.rate = float(rate)
+        self.burst = float(burst) if burst else self.rate
+        self.__tokens = self.burst
+        self.__last = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def consume(self, amount: int) -> float:
+        """
+        消费令牌，令牌不足时阻塞
+        :param amount: 字节数
+        :return: 等待的秒数
+        """
+        if amount <= 0 or self.rate <= 0:
+            return 0.0
+
+        with self.__lock:
+            now = time.monotonic()
+            self.__tokens = min(self.burst, self.__tokens + (now - self.__last) * self.rate)
+            self.__last = now
+            self.__tokens -= amount
+            wait = -self.__tokens / self.rate if self.__tokens < 0 else 0.0
+
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class UploadPermit:
+    """
+    一次上传的许可，由UploadLimiter.acquire返回。
+    上传过程中每发送一段数据调用一次throttle，按全局和目标主机的带宽限制等待
+    """
+
+    def __init__(self, buckets: list, queue_wait: float):
+        self.__buckets = buckets
+        # 等待并发名额的秒数
+        self.queue_wait = queue_wait
+        # 等待带宽的秒数
+        self.throttle_wait = 0.0
+        self.bytes_sent = 0
+
+    @property
+    def total_wait(self) -> float:
+        return self.queue_wait + self.throttle_wait
+
+    def throttle(self, amount: int):
+        self.bytes_sent += amount
+        for bucket in self.__buckets:
+            self.throttle_wait += bucket.consume(amount)
+
+
+class UploadLimiter:
+    """
+    进程内所有回调上传共享的限制：
+    - 并发上传数上限（KL_UPLOAD_MAX_CONCURRENCY，0为不限制）
+    - 总带宽（KL_UPLOAD_BYTES_PER_SECOND，字节/秒，0为不限制），以令牌桶作用在流式请求体上
+    - 按目标主机的带宽（KL_UPLOAD_HOST_LIMITS，如 "cdn.example.com=1048576,10.0.0.5:9100=524288"）
+
+    限制只在当前进程内生效：令牌桶和并发计数都在内存中，不跨进程共享。
+    同一台机器上运行多个ComfyUI实例时，每个实例各自按配置限速，总带宽和总并发是各实例之和，
+    需要按实例数分摊配置值。
+
+    用法：
+        with UploadLimiter.acquire(url) as permit:
+            encoder.throttle = permit.throttle
+            ...
+        permit.total_wait  # 这次上传为排队和限速等待的秒数
+    """
+    __version__ = '1.0.0'
+    __name__ = 'UploadLimiter'
+    __logger__ = Log.get_logger(__name__)
+
+    __ENV_MAX_CONCURRENCY__ = 'KL_UPLOAD_MAX_CONCURRENCY'
+    __ENV_BYTES_PER_SECOND__ = 'KL_UPLOAD_BYTES_PER_SECOND'
+    __ENV_HOST_LIMITS__ = 'KL_UPLOAD_HOST_LIMITS'
+
+    __lock = threading.Condition()
+    __config = None
+    __active = 0
+    __global_bucket = None
+    __host_buckets = {}
+
+    @classmethod
+    def configure(cls, max_concurrency: Optional[int] = None, bytes_per_second: Optional[int] = None,
+                  host_limits: Optional[Dict[str, int]] = None):
+        """
+        修改限制，未指定的项保持不变；正在进行的上传不受影响
+        :param max_concurrency: 并发上传数上限，0为不限制
+        :param bytes_per_second: 总带宽（字节/秒），0为不限制
+        :param host_limits: 目标主机（host 或 host:port） -> 带宽（字节/秒）
+        """
+        with cls.__lock:
+            config = dict(cls.__get_config__())
+            if max_concurrency is not None:
+                config['max_concurrency'] = max(0, max_concurrency)
+            if bytes_per_second is not None:
+                config['bytes_per_second'] = max(0, bytes_per_second)
+            if host_limits is not None:
+                config['host_limits'] = {k.lower(): v for k, v in host_limits.items() if v > 0}
+            cls.__config = config
+            cls.__global_bucket = None
+            cls.__host_buckets = {}
+            cls.__lock.notify_all()
+
+    @classmethod
+    def acquire(cls, url: str) -> 'UploadLimiter':
+        """
+        :param url: 上传地址
+        :return: 上下文管理器，进入时等待并发名额并返回UploadPermit
+        """
+        return cls(url)
+
+    def __init__(self, url: str):
+        self.url = url
+        self.permit = None
+
+    def __enter__(self) -> UploadPermit:
+        cls = type(self)
+        started = time.monotonic()
+        with cls.__lock:
+            while 0 < cls.__get_config__()['max_concurrency'] <= cls.__active:
+                cls.__lock.wait()
+            cls.__active += 1
+            buckets = cls.__get_buckets__(self.url)
+
+        self.permit = UploadPermit(buckets, time.monotonic() - started)
+        return self.permit
+
+    def __exit__(self, *args):
+        cls = type(self)
+        with cls.__lock:
+            cls.__active -= 1
+            cls.__lock.notify()
+
+        Metrics.UPLOAD_WAIT.observe(self.permit.total_wait)
+        if self.permit.total_wait >= 1:
+            cls.__logger__.info('upload to {} waited {:.2f}s (queue {:.2f}s, bandwidth {:.2f}s) for {} bytes'.format(
+                urlparse(self.url).netloc, self.permit.total_wait, self.permit.queue_wait,
+                self.permit.throttle_wait, self.permit.bytes_sent))
+
+    @classmethod
+    def __get_buckets__(cls, url: str) -> list:
+        # 调用方需持有cls.__lock
+        config = cls.__get_config__()
+        buckets = []
+        if config['bytes_per_second'] > 0:
+            if cls.__global_bucket is None:
+                cls.__global_bucket = TokenBucket(config['bytes_per_second'])
+            buckets.append(cls.__global_bucket)
+
+        parsed = urlparse(url)
+        host = (parsed.hostname or '').lower()
+        for key in ('{}:{}'.format(host, parsed.port) if parsed.port else None, host):
+            if key and key in config['host_limits']:
+                bucket = cls.__host_buckets.get(key)
+                if bucket is None:
+                    bucket = cls.__host_buckets[key] = TokenBucket(config['host_limits'][key])
+                buckets.append(bucket)
+                break
+
+        return buckets
+
+    @classmethod
+    def __get_config__(cls) -> dict:
+        if cls.__config is None:
+            cls.__config = {
+                'max_concurrency': max(0, EnvUtil.get_int(cls.__ENV_MAX_CONCURRENCY__, 0)),
+                'bytes_per_second': max(0, EnvUtil.get_int(cls.__ENV_BYTES_PER_SECOND__, 0)),
+                'host_limits': cls.__parse_host_limits__(os.getenv(cls.__ENV_HOST_LIMITS__, '')),
+            }
+
+        return cls.__config
+
+    @classmethod
+    def __parse_host_limits__(cls, value: str) -> Dict[str, int]:
+        limits = {}
+        for item in value.split(','):
+            host, _, rate = item.strip().rpartition('=')
+            try:
+                if host and int(rate) > 0:
+                    limits[host.strip().lower()] = int(rate)
+            except ValueError:
+                cls.__logger__.error('invalid upload host limit: {}'.format(item))
+        return limits
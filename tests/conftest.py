@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+"""
+单元测试在仓库根目录下运行：
+
+    python -m pytest tests
+
+klutils按顶层包导入，不经过仓库根目录的__init__.py，不需要ComfyUI
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 测试中会重复触发同一条警告，关闭日志限流，避免进程退出时才输出的汇总写到pytest已关闭的输出流
+os.environ.setdefault('KL_LOG_RATE_BURST', '0')
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from klutils.callback_outbox import CallbackOutbox, CallbackOutboxScheduler
+
+
+class CallbackOutboxTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.outbox = CallbackOutbox(os.path.join(tmp_dir.name, 'outbox.db'))
+        self.addCleanup(self.outbox.close)
+
+    def enqueue(self, **kwargs) -> int:
+        return self.outbox.enqueue('p-1', 'http://receiver/cb', '/tmp/a.png', '/tmp/v.mp4', **kwargs)
+
+    def get_entry(self, entry_id: int) -> dict:
+        return [entry for entry in self.outbox.list_undelivered() if entry['id'] == entry_id][0]
+
+    def test_claim_respects_lease(self):
+        leased = self.enqueue()
+        due = self.enqueue(lease_seconds=0, options={'upload_mode': 'chunked'})
+
+        claimed = self.outbox.claim_due()
+        self.assertEqual([entry['id'] for entry in claimed], [due])
+        self.assertEqual(claimed[0]['options'], {'upload_mode': 'chunked'})
+        # 领取后进入租期，不会被重复领取
+        self.assertEqual(self.outbox.claim_due(), [])
+
+        # 租期到期后（如进程崩溃）重新可领取
+        later = time.time() + CallbackOutbox.DEFAULT_LEASE_SECONDS + 1
+        with mock.patch('klutils.callback_outbox.time.time', return_value=later):
+            self.assertEqual(sorted(entry['id'] for entry in self.outbox.claim_due()), [leased, due])
+
+    def test_extend_lease(self):
+        entry_id = self.enqueue(lease_seconds=0)
+        self.assertTrue(self.outbox.extend_lease(entry_id, lease_seconds=600))
+        self.assertGreater(self.get_entry(entry_id)['next_due'], time.time() + 500)
+        self.assertEqual(self.outbox.claim_due(), [])
+
+        self.outbox.mark_delivered(entry_id)
+        self.assertFalse(self.outbox.extend_lease(entry_id))
+        self.assertFalse(self.outbox.extend_lease(entry_id + 100))
+
+    def test_mark_failed_backoff_then_dead(self):
+        entry_id = self.enqueue(max_attempts=3)
+        started = time.time()
+        self.assertEqual(self.outbox.mark_failed(entry_id, '503', 'busy'), CallbackOutbox.STATUS_PENDING)
+        entry = self.get_entry(entry_id)
+        self.assertEqual((entry['attempts'], entry['last_error_code']), (1, '503'))
+        self.assertAlmostEqual(entry['next_due'] - started, CallbackOutbox.BACKOFF_BASE_SECONDS, delta=1)
+
+        self.assertEqual(self.outbox.mark_failed(entry_id, '503', 'busy'), CallbackOutbox.STATUS_PENDING)
+        self.assertAlmostEqual(self.get_entry(entry_id)['next_due'] - started,
+                               CallbackOutbox.BACKOFF_BASE_SECONDS * 2, delta=1)
+
+        self.assertEqual(self.outbox.mark_failed(entry_id, '503', 'busy'), CallbackOutbox.STATUS_DEAD)
+        self.assertEqual(self.outbox.count(CallbackOutbox.STATUS_DEAD), 1)
+        self.assertEqual(self.outbox.list_undelivered(include_dead=False), [])
+        self.assertEqual(self.outbox.mark_failed(entry_id + 100, '503', 'busy'), '')
+
+    def test_mark_failed_permanent(self):
+        entry_id = self.enqueue()
+        self.assertEqual(self.outbox.mark_failed(entry_id, '-1', 'file not exists', permanent=True),
+                         CallbackOutbox.STATUS_DEAD)
+
+    def test_merge_options(self):
+        entry_id = self.enqueue(options={'upload_mode': 'form', 'dedup': True})
+        self.outbox.merge_options(entry_id, {'delivered_fields': ['image_0']})
+        self.outbox.merge_options(entry_id, {'dedup': False})
+        self.assertEqual(self.get_entry(entry_id)['options'],
+                         {'upload_mode': 'form', 'dedup': False, 'delivered_fields': ['image_0']})
+
+    def test_deliver_entry_renews_lease_during_slow_delivery(self):
+        entry_id = self.enqueue(lease_seconds=0)
+        self.outbox.claim_due(lease_seconds=0.05)
+
+        def slow_deliver():
+            time.sleep(0.2)
+            # 续租后租期仍未到，调度器不会重复领取
+            self.assertEqual(self.outbox.claim_due(), [])
+            return False, '503', 'busy'
+
+        with mock.patch.object(CallbackOutbox, 'LEASE_RENEW_INTERVAL', 0.02), \
+                mock.patch.object(self.outbox, 'extend_lease', wraps=self.outbox.extend_lease) as extend_lease:
+            result = CallbackOutboxScheduler.deliver_entry(self.outbox, entry_id, slow_deliver)
+
+        self.assertEqual(result, (False, '503', 'busy'))
+        self.assertGreater(extend_lease.call_count, 1)
+        # 失败结果在续租线程退出后记录，下次到期时间按退避计算，不被租期覆盖
+        entry = self.get_entry(entry_id)
+        self.assertEqual(entry['attempts'], 1)
+        self.assertLess(entry['next_due'] - time.time(), CallbackOutbox.BACKOFF_BASE_SECONDS + 1)
+
+    def test_deliver_entry_records_exception(self):
+        entry_id = self.enqueue()
+
+        def broken_deliver():
+            raise RuntimeError('boom')
+
+        self.assertEqual(CallbackOutboxScheduler.deliver_entry(self.outbox, entry_id, broken_deliver),
+                         (False, 'UNKNOWN_ERROR', 'boom'))
+        self.assertEqual(self.get_entry(entry_id)['last_error_code'], 'UNKNOWN_ERROR')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import tempfile
+import types
+import unittest
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+from klutils.chunked_upload import ChunkedUploader
+
+PART_SIZE = 1000
+
+
+class FakeReceiver:
+    """
+    按ChunkedUploader的协议保存分片，fail_parts中的分片第一次上传时返回503
+    """
+
+    def __init__(self, fail_parts: tuple = ()):
+        self.parts = {}
+        self.puts = []
+        self.completed = None
+        self.fail_parts = set(fail_parts)
+
+    @staticmethod
+    def response(status_code: int, body: dict = None):
+        return types.SimpleNamespace(status_code=status_code, text=json.dumps(body or {}), json=lambda: body or {})
+
+    def get(self, url, **kwargs):
+        query = parse_qs(urlparse(url).query)
+        parts = {name: sorted(indexes) for (upload_id, name), indexes in self.__index__().items()
+                 if upload_id == query['kl_upload'][0]}
+        return self.response(200, {'parts': parts}) if parts else self.response(404)
+
+    def request(self, method, url, data=None, headers=None, **kwargs):
+        query = {key: values[0] for key, values in parse_qs(urlparse(url).query).items()}
+        key = (query['kl_upload'], query['field'], int(query['part']))
+        self.puts.append(key[1:])
+        if key[1:] in self.fail_parts:
+            self.fail_parts.discard(key[1:])
+            return self.response(503)
+        if hashlib.sha256(data).hexdigest() != headers[ChunkedUploader.HEADER_PART_SHA256]:
+            return self.response(422)
+        self.parts[key] = (int(query['offset']), data)
+        return self.response(201)
+
+    def post(self, url, data=None, **kwargs):
+        query = parse_qs(urlparse(url).query)
+        self.completed = (query, data)
+        return self.response(200)
+
+    def assemble(self, upload_id: str, field: str) -> bytes:
+        chunks = sorted(value for (uid, name, _), value in self.parts.items() if uid == upload_id and name == field)
+        return b''.join(data for _, data in chunks)
+
+    def __index__(self) -> dict:
+        index = {}
+        for upload_id, name, part in self.parts:
+            index.setdefault((upload_id, name), []).append(part)
+        return index
+
+
+class ChunkedUploaderTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.NamedTemporaryFile(suffix='.mp4', delete=False)
+        self.video = os.urandom(PART_SIZE * 4 + 123)
+        tmp.write(self.video)
+        tmp.close()
+        self.video_path = tmp.name
+        self.addCleanup(os.remove, self.video_path)
+        self.files = {
+            'image': ('a.jpg', b'jpeg-bytes', 'image/*'),
+            'video': ('v.mp4', self.video_path, 'video/*'),
+        }
+
+    def new_uploader(self, receiver: FakeReceiver) -> ChunkedUploader:
+        for name in ('get', 'request', 'post'):
+            patcher = mock.patch('klutils.chunked_upload.HttpSessionPool.' + name, side_effect=getattr(receiver, name))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        upload_id = ChunkedUploader.make_upload_id('p-1', self.files)
+        return ChunkedUploader('http://receiver/cb?token=t', upload_id, self.files, fields={'promptId': 'p-1'},
+                               part_size=PART_SIZE)
+
+    def test_full_upload_and_manifest(self):
+        receiver = FakeReceiver()
+        uploader = self.new_uploader(receiver)
+        self.assertEqual(uploader.upload().status_code, 200)
+
+        self.assertEqual(receiver.assemble(uploader.upload_id, 'video'), self.video)
+        self.assertEqual(receiver.assemble(uploader.upload_id, 'image'), b'jpeg-bytes')
+        self.assertEqual(uploader.bytes_sent, len(self.video) + len(b'jpeg-bytes'))
+
+        query, form = receiver.completed
+        self.assertEqual(query['complete'], ['1'])
+        self.assertEqual(query['token'], ['t'])
+        self.assertEqual(form['promptId'], 'p-1')
+        manifest = json.loads(form['manifest'])
+        self.assertEqual(manifest['video']['size'], len(self.video))
+        self.assertEqual(manifest['video']['parts'], 5)
+        self.assertEqual(manifest['image']['parts'], 1)
+
+    def test_resume_sends_only_missing_parts(self):
+        receiver = FakeReceiver(fail_parts=(('video', 3),))
+        uploader = self.new_uploader(receiver)
+        self.assertEqual(uploader.upload().status_code, 503)
+        self.assertIsNone(receiver.completed)
+        sent_before_failure = uploader.bytes_sent
+
+        # 重试时upload id不变，只补传接收端还没有的分片
+        receiver.puts.clear()
+        retry = ChunkedUploader(uploader.url, ChunkedUploader.make_upload_id('p-1', self.files), self.files,
+                                fields={'promptId': 'p-1'}, part_size=PART_SIZE)
+        self.assertEqual(retry.upload().status_code, 200)
+        self.assertEqual(receiver.puts, [('video', 3), ('video', 4)])
+        self.assertEqual(retry.bytes_sent + sent_before_failure, len(self.video) + len(b'jpeg-bytes'))
+        self.assertEqual(receiver.assemble(retry.upload_id, 'video'), self.video)
+
+    def test_upload_id_is_stable(self):
+        upload_id = ChunkedUploader.make_upload_id('p-1', self.files)
+        self.assertEqual(ChunkedUploader.make_upload_id('p-1', dict(reversed(list(self.files.items())))), upload_id)
+        self.assertNotEqual(ChunkedUploader.make_upload_id('p-2', self.files), upload_id)
+
+        stat = os.stat(self.video_path)
+        os.utime(self.video_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertNotEqual(ChunkedUploader.make_upload_id('p-1', self.files), upload_id)
+
+
+if __name__ == '__main__':
+    unittest.main()
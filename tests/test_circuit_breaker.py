@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+import time
+import unittest
+
+from klutils.circuit_breaker import CircuitBreaker
+
+RESET_TIMEOUT = 0.05
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def open_breaker(self) -> CircuitBreaker:
+        breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=RESET_TIMEOUT)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.STATE_CLOSED)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.STATE_OPEN)
+        return breaker
+
+    def wait_half_open(self, breaker: CircuitBreaker):
+        time.sleep(breaker.stats()['open_remaining'] + 0.01)
+        self.assertEqual(breaker.state, CircuitBreaker.STATE_HALF_OPEN)
+
+    def test_open_rejects_until_reset_timeout(self):
+        breaker = self.open_breaker()
+        allowed, remaining = breaker.allow()
+        self.assertFalse(allowed)
+        self.assertGreater(remaining, 0)
+        self.assertEqual(breaker.stats()['rejected'], 1)
+
+    def test_half_open_allows_single_probe(self):
+        breaker = self.open_breaker()
+        self.wait_half_open(breaker)
+        self.assertEqual(breaker.allow(), (True, 0.0))
+        self.assertEqual(breaker.allow(), (False, 0.0))
+
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.STATE_CLOSED)
+        self.assertTrue(breaker.allow()[0])
+        self.assertTrue(breaker.allow()[0])
+
+    def test_half_open_probe_failure_doubles_timeout(self):
+        breaker = self.open_breaker()
+        self.wait_half_open(breaker)
+        self.assertTrue(breaker.allow()[0])
+        breaker.record_failure()
+
+        self.assertEqual(breaker.state, CircuitBreaker.STATE_OPEN)
+        remaining = breaker.stats()['open_remaining']
+        self.assertGreater(remaining, RESET_TIMEOUT)
+        self.assertLessEqual(remaining, RESET_TIMEOUT * 2)
+
+    def test_release_returns_probe_slot(self):
+        breaker = self.open_breaker()
+        self.wait_half_open(breaker)
+        self.assertTrue(breaker.allow()[0])
+        breaker.release()
+        self.assertEqual(breaker.state, CircuitBreaker.STATE_HALF_OPEN)
+        self.assertTrue(breaker.allow()[0])
+
+    def test_lost_probe_slot_expires(self):
+        breaker = self.open_breaker()
+        breaker.PROBE_LEASE = 0.05
+        self.wait_half_open(breaker)
+        self.assertTrue(breaker.allow()[0])
+        self.assertFalse(breaker.allow()[0])
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow()[0])
+
+    def test_retry_after_opens_below_threshold(self):
+        breaker = CircuitBreaker('test', failure_threshold=5, reset_timeout=RESET_TIMEOUT)
+        breaker.record_failure(retry_after=5)
+        allowed, remaining = breaker.allow()
+        self.assertFalse(allowed)
+        self.assertGreater(remaining, 4)
+
+    def test_retry_after_pause_returns_to_closed(self):
+        breaker = CircuitBreaker('test', failure_threshold=3, reset_timeout=1.0)
+        breaker.record_failure(retry_after=0.05)
+        self.assertEqual(breaker.state, CircuitBreaker.STATE_OPEN)
+        self.assertFalse(breaker.allow()[0])
+
+        # 暂停结束后回到closed，不是只放行一个探测请求的half-open
+        time.sleep(0.06)
+        self.assertEqual(breaker.state, CircuitBreaker.STATE_CLOSED)
+        self.assertTrue(breaker.allow()[0])
+        self.assertTrue(breaker.allow()[0])
+
+        # 第二次失败仍然只暂停Retry-After的时间，不翻倍
+        breaker.record_failure(retry_after=0.05)
+        self.assertLessEqual(breaker.stats()['open_remaining'], 0.05)
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow()[0])
+
+        # 第三次失败才达到阈值，按reset_timeout熔断
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.STATE_OPEN)
+        self.assertEqual(breaker.stats()['failures'], 3)
+        self.assertGreater(breaker.stats()['open_remaining'], 0.5)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(CircuitBreaker.parse_retry_after('7'), 7.0)
+        self.assertEqual(CircuitBreaker.parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT'), 0.0)
+        self.assertEqual(CircuitBreaker.parse_retry_after('soon'), 0.0)
+        self.assertEqual(CircuitBreaker.parse_retry_after(None), 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+import os
+import unittest
+from unittest import mock
+
+from klutils.env_util import EnvUtil
+
+ENV_NAME = 'KL_TEST_ENV_NUMBER'
+
+
+class EnvUtilTest(unittest.TestCase):
+
+    def test_get_number_unset_returns_default(self):
+        with mock.patch.dict(os.environ, {}, clear=False):
+            os.environ.pop(ENV_NAME, None)
+            self.assertEqual(EnvUtil.get_number(ENV_NAME, 1.5), 1.5)
+            self.assertEqual(EnvUtil.get_int(ENV_NAME, 3), 3)
+
+    def test_get_number_parses_value(self):
+        with mock.patch.dict(os.environ, {ENV_NAME: ' 2.25 '}):
+            self.assertEqual(EnvUtil.get_number(ENV_NAME, 1.0), 2.25)
+        with mock.patch.dict(os.environ, {ENV_NAME: '42'}):
+            value = EnvUtil.get_int(ENV_NAME, 0)
+            self.assertEqual(value, 42)
+            self.assertIsInstance(value, int)
+
+    def test_get_number_invalid_returns_default(self):
+        for raw in ('', 'abc', '1.5'):
+            with mock.patch.dict(os.environ, {ENV_NAME: raw}):
+                self.assertEqual(EnvUtil.get_int(ENV_NAME, 7), 7, raw)
+        with mock.patch.dict(os.environ, {ENV_NAME: 'fast'}):
+            self.assertEqual(EnvUtil.get_number(ENV_NAME, 0.5), 0.5)
+
+    def test_get_host_key(self):
+        self.assertEqual(EnvUtil.get_host_key('http://Example.com/cb'), ('http', 'example.com', 80))
+        self.assertEqual(EnvUtil.get_host_key('HTTPS://example.com/cb'), ('https', 'example.com', 443))
+        self.assertEqual(EnvUtil.get_host_key('http://127.0.0.1:8188/queue'), ('http', '127.0.0.1', 8188))
+        self.assertEqual(EnvUtil.get_host_key('http://example.com:80/a'), EnvUtil.get_host_key('http://example.com/b'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import importlib.util
+import os
+import tempfile
+import unittest
+
+from klutils.file_hasher import FileHasher
+from klutils.file_util import FileUtil
+
+HAS_XXHASH = importlib.util.find_spec('xxhash') is not None
+
+
+class FileHasherTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_dir = tmp_dir.name
+        self.contents = {}
+        # 大于默认缓冲区，覆盖多次readinto和最后不满一块的情况
+        sizes = (('empty.bin', 0), ('small.bin', 1000), ('large.bin', FileHasher.DEFAULT_BUFFER_BYTES * 2 + 17))
+        for name, size in sizes:
+            path = os.path.join(self.tmp_dir, name)
+            self.contents[path] = os.urandom(size)
+            with open(path, 'wb') as f:
+                f.write(self.contents[path])
+
+    def test_single_pass_matches_hashlib(self):
+        algorithms = ('sha1', 'md5', 'sha256', 'blake2b')
+        for path, content in self.contents.items():
+            digests = FileHasher.hash_file(path, algorithms)
+            self.assertEqual(digests, {name: hashlib.new(name, content).hexdigest() for name in algorithms}, path)
+
+    def test_hash_files_concurrently(self):
+        paths = list(self.contents) + [os.path.join(self.tmp_dir, 'missing.bin')]
+        results = FileHasher.hash_files(paths + paths[:1], ('sha256', 'md5'), max_workers=4)
+
+        self.assertEqual(list(results), paths)
+        for path, content in self.contents.items():
+            self.assertEqual(results[path], {'sha256': hashlib.sha256(content).hexdigest(),
+                                             'md5': hashlib.md5(content).hexdigest()})
+        # 读取失败的文件对应空字典，不影响其他文件
+        self.assertEqual(results[paths[-1]], {})
+        self.assertEqual(FileHasher.hash_files(paths, ('sha1',), max_workers=1),
+                         FileHasher.hash_files(paths, ('sha1',)))
+
+    def test_errors(self):
+        path = next(iter(self.contents))
+        self.assertEqual(FileHasher.hash_file(path, ()), {})
+        with self.assertRaises(ValueError):
+            FileHasher.hash_file(path, ('sha1', 'no-such-hash'))
+        with self.assertRaises(ValueError):
+            FileHasher.hash_files([path], ('no-such-hash',))
+        with self.assertRaises(OSError):
+            FileHasher.hash_file(os.path.join(self.tmp_dir, 'missing.bin'))
+
+    def test_xxhash_is_optional(self):
+        path = next(iter(self.contents))
+        self.assertEqual('xxh64' in FileHasher.available_algorithms(), HAS_XXHASH)
+        if HAS_XXHASH:
+            import xxhash
+            self.assertEqual(FileHasher.hash_file(path, ('xxh3_64',))['xxh3_64'],
+                             xxhash.xxh3_64(self.contents[path]).hexdigest())
+        else:
+            with self.assertRaises(ValueError):
+                FileHasher.hash_file(path, ('xxh64',))
+
+    def test_file_util_wrappers(self):
+        path = list(self.contents)[-1]
+        content = self.contents[path]
+        self.assertEqual(FileUtil.get_file_hash_sha1(path), hashlib.sha1(content).hexdigest())
+        self.assertEqual(FileUtil.get_file_hash_md5(path), hashlib.md5(content).hexdigest())
+        self.assertEqual(FileUtil.get_file_hashes(path), {'sha1': hashlib.sha1(content).hexdigest(),
+                                                          'md5': hashlib.md5(content).hexdigest()})
+        self.assertEqual(FileUtil.get_file_hashes(path + '.missing'), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from klutils.file_share import FileShare
+
+
+class FileShareTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.NamedTemporaryFile(suffix='.mp4', delete=False)
+        tmp.write(b'video-bytes')
+        tmp.close()
+        self.file_path = tmp.name
+        self.addCleanup(lambda: os.path.exists(self.file_path) and os.remove(self.file_path))
+
+    def test_token_round_trip(self):
+        token, expires = FileShare.create_token(self.file_path, ttl=60)
+        self.assertEqual(FileShare.verify_token(token), os.path.abspath(self.file_path))
+        self.assertGreater(expires, 0)
+
+        url, _ = FileShare.make_url('http://10.0.0.2:8188/', self.file_path)
+        self.assertTrue(url.startswith('http://10.0.0.2:8188' + FileShare.ROUTE_PREFIX))
+        self.assertEqual(FileShare.verify_token(url.rsplit('/', 1)[1]), os.path.abspath(self.file_path))
+
+    def test_tampered_token_rejected(self):
+        token, _ = FileShare.create_token(self.file_path, ttl=60)
+        payload, _, signature = token.partition('.')
+        other, _ = FileShare.create_token(self.file_path + '.other', ttl=60)
+
+        for bad in (payload + '.' + signature[:-1] + ('A' if signature[-1] != 'A' else 'B'),
+                    other.partition('.')[0] + '.' + signature,
+                    payload, '', '.', 'é.é', None):
+            self.assertIsNone(FileShare.verify_token(bad), bad)
+
+    def test_expired_token_rejected(self):
+        token, expires = FileShare.create_token(self.file_path, ttl=60)
+        with mock.patch('klutils.file_share.time.time', return_value=expires + 1):
+            self.assertIsNone(FileShare.verify_token(token))
+
+    def test_missing_file_rejected(self):
+        token, _ = FileShare.create_token(self.file_path, ttl=60)
+        os.remove(self.file_path)
+        self.assertIsNone(FileShare.verify_token(token))
+
+    def test_ttl_from_env(self):
+        with mock.patch.dict(os.environ, {'KL_FILE_SHARE_TTL': '120'}):
+            with mock.patch('klutils.file_share.time.time', return_value=1000.0):
+                _, expires = FileShare.create_token(self.file_path)
+        self.assertEqual(expires, 1120)
+
+
+if __name__ == '__main__':
+    unittest.main()
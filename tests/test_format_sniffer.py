@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import tempfile
+import unittest
+
+from klutils.format_sniffer import FormatSniffer
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+def ftyp(major: bytes, *compatible: bytes) -> bytes:
+    body = major + b'\x00\x00\x00\x00' + b''.join(compatible)
+    return (8 + len(body)).to_bytes(4, 'big') + b'ftyp' + body + b'\x00\x00\x00\x08mdat'
+
+
+class FormatSnifferTest(unittest.TestCase):
+
+    def test_magic_numbers(self):
+        cases = {
+            b'\xff\xd8\xff\xe0\x00\x10JFIF\x00': FormatSniffer.FORMAT_JPEG,
+            b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR': FormatSniffer.FORMAT_PNG,
+            b'GIF89a\x01\x00\x01\x00': FormatSniffer.FORMAT_GIF,
+            b'RIFF\x24\x00\x00\x00WEBPVP8 ': FormatSniffer.FORMAT_WEBP,
+            b'RIFF\x24\x00\x00\x00AVI LIST': FormatSniffer.FORMAT_AVI,
+            b'BM\x36\x00\x0c\x00\x00\x00\x00\x00\x36\x00\x00\x00': FormatSniffer.FORMAT_BMP,
+            b'\x1a\x45\xdf\xa3\x9f\x42\x86\x81\x01\x42\x82\x84webm': FormatSniffer.FORMAT_WEBM,
+            b'\x1a\x45\xdf\xa3\xa3\x42\x86\x81\x01\x42\x82\x88matroska': FormatSniffer.FORMAT_MKV,
+            b'\x00\x00\x00\x08wide\x00\x00\x00\x00mdat': FormatSniffer.FORMAT_MOV,
+        }
+        for header, expected in cases.items():
+            self.assertEqual(FormatSniffer.sniff(header), expected, header)
+
+    def test_iso_bmff_brands(self):
+        cases = {
+            ftyp(b'isom', b'isom', b'mp41'): FormatSniffer.FORMAT_MP4,
+            ftyp(b'qt  ', b'qt  '): FormatSniffer.FORMAT_MOV,
+            ftyp(b'avif', b'mif1', b'miaf'): FormatSniffer.FORMAT_AVIF,
+            ftyp(b'heic', b'mif1', b'heic'): FormatSniffer.FORMAT_HEIC,
+            # 通用的mif1 brand按兼容brand区分AVIF和HEIC
+            ftyp(b'mif1', b'mif1', b'avif'): FormatSniffer.FORMAT_AVIF,
+            ftyp(b'mif1', b'mif1', b'heic'): FormatSniffer.FORMAT_HEIC,
+        }
+        for header, expected in cases.items():
+            self.assertEqual(FormatSniffer.sniff(header), expected, header)
+
+    def test_unknown_and_short_headers(self):
+        for header in (b'', b'\xff\xd8', b'RIFF\x00\x00\x00\x00WAVE', b'BMW is not a bitmap', b'plain text file'):
+            self.assertEqual(FormatSniffer.sniff(header), '', header)
+
+    def test_categories(self):
+        self.assertTrue(FormatSniffer.is_image_format('png'))
+        self.assertTrue(FormatSniffer.is_video_format(FormatSniffer.FORMAT_MOV))
+        self.assertTrue(FormatSniffer.is_animated_image_format('GIF'))
+        self.assertFalse(FormatSniffer.is_animated_image_format(FormatSniffer.FORMAT_PNG))
+        for method in (FormatSniffer.is_image_format, FormatSniffer.is_video_format):
+            self.assertFalse(method(''))
+            self.assertFalse(method(None))
+
+    def test_sniff_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'v.mp4')
+            with open(path, 'wb') as f:
+                f.write(ftyp(b'isom', b'isom') + b'\x00' * 100)
+            self.assertEqual(FormatSniffer.sniff_file(path), FormatSniffer.FORMAT_MP4)
+            self.assertEqual(FormatSniffer.sniff_file(os.path.join(tmp_dir, 'missing.mp4')), '')
+            self.assertEqual(FormatSniffer.sniff_file(tmp_dir), '')
+            self.assertEqual(FormatSniffer.sniff_file(None), '')
+
+    @unittest.skipIf(Image is None, 'Pillow not installed')
+    def test_agrees_with_pillow(self):
+        for image_format in ('JPEG', 'PNG', 'GIF', 'BMP', 'WEBP'):
+            buffer = io.BytesIO()
+            Image.new('RGB', (8, 8), (200, 10, 10)).save(buffer, image_format)
+            self.assertEqual(FormatSniffer.sniff(buffer.getvalue()[:FormatSniffer.HEADER_BYTES]), image_format)
+
+
+if __name__ == '__main__':
+    unittest.main()
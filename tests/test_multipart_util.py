@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+import email
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from klutils.multipart_util import MultipartEncoder
+
+
+class MultipartEncoderTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.NamedTemporaryFile(suffix='.bin', delete=False)
+        self.file_content = os.urandom(200 * 1024 + 17)
+        tmp.write(self.file_content)
+        tmp.close()
+        self.file_path = tmp.name
+        self.addCleanup(os.remove, self.file_path)
+
+    def new_encoder(self, chunk_size: int = MultipartEncoder.DEFAULT_CHUNK_SIZE) -> MultipartEncoder:
+        return MultipartEncoder(
+            fields={'promptId': 'p-1', 'batchIndex': 0},
+            files={
+                'image_0': ('a.png', b'\x89PNG-bytes', 'image/*'),
+                'video_0': ('v "1".mp4', self.file_path, 'video/*'),
+            },
+            chunk_size=chunk_size
+        )
+
+    def parse(self, encoder: MultipartEncoder, body: bytes) -> dict:
+        message = email.message_from_bytes(b'Content-Type: ' + encoder.content_type.encode('ascii') + b'\r\n\r\n' + body)
+        self.assertTrue(message.is_multipart())
+        return {part.get_param('name', header='Content-Disposition'): part for part in message.get_payload()}
+
+    def test_length_matches_streamed_body(self):
+        encoder = self.new_encoder(chunk_size=4096)
+        chunks = list(encoder)
+        self.assertTrue(all(0 < len(chunk) <= 4096 for chunk in chunks))
+        self.assertGreater(len(chunks), len(self.file_content) // 4096)
+
+        body = b''.join(chunks)
+        self.assertEqual(len(body), len(encoder))
+        self.assertEqual(encoder.len, len(encoder))
+        self.assertTrue(body.endswith('--{}--\r\n'.format(encoder.boundary).encode('ascii')))
+
+    def test_body_parses_as_multipart(self):
+        encoder = self.new_encoder()
+        parts = self.parse(encoder, encoder.read())
+
+        self.assertEqual(parts['promptId'].get_payload(), 'p-1')
+        self.assertEqual(parts['batchIndex'].get_payload(), '0')
+        self.assertEqual(parts['image_0'].get_payload(decode=True), b'\x89PNG-bytes')
+        self.assertEqual(parts['video_0'].get_content_type(), 'video/*')
+        self.assertEqual(parts['video_0'].get_payload(decode=True), self.file_content)
+
+    def test_read_respects_size_and_reset(self):
+        encoder = self.new_encoder(chunk_size=1000)
+        first = encoder.read(333)
+        self.assertEqual(len(first), 333)
+
+        rest = []
+        while True:
+            chunk = encoder.read(5000)
+            if not chunk:
+                break
+            self.assertLessEqual(len(chunk), 5000)
+            rest.append(chunk)
+        body = first + b''.join(rest)
+        self.assertEqual(len(body), len(encoder))
+
+        encoder.reset()
+        self.assertEqual(encoder.read(), body)
+        encoder.close()
+
+    def test_throttle_sees_every_byte(self):
+        encoder = self.new_encoder(chunk_size=8192)
+        sent = []
+        encoder.throttle = sent.append
+        b''.join(encoder)
+        self.assertEqual(sum(sent), len(encoder))
+
+    def test_iter_segments_reference_file(self):
+        encoder = self.new_encoder()
+        segments = list(encoder.iter_segments())
+        self.assertIn((self.file_path, 0, len(self.file_content)), segments)
+        self.assertEqual(sum(len(s) if isinstance(s, bytes) else s[2] for s in segments), len(encoder))
+
+    def test_file_growing_after_encode_is_truncated(self):
+        encoder = self.new_encoder(chunk_size=4096)
+        with open(self.file_path, 'ab') as f:
+            f.write(b'appended after Content-Length was computed')
+        body = encoder.read()
+        self.assertEqual(len(body), len(encoder))
+        self.assertEqual(self.parse(encoder, body)['video_0'].get_payload(decode=True), self.file_content)
+
+    def test_file_shrinking_after_encode_raises(self):
+        encoder = self.new_encoder(chunk_size=4096)
+        with open(self.file_path, 'r+b') as f:
+            f.truncate(len(self.file_content) // 2)
+        with self.assertRaises(OSError):
+            b''.join(encoder)
+        encoder.close()
+
+    def test_missing_file_raises(self):
+        with self.assertRaises(OSError):
+            MultipartEncoder(files={'video': ('v.mp4', self.file_path + '.missing', 'video/*')})
+
+    @unittest.skipUnless(hasattr(os, 'sendfile'), 'os.sendfile not available')
+    def test_can_sendfile_respects_proxies(self):
+        environ = {key: value for key, value in os.environ.items() if 'proxy' not in key.lower()}
+        with mock.patch.dict(os.environ, environ, clear=True):
+            self.assertTrue(MultipartEncoder.can_sendfile('http://receiver/cb'))
+            self.assertFalse(MultipartEncoder.can_sendfile('https://receiver/cb'))
+
+            os.environ['http_proxy'] = 'http://proxy:3128'
+            self.assertFalse(MultipartEncoder.can_sendfile('http://receiver/cb'))
+            os.environ['no_proxy'] = 'receiver'
+            self.assertTrue(MultipartEncoder.can_sendfile('http://receiver/cb'))
+
+
+if __name__ == '__main__':
+    unittest.main()
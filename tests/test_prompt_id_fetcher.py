@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import itertools
+import sys
+import threading
+import time
+import types
+import unittest
+from unittest import mock
+
+from benchmarks._common import load_node_pack
+
+RUNS = 10
+DOWNSTREAM = 3
+
+
+class FakeRoutes:
+    def get(self, path):
+        return lambda handler: handler
+
+
+class FakePromptQueue:
+
+    def __init__(self):
+        self.mutex = threading.RLock()
+        self.currently_running = {}
+
+    def start(self, number: int, prompt_id: str):
+        with self.mutex:
+            self.currently_running = {number: (number, prompt_id, {}, {}, [])}
+
+
+class PromptIdFetcherReexecTest(unittest.TestCase):
+    """
+    按ComfyUI的缓存规则（IS_CHANGED返回值与上次相同、且上游都命中缓存时不重新执行）
+    重放 PromptIdFetcher -> DOWNSTREAM个下游节点 的子图，每次运行都分配新的prompt id
+    """
+
+    def setUp(self):
+        self.prompt_queue = FakePromptQueue()
+        prompt_server = types.SimpleNamespace(routes=FakeRoutes(), prompt_queue=self.prompt_queue,
+                                              last_prompt_id=None)
+        server = types.ModuleType('server')
+        server.PromptServer = types.SimpleNamespace(instance=prompt_server)
+        # 退出时sys.modules恢复原状，节点包和伪造的server一起移除
+        patcher = mock.patch.dict(sys.modules, {'server': server})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        node_pack = load_node_pack('klnodes_test')
+        self.fetcher_class = node_pack.NODE_CLASS_MAPPINGS['Prompt ID Fetcher']
+
+        # 每次运行间隔1秒（真实的运行间隔远大于time.time()的精度）
+        clock = itertools.count(1000.0)
+        misc_nodes = sys.modules['klnodes_test.comfy_nodes.misc_nodes']
+        fake_time = types.SimpleNamespace(time=lambda: next(clock), perf_counter=time.perf_counter)
+        time_patcher = mock.patch.object(misc_nodes, 'time', fake_time)
+        time_patcher.start()
+        self.addCleanup(time_patcher.stop)
+
+    def test_every_run_reexecutes_with_current_prompt_id(self):
+        last_token = object()
+        cached_output = None
+        executed = 0
+        outputs = []
+        for number in range(RUNS):
+            prompt_id = 'prompt-{}'.format(number)
+            self.prompt_queue.start(number, prompt_id)
+            token = self.fetcher_class.IS_CHANGED()
+            if token != last_token or cached_output is None:
+                last_token = token
+                cached_output = self.fetcher_class().get_prompt_id()
+                # 上游被标记为已变化时，下游全部重新执行
+                executed += 1 + DOWNSTREAM
+            outputs.append((prompt_id, cached_output[0]))
+
+        self.assertEqual(executed, RUNS * (1 + DOWNSTREAM))
+        for prompt_id, output in outputs:
+            self.assertEqual(output, prompt_id)
+
+    def test_is_changed_differs_per_run(self):
+        tokens = [self.fetcher_class.IS_CHANGED(force_refresh=0) for _ in range(RUNS)]
+        self.assertEqual(len(set(tokens)), RUNS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+import unittest
+from unittest import mock
+
+from klutils.queue_snapshot import QueueSnapshotCache
+
+FOLLOWERS = 3
+
+
+class QueueSnapshotCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        QueueSnapshotCache.clear()
+        self.entered = threading.Event()
+        self.release = threading.Event()
+        self.results = {}
+
+    def tearDown(self):
+        self.release.set()
+
+    def blocking_fetch(self, result):
+        def fetch(url, headers):
+            self.entered.set()
+            self.release.wait(5)
+            if isinstance(result, BaseException):
+                raise result
+            return result
+        return fetch
+
+    def call(self, name: str, url: str):
+        try:
+            self.results[name] = QueueSnapshotCache.get_running_prompt_ids(url, ttl=0)
+        except BaseException as e:
+            self.results[name] = e
+
+    def start_callers(self, url: str) -> list:
+        """
+        先让leader进入请求，再启动FOLLOWERS个调用方，等它们都合并到进行中的请求上
+        """
+        coalesced = QueueSnapshotCache.stats()['coalesced']
+        threads = [threading.Thread(target=self.call, args=('leader', url))]
+        threads[0].start()
+        self.assertTrue(self.entered.wait(5))
+        for index in range(FOLLOWERS):
+            threads.append(threading.Thread(target=self.call, args=('follower-{}'.format(index), url)))
+            threads[-1].start()
+
+        deadline = time.monotonic() + 5
+        while QueueSnapshotCache.stats()['coalesced'] - coalesced < FOLLOWERS and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(QueueSnapshotCache.stats()['coalesced'] - coalesced, FOLLOWERS)
+        return threads
+
+    def test_followers_share_result(self):
+        url = 'http://127.0.0.1:1/queue-ok'
+        with mock.patch.object(QueueSnapshotCache, '__fetch__', side_effect=self.blocking_fetch(['a', 'b'])) as fetch:
+            threads = self.start_callers(url)
+            self.release.set()
+            for thread in threads:
+                thread.join(5)
+
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual(len(self.results), FOLLOWERS + 1)
+        for result in self.results.values():
+            self.assertEqual(result, ['a', 'b'])
+
+    def test_followers_receive_leader_error(self):
+        url = 'http://127.0.0.1:1/queue-error'
+        error = ConnectionError('refused')
+        with mock.patch.object(QueueSnapshotCache, '__fetch__', side_effect=self.blocking_fetch(error)) as fetch:
+            threads = self.start_callers(url)
+            self.release.set()
+            for thread in threads:
+                thread.join(5)
+            self.assertEqual(fetch.call_count, 1)
+
+            # 失败的结果不缓存，下一次调用重新请求
+            fetch.side_effect = None
+            fetch.return_value = ['c']
+            self.assertEqual(QueueSnapshotCache.get_running_prompt_ids(url, ttl=10), ['c'])
+            self.assertEqual(fetch.call_count, 2)
+
+        self.assertEqual(len(self.results), FOLLOWERS + 1)
+        self.assertIs(self.results['leader'], error)
+        followers = [result for name, result in self.results.items() if name != 'leader']
+        # 每个调用方各自的异常实例，类型和参数不变，__cause__为leader的异常
+        self.assertEqual(len({id(result) for result in followers}), FOLLOWERS)
+        for result in followers:
+            self.assertIsNot(result, error)
+            self.assertIsInstance(result, ConnectionError)
+            self.assertEqual(result.args, error.args)
+            self.assertIs(result.__cause__, error)
+
+    def test_interrupted_leader_wakes_followers(self):
+        url = 'http://127.0.0.1:1/queue-interrupted'
+        with mock.patch.object(QueueSnapshotCache, '__fetch__', side_effect=self.blocking_fetch(KeyboardInterrupt())) \
+                as fetch:
+            threads = self.start_callers(url)
+            started = time.monotonic()
+            self.release.set()
+            for thread in threads:
+                thread.join(5)
+
+            # 中断的结果同样不缓存
+            fetch.side_effect = None
+            fetch.return_value = ['c']
+            self.assertEqual(QueueSnapshotCache.get_running_prompt_ids(url, ttl=10), ['c'])
+            self.assertEqual(fetch.call_count, 2)
+
+        self.assertLess(time.monotonic() - started, QueueSnapshotCache.REQUEST_TIMEOUT)
+        self.assertIsInstance(self.results['leader'], KeyboardInterrupt)
+        for name, result in self.results.items():
+            if name != 'leader':
+                self.assertIsInstance(result, ConnectionError)
+
+    def test_follower_wait_timeout_raises(self):
+        url = 'http://127.0.0.1:1/queue-slow'
+        with mock.patch.object(QueueSnapshotCache, '__fetch__', side_effect=self.blocking_fetch(['a'])), \
+                mock.patch.object(QueueSnapshotCache, 'REQUEST_TIMEOUT', 0.05):
+            leader = threading.Thread(target=self.call, args=('leader', url))
+            leader.start()
+            self.assertTrue(self.entered.wait(5))
+            with self.assertRaises(TimeoutError):
+                QueueSnapshotCache.get_running_prompt_ids(url, ttl=0)
+            self.release.set()
+            leader.join(5)
+
+        self.assertEqual(self.results['leader'], ['a'])
+
+
+if __name__ == '__main__':
+    unittest.main()
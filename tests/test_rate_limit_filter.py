@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+import time
+import unittest
+
+from klutils.log_handlers import RateLimitFilter
+
+
+def make_record(msg: str, name: str = 'kl.test', level: int = logging.WARNING, **extra) -> logging.LogRecord:
+    record = logging.LogRecord(name, level, __file__, 0, msg, None, None)
+    record.__dict__.update(extra)
+    return record
+
+
+class RateLimitFilterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.summaries = []
+        self.emitted = threading.Event()
+
+    def new_filter(self, **kwargs) -> RateLimitFilter:
+        def emit(record):
+            self.summaries.append(record)
+            self.emitted.set()
+        return RateLimitFilter(emit=emit, **kwargs)
+
+    def test_burst_then_summary(self):
+        rate_filter = self.new_filter(window=60, burst=2)
+        results = [rate_filter.filter(make_record('upload to 10.0.0.{} failed after {}ms'.format(i, i * 7)))
+                   for i in range(10)]
+        # 数字不同的同一条消息算作同一个key
+        self.assertEqual(results, [True, True] + [False] * 8)
+        self.assertEqual(self.summaries, [])
+
+        rate_filter.flush()
+        self.assertEqual(len(self.summaries), 1)
+        summary = self.summaries[0]
+        self.assertEqual((summary.name, summary.levelno), ('kl.test', logging.WARNING))
+        self.assertIn('upload to 10.0.0.9 failed after 63ms', summary.getMessage())
+        self.assertIn('suppressed 8 similar message(s) in 60s', summary.getMessage())
+        # 汇总记录本身不再被限流
+        self.assertTrue(rate_filter.filter(summary))
+
+        # flush后计数清零
+        self.assertTrue(rate_filter.filter(make_record('upload to 10.0.0.1 failed after 1ms')))
+
+    def test_below_level_and_explicit_key(self):
+        rate_filter = self.new_filter(window=60, burst=1)
+        self.assertTrue(all(rate_filter.filter(make_record('same', level=logging.INFO)) for _ in range(5)))
+
+        self.assertTrue(rate_filter.filter(make_record('first text', log_key='k')))
+        self.assertFalse(rate_filter.filter(make_record('other text', log_key='k')))
+        self.assertTrue(rate_filter.filter(make_record('other text')))
+
+    def test_summary_emitted_when_window_ends(self):
+        rate_filter = self.new_filter(window=0.05, burst=1)
+        for _ in range(4):
+            rate_filter.filter(make_record('receiver busy'))
+
+        # 没有后续日志，也由后台线程在窗口结束时输出汇总
+        self.assertTrue(self.emitted.wait(5))
+        self.assertEqual(len(self.summaries), 1)
+        self.assertIn('suppressed 3 similar message(s)', self.summaries[0].getMessage())
+
+        # 新窗口重新计数
+        time.sleep(0.01)
+        self.assertTrue(rate_filter.filter(make_record('receiver busy')))
+
+    def test_rules(self):
+        rate_filter = self.new_filter(window=60, burst=1)
+        rate_filter.set_rule(60, 3, logger_name='kl.noisy')
+        rate_filter.set_rule(0, 0, key='never limited')
+
+        self.assertEqual([rate_filter.filter(make_record('x', name='kl.noisy')) for _ in range(4)],
+                         [True, True, True, False])
+        self.assertTrue(all(rate_filter.filter(make_record('never limited')) for _ in range(5)))
+
+        # 删除规则后回到默认规则
+        rate_filter.set_rule(None, None, logger_name='kl.noisy')
+        self.assertTrue(rate_filter.filter(make_record('y', name='kl.noisy')))
+        self.assertFalse(rate_filter.filter(make_record('y', name='kl.noisy')))
+
+    def test_max_keys_evicts_oldest_with_summary(self):
+        rate_filter = self.new_filter(window=60, burst=1, max_keys=2)
+        for key in ('a', 'a', 'b', 'c'):
+            rate_filter.filter(make_record('message', log_key=key))
+
+        self.assertEqual(len(self.summaries), 1)
+        self.assertIn('suppressed 1 similar message(s)', self.summaries[0].getMessage())
+        # a被淘汰后重新计数
+        self.assertTrue(rate_filter.filter(make_record('message', log_key='a')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+import time
+import unittest
+
+from klutils.transcode_cache import TranscodeCache
+
+ENTRY = 100
+
+
+def data(tag: str) -> bytes:
+    return tag.encode('ascii') * ENTRY
+
+
+class TranscodeCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_dir = tmp_dir.name
+        self.disk_dir = os.path.join(self.tmp_dir, 'cache')
+
+    def test_memory_lru_eviction(self):
+        cache = TranscodeCache(memory_bytes=ENTRY * 2 + 50)
+        cache.put('a', data('a'))
+        cache.put('b', data('b'))
+        self.assertEqual(cache.get('a'), data('a'))
+        cache.put('c', data('c'))
+
+        # b最久未使用，被淘汰
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), data('a'))
+        self.assertEqual(cache.get('c'), data('c'))
+        stats = cache.stats()
+        self.assertEqual((stats['memory_entries'], stats['memory_bytes']), (2, ENTRY * 2))
+        self.assertEqual((stats['memory_hits'], stats['misses']), (3, 1))
+
+    def test_oversized_entry_is_not_cached(self):
+        cache = TranscodeCache(memory_bytes=ENTRY - 1)
+        cache.put('a', data('a'))
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['memory_bytes'], 0)
+
+    def test_disk_hit_promotes_to_memory(self):
+        cache = TranscodeCache(memory_bytes=ENTRY + 50, disk_dir=self.disk_dir, disk_bytes=ENTRY * 10)
+        cache.put('a', data('a'))
+        cache.put('b', data('b'))
+        self.assertEqual(cache.get('a'), data('a'))
+        self.assertEqual(cache.stats()['disk_hits'], 1)
+        self.assertEqual(cache.get('a'), data('a'))
+        self.assertEqual(cache.stats()['memory_hits'], 1)
+
+    def test_disk_lru_eviction_and_reload(self):
+        cache = TranscodeCache(memory_bytes=0, disk_dir=self.disk_dir, disk_bytes=ENTRY * 3)
+        for tag in ('a', 'b', 'c'):
+            cache.put(tag, data(tag))
+            time.sleep(0.01)
+        self.assertEqual(cache.get('a'), data('a'))
+        time.sleep(0.01)
+        cache.put('d', data('d'))
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(sorted(os.listdir(self.disk_dir)), ['a.bin', 'c.bin', 'd.bin'])
+
+        # 重启后按文件修改时间恢复LRU顺序，容量变小时先淘汰最久未使用的
+        reloaded = TranscodeCache(memory_bytes=0, disk_dir=self.disk_dir, disk_bytes=ENTRY * 2)
+        self.assertEqual(reloaded.stats()['disk_entries'], 2)
+        self.assertIsNone(reloaded.get('c'))
+        self.assertEqual(reloaded.get('a'), data('a'))
+        self.assertEqual(reloaded.get('d'), data('d'))
+
+    def test_get_or_create_keys_on_content_and_params(self):
+        src_path = os.path.join(self.tmp_dir, 'a.png')
+        with open(src_path, 'wb') as f:
+            f.write(b'png-1')
+
+        cache = TranscodeCache(memory_bytes=ENTRY * 10)
+        calls = []
+
+        def create() -> bytes:
+            calls.append(1)
+            return data(str(len(calls)))
+
+        self.assertEqual(cache.get_or_create(src_path, 'jpeg', {'quality': 90}, create), data('1'))
+        self.assertEqual(cache.get_or_create(src_path, 'JPEG', {'quality': 90}, create), data('1'))
+        self.assertEqual(cache.get_or_create(src_path, 'jpeg', {'quality': 80}, create), data('2'))
+
+        with open(src_path, 'wb') as f:
+            f.write(b'png-2')
+        self.assertEqual(cache.get_or_create(src_path, 'jpeg', {'quality': 90}, create), data('3'))
+
+        # 源文件不存在时不缓存
+        missing = src_path + '.missing'
+        self.assertEqual(TranscodeCache.make_key(missing, 'jpeg'), '')
+        cache.get_or_create(missing, 'jpeg', None, create)
+        cache.get_or_create(missing, 'jpeg', None, create)
+        self.assertEqual(len(calls), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
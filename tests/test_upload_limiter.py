@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+import unittest
+from unittest import mock
+
+from klutils.upload_limiter import TokenBucket, UploadLimiter
+
+
+class FakeClock:
+    """
+    sleep只推进时间，不真正等待
+    """
+
+    def __init__(self):
+        self.now = 100.0
+        self.slept = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('klutils.upload_limiter.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_passes_without_wait(self):
+        bucket = TokenBucket(rate=1000)
+        self.assertEqual(bucket.consume(1000), 0.0)
+        self.assertEqual(self.clock.slept, [])
+
+    def test_debt_waits_at_rate(self):
+        bucket = TokenBucket(rate=1000)
+        bucket.consume(1000)
+        self.assertAlmostEqual(bucket.consume(500), 0.5)
+        # 超过桶容量的单次消费按平均速率放行
+        self.assertAlmostEqual(bucket.consume(3000), 3.0)
+        self.assertAlmostEqual(sum(self.clock.slept), 3.5)
+
+    def test_refill_is_capped_at_burst(self):
+        bucket = TokenBucket(rate=1000, burst=2000)
+        bucket.consume(2000)
+        self.clock.now += 60
+        self.assertEqual(bucket.consume(2000), 0.0)
+        self.assertAlmostEqual(bucket.consume(1000), 1.0)
+
+    def test_average_rate(self):
+        bucket = TokenBucket(rate=1000)
+        started = self.clock.now
+        for _ in range(20):
+            bucket.consume(500)
+        # 第一秒用掉桶内的令牌，其余按速率发送
+        self.assertAlmostEqual(self.clock.now - started, 20 * 500 / 1000 - 1)
+
+    def test_zero_amount_or_rate_is_free(self):
+        self.assertEqual(TokenBucket(rate=1000).consume(0), 0.0)
+        self.assertEqual(TokenBucket(rate=0, burst=1).consume(10 ** 9), 0.0)
+
+
+class UploadLimiterTest(unittest.TestCase):
+
+    def setUp(self):
+        UploadLimiter.configure(max_concurrency=0, bytes_per_second=0, host_limits={})
+        self.addCleanup(UploadLimiter.configure, max_concurrency=0, bytes_per_second=0, host_limits={})
+
+    def test_max_concurrency(self):
+        UploadLimiter.configure(max_concurrency=2)
+        lock = threading.Lock()
+        state = {'active': 0, 'peak': 0}
+
+        def upload():
+            with UploadLimiter.acquire('http://receiver/cb'):
+                with lock:
+                    state['active'] += 1
+                    state['peak'] = max(state['peak'], state['active'])
+                time.sleep(0.02)
+                with lock:
+                    state['active'] -= 1
+
+        threads = [threading.Thread(target=upload) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(state['peak'], 2)
+
+    def test_host_limit_applies_to_matching_host(self):
+        UploadLimiter.configure(host_limits={'slow.example.com': 1000, 'other.example.com:9100': 1000})
+        clock = FakeClock()
+        with mock.patch('klutils.upload_limiter.time', clock):
+            with UploadLimiter.acquire('http://Slow.Example.com/cb') as permit:
+                permit.throttle(3000)
+            self.assertAlmostEqual(permit.throttle_wait, 2.0)
+            self.assertEqual(permit.bytes_sent, 3000)
+
+            with UploadLimiter.acquire('http://fast.example.com/cb') as permit:
+                permit.throttle(10 ** 6)
+            self.assertEqual(permit.throttle_wait, 0.0)
+
+            with UploadLimiter.acquire('http://other.example.com:9100/cb') as permit:
+                permit.throttle(2000)
+            self.assertAlmostEqual(permit.throttle_wait, 1.0)
+
+    def test_host_limits_from_env(self):
+        limits = UploadLimiter.__parse_host_limits__(' a.example.com=100 , b:9100=200,bad=x,c=0')
+        self.assertEqual(limits, {'a.example.com': 100, 'b:9100': 200})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""
+回调接收端的参考实现，只依赖标准库，用于本地联调和测试：
+
+    python tools/reference_receiver.py --port 9100 --output ./received
+
+支持：
+- 普通回调：multipart/form-data POST，文件保存到 <output>/<promptId>/
+- 分片续传（见 klutils/chunked_upload.py）：GET 查询进度、PUT 上传分片、POST complete 拼装
+- 内容去重（见 klutils/dedup_util.py）：GET ?kl_check= 查询是否持有某个sha1的内容，
+  收到的文件按sha1另存到 <output>/.objects/，表单中只有 <字段>_sha1 引用的文件从这里复制
+- 按地址上传（upload_mode=reference）：表单中 <字段>_url 指向的文件由接收端下载，支持断点续传（Range）
+- --fail-every N：每N个分片请求返回一次503，用于验证续传
+"""
+import argparse
+import email.parser
+import email.policy
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+UPLOAD_ID_PATTERN = re.compile(r'^[0-9a-f]{8,64}$')
+FIELD_PATTERN = re.compile(r'^[A-Za-z0-9_\-]{1,64}$')
+SHA1_PATTERN = re.compile(r'^[0-9a-f]{40}$')
+
+
+class ReceiverState:
+
+    def __init__(self, output_dir: str, fail_every: int = 0):
+        self.output_dir = os.path.abspath(output_dir)
+        self.uploads_dir = os.path.join(self.output_dir, '.uploads')
+        self.objects_dir = os.path.join(self.output_dir, '.objects')
+        self.fail_every = fail_every
+        self.part_requests = 0
+        self.lock = threading.Lock()
+        os.makedirs(self.uploads_dir, exist_ok=True)
+        os.makedirs(self.objects_dir, exist_ok=True)
+
+    def should_fail(self) -> bool:
+        with self.lock:
+            self.part_requests += 1
+            return self.fail_every > 0 and self.part_requests % self.fail_every == 0
+
+
+class ReceiverHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    state: ReceiverState = None
+
+    # ---------- 分片续传 / 内容查询 ----------
+    def do_GET(self):
+        check = self.__get_query__().get('kl_check')
+        if check is not None:
+            hashes = [h for h in check.lower().split(',') if SHA1_PATTERN.match(h)]
+            return self.__reply__(200, {'exists': {
+                h: os.path.isfile(os.path.join(self.state.objects_dir, h)) for h in hashes
+            }})
+
+        upload_id = self.__get_upload_id__()
+        if upload_id is None:
+            return self.__reply__(400, {'error': 'missing or invalid kl_upload'})
+
+        upload_dir = os.path.join(self.state.uploads_dir, upload_id)
+        if not os.path.isdir(upload_dir):
+            return self.__reply__(404, {'parts': {}})
+
+        parts = {}
+        for name in os.listdir(upload_dir):
+            field, _, index = name.rpartition('.')
+            if field and index.isdigit():
+                parts.setdefault(field, []).append(int(index))
+        return self.__reply__(200, {'parts': {k: sorted(v) for k, v in parts.items()}})
+
+    def do_PUT(self):
+        upload_id = self.__get_upload_id__()
+        query = self.__get_query__()
+        field = query.get('field', '')
+        part = query.get('part', '')
+        body = self.__read_body__()
+        if upload_id is None or not FIELD_PATTERN.match(field) or not part.isdigit():
+            return self.__reply__(400, {'error': 'invalid part request'})
+
+        if self.state.should_fail():
+            return self.__reply__(503, {'error': 'injected failure'})
+
+        expected = self.headers.get('X-KL-Part-SHA256', '')
+        if expected and hashlib.sha256(body).hexdigest() != expected.lower():
+            return self.__reply__(422, {'error': 'checksum mismatch'})
+
+        upload_dir = os.path.join(self.state.uploads_dir, upload_id)
+        os.makedirs(upload_dir, exist_ok=True)
+        part_path = os.path.join(upload_dir, '{}.{}'.format(field, int(part)))
+        with open(part_path + '.tmp', 'wb') as f:
+            f.write(body)
+        os.replace(part_path + '.tmp', part_path)
+        return self.__reply__(200, {'received': int(part)})
+
+    # ---------- 普通回调 / 完成分片上传 ----------
+    def do_POST(self):
+        fields, files = self.__parse_form__(self.__read_body__())
+        prompt_id = re.sub(r'[^A-Za-z0-9_\-]', '_', fields.get('promptId', '')) or 'unknown'
+        target_dir = os.path.join(self.state.output_dir, prompt_id)
+        os.makedirs(target_dir, exist_ok=True)
+
+        upload_id = self.__get_upload_id__()
+        if upload_id is not None and self.__get_query__().get('complete'):
+            return self.__complete__(upload_id, fields, target_dir)
+
+        saved = {}
+        for field, (filename, data) in files.items():
+            path = os.path.join(target_dir, os.path.basename(filename or field))
+            with open(path, 'wb') as f:
+                f.write(data)
+            self.__store_object__(path)
+            saved[field] = {'path': path, 'size': len(data)}
+
+        missing = self.__resolve_references__(fields, saved, target_dir)
+        if missing:
+            return self.__reply__(409, {'error': 'unknown content', 'fields': missing})
+
+        failed = self.__fetch_urls__(fields, saved, target_dir)
+        if failed:
+            return self.__reply__(502, {'error': 'download failed', 'fields': failed})
+
+        self.log_message('callback promptId=%s files=%s', prompt_id, json.dumps(saved))
+        return self.__reply__(200, {'files': saved})
+
+    def __complete__(self, upload_id: str, fields: dict, target_dir: str):
+        try:
+            manifest = json.loads(fields.get('manifest', '{}'))
+        except ValueError:
+            return self.__reply__(400, {'error': 'invalid manifest'})
+
+        upload_dir = os.path.join(self.state.uploads_dir, upload_id)
+        saved = {}
+        for field, info in manifest.items():
+            if not FIELD_PATTERN.match(field):
+                return self.__reply__(400, {'error': 'invalid field'})
+            part_paths = [os.path.join(upload_dir, '{}.{}'.format(field, i)) for i in range(int(info['parts']))]
+            missing = [i for i, p in enumerate(part_paths) if not os.path.isfile(p)]
+            if missing:
+                return self.__reply__(409, {'error': 'missing parts', 'field': field, 'parts': missing})
+
+            path = os.path.join(target_dir, os.path.basename(info.get('filename') or field))
+            with open(path, 'wb') as out:
+                for part_path in part_paths:
+                    with open(part_path, 'rb') as f:
+                        shutil.copyfileobj(f, out)
+            if os.path.getsize(path) != int(info['size']):
+                return self.__reply__(422, {'error': 'size mismatch', 'field': field})
+            self.__store_object__(path)
+            saved[field] = {'path': path, 'size': int(info['size'])}
+
+        missing = self.__resolve_references__(fields, saved, target_dir)
+        if missing:
+            return self.__reply__(409, {'error': 'unknown content', 'fields': missing})
+
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        self.log_message('chunked callback promptId=%s files=%s', fields.get('promptId', ''), json.dumps(saved))
+        return self.__reply__(200, {'files': saved})
+
+    # ---------- 内容去重 ----------
+    def __store_object__(self, path: str):
+        sha1obj = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha1obj.update(chunk)
+        object_path = os.path.join(self.state.objects_dir, sha1obj.hexdigest())
+        if not os.path.isfile(object_path):
+            shutil.copyfile(path, object_path + '.tmp')
+            os.replace(object_path + '.tmp', object_path)
+
+    def __resolve_references__(self, fields: dict, saved: dict, target_dir: str) -> list:
+        """
+        处理只带 <字段>_sha1 引用、没有附带文件内容的字段
+        :return: 接收端找不到内容的字段名
+        """
+        missing = []
+        for key, value in fields.items():
+            if not key.endswith('_sha1'):
+                continue
+            field = key[:-len('_sha1')]
+            if field in saved:
+                continue
+
+            object_path = os.path.join(self.state.objects_dir, value.lower())
+            if not SHA1_PATTERN.match(value.lower()) or not os.path.isfile(object_path):
+                missing.append(field)
+                continue
+
+            path = os.path.join(target_dir, os.path.basename(fields.get(field + '_filename') or field))
+            shutil.copyfile(object_path, path)
+            saved[field] = {'path': path, 'size': os.path.getsize(path), 'reference': value.lower()}
+        return missing
+
+    # ---------- 按地址上传 ----------
+    def __fetch_urls__(self, fields: dict, saved: dict, target_dir: str) -> list:
+        """
+        下载 <字段>_url 指向的文件；已有部分内容时用Range续传
+        :return: 下载失败的字段名
+        """
+        failed = []
+        for key, url in fields.items():
+            if not key.endswith('_url'):
+                continue
+            field = key[:-len('_url')]
+            path = os.path.join(target_dir, os.path.basename(fields.get(field + '_filename') or field))
+            expected = int(fields.get(field + '_size') or -1)
+            if os.path.isfile(path) and os.path.getsize(path) > expected >= 0:
+                os.remove(path)
+            try:
+                for _ in range(3):
+                    offset = os.path.getsize(path) if os.path.isfile(path) else 0
+                    if offset == expected:
+                        break
+                    headers = {'Range': 'bytes={}-'.format(offset)} if offset else {}
+                    request = urllib.request.Request(url, headers=headers)
+                    with urllib.request.urlopen(request, timeout=60) as response, \
+                            open(path, 'ab' if response.status == 206 else 'wb') as out:
+                        shutil.copyfileobj(response, out)
+            except (urllib.error.URLError, OSError) as e:
+                self.log_message('download %s failed: %s', url, e)
+
+            if not os.path.isfile(path) or (expected >= 0 and os.path.getsize(path) != expected):
+                failed.append(field)
+                continue
+            self.__store_object__(path)
+            saved[field] = {'path': path, 'size': os.path.getsize(path), 'url': url}
+        return failed
+
+    # ---------- 工具方法 ----------
+    def __get_query__(self) -> dict:
+        return {k: v[-1] for k, v in parse_qs(urlparse(self.path).query).items()}
+
+    def __get_upload_id__(self):
+        upload_id = self.__get_query__().get('kl_upload')
+        return upload_id if upload_id and UPLOAD_ID_PATTERN.match(upload_id) else None
+
+    def __read_body__(self) -> bytes:
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def __parse_form__(self, body: bytes):
+        content_type = self.headers.get('Content-Type', '')
+        fields, files = {}, {}
+        if content_type.startswith('application/x-www-form-urlencoded'):
+            for key, values in parse_qs(body.decode('utf-8')).items():
+                fields[key] = values[-1]
+            return fields, files
+
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            'Content-Type: {}\r\n\r\n'.format(content_type).encode('utf-8') + body
+        )
+        if not message.is_multipart():
+            return fields, files
+
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            payload = part.get_payload(decode=True) or b''
+            if part.get_filename() is not None:
+                files[name] = (part.get_filename(), payload)
+            else:
+                fields[name] = payload.decode('utf-8')
+        return fields, files
+
+    def __reply__(self, status: int, document: dict):
+        body = json.dumps(document).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='reference callback receiver')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--output', default='./received')
+    parser.add_argument('--fail-every', type=int, default=0, help='return 503 for every Nth part request')
+    args = parser.parse_args()
+
+    ReceiverHandler.state = ReceiverState(args.output, args.fail_every)
+    server = ThreadingHTTPServer((args.host, args.port), ReceiverHandler)
+    print('reference receiver listening on http://{}:{}/, saving to {}'.format(
+        args.host, args.port, ReceiverHandler.state.output_dir))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()